@@ -17,7 +17,9 @@ It could be used in an environment similar to the one which
 ``hil.cfg.dev*``
 """
 
+import json
 from subprocess import check_call
+from tempfile import NamedTemporaryFile
 
 N_NODES = 6
 
@@ -27,25 +29,33 @@ switch = "mock01"
 obmd_base_uri = 'http://obmd.example.com/nodes/'
 obmd_admin_token = 'secret'
 
-
-def hil(*args):
-    """Convenience function that calls the hil command line tool with
-    the given arguments.
-    """
-    args = map(str, args)
-    print args
-    check_call(['hil'] + args)
-
-
-hil('switch', 'register', switch, 'mock', 'ip', 'user', 'pass')
-
-for node in range(N_NODES):
-    nic_port = "gi1/0/%d" % (node)
-    nic_name = 'nic1'
-    hil('node', 'register',
-        node,
-        obmd_base_uri + str(node),
-        obmd_admin_token)
-    hil('node', 'nic', 'register', node, nic_name, 'FillThisInLater')
-    hil('port', 'register', switch, nic_port)
-    hil('port', 'nic', 'add', switch, nic_port, node, nic_name)
+# Rather than registering each object with a separate call to the hil
+# command line tool, describe the whole layout, and register it all at
+# once with ``hil-admin import-layout`` (see ``hil/layout.py``):
+layout = {
+    'switches': [{
+        'switch': switch,
+        'type': 'http://schema.massopencloud.org/haas/v0/switches/mock',
+        'hostname': 'ip',
+        'username': 'user',
+        'password': 'pass',
+    }],
+    'nodes': [{
+        'name': str(node),
+        'obmd': {
+            'uri': obmd_base_uri + str(node),
+            'admin_token': obmd_admin_token,
+        },
+        'nics': [{
+            'name': 'nic1',
+            'mac': 'FillThisInLater',
+            'switch': switch,
+            'port': "gi1/0/%d" % (node),
+        }],
+    } for node in range(N_NODES)],
+}
+
+with NamedTemporaryFile(suffix='.json') as layout_file:
+    json.dump(layout, layout_file)
+    layout_file.flush()
+    check_call(['hil-admin', 'import-layout', layout_file.name])
@@ -8,7 +8,6 @@ config file and status file format in
 README file.
 """
 
-import time
 import ConfigParser
 
 from hil.client.client import Client, RequestsHTTPClient
@@ -63,39 +62,35 @@ def release_from_project(
 
     node_info = hil_client.node.show(node)
 
+    status_ids = []
     for nic in node_info['nics']:
         port = nic['port']
         switch = nic['switch']
         if port and switch:
             try:
-                hil_client.port.port_revert(switch, port)
+                response = hil_client.port.port_revert(switch, port)
+                status_ids.append(response['status_id'])
                 print('Removed all networks from node `%s`' % node)
             except FailedAPICallException:
                 print('Failed to revert port `%s` on node \
                         `%s` switch `%s`' % (port, node, switch))
                 raise HILClientFailure()
 
-    time.sleep(5)
-    # tries 2 times to detach the project because there might be a pending
-    # networking action setup (revert port in the previous step).
-    for counter in range(2):
-        try:
-            hil_client.project.detach(project, node)
-            print('Node `%s` removed from project `%s`' % (node, project))
-            return
-        except FailedAPICallException as ex:
-            if ex.message == 'Node has pending network actions':
-                print('Removing node %s from project `%s` failed: \
-                        %d try' % (node, project, counter + 1))
-                time.sleep(2)
-            else:
-                print('HIL reservation failure: Unable to \
-                        detach node `%s` from project `%s`' % (node, project))
-                raise HILClientFailure(ex.message)
-
-    print('HIL reservation failure: Unable to detach node \
-            `%s` from project `%s`' % (node, project))
-    raise HILClientFailure()
+    # The node can't be detached while the reverts are pending:
+    if status_ids:
+        result = hil_client.node.wait_for_actions(status_ids, timeout=60)
+        if result['status'] != 'DONE':
+            print('Reverting the ports of node `%s` did not finish: %s' %
+                  (node, result['status']))
+            raise HILClientFailure()
+
+    try:
+        hil_client.project.detach(project, node)
+        print('Node `%s` removed from project `%s`' % (node, project))
+    except FailedAPICallException as ex:
+        print('HIL reservation failure: Unable to \
+                detach node `%s` from project `%s`' % (node, project))
+        raise HILClientFailure(ex.message)
 
 
 def update_file(statusfile, nodes):
@@ -122,7 +117,13 @@ def release_nodes(
     or removes the node from the project.
     """
 
-    free_node_list = hil_client.node.list('free')
+    # Fetch the project of every node in one call, rather than one per node:
+    projects_in_hil = dict(
+        (info['name'], info['project'])
+        for info in hil_client.node.list_details(
+            'all', fields=['name', 'project']))
+    free_node_list = [node for node, project in projects_in_hil.items()
+                      if project is None]
     # Only these nodes should be updated in
     # the file(either for project or for time)
     nodes_to_update = list(set(
@@ -139,8 +140,7 @@ def release_nodes(
         project = nodes[node]['project']
         time = nodes[node]['time']
 
-        node_current_info = hil_client.node.show(node)
-        project_in_hil = node_current_info['project']
+        project_in_hil = projects_in_hil[node]
         new_time = int(time)+1
         # Just update the time for the nodes which have been in
         # the project for less than the threshold
@@ -4,13 +4,15 @@ TODO: Spec out and document what sanitization is required.
 """
 import json
 import requests
+import time
 import uuid
 import flask
 
-from schema import Schema, And, Optional, SchemaError
+from collections import namedtuple
+from schema import Schema, And, Or, Optional, SchemaError, Use
 from urlparse import urlparse
 
-from hil import model, errors
+from hil import model, errors, layout, metrics, obmd
 from hil.model import db
 from hil.auth import get_auth_backend
 from hil.config import cfg
@@ -19,21 +21,53 @@ from hil.class_resolver import concrete_class_for
 from hil.network_allocator import get_network_allocator
 import logging
 
+# Imported for its side effects: it wakes up the network daemon when
+# networking actions are queued.
+from hil import notify  # pylint: disable=unused-import
+
+
+def list_schema(fields=None):
+    """Return the schema for a call which lists objects by label.
+
+    Besides ``fields`` (a dict, as for `Schema`), the call accepts these
+    optional query parameters, which it should pass on to `list_response`:
+
+    * ``limit``, the maximum number of results to return.
+    * ``after``, a label; only results with labels after it are returned.
+      Passing the last label of one page gets the next one.
+    * ``prefix``, only results with labels starting with this are returned.
+    * ``stream``, "true" to send the response incrementally, rather than
+      building it all in memory first.
+    """
+    schema = {
+        Optional('limit'): And(Use(int), lambda limit: limit > 0),
+        Optional('after'): basestring,
+        Optional('prefix'): basestring,
+        Optional('stream'): And(Or('true', 'false'),
+                                Use(lambda stream: stream == 'true')),
+    }
+    schema.update(fields or {})
+    return Schema(schema)
+
 
 # Project Code #
 ################
-@rest_call('GET', '/projects', Schema({}))
-def list_projects():
+@rest_call('GET', '/projects', list_schema())
+def list_projects(limit=None, after=None, prefix=None, stream=False):
     """List all projects.
 
     Returns a JSON array of strings representing a list of projects.
 
     Example:  '["project1", "project2", "project3"]'
+
+    See `list_schema` for the optional arguments.
     """
     get_auth_backend().require_admin()
-    projects = model.Project.query.all()
-    projects = sorted([p.label for p in projects])
-    return json.dumps(projects)
+    return list_response(db.session.query(model.Project.label),
+                         model.Project.label,
+                         lambda project: project.label,
+                         limit=limit, after=after, prefix=prefix,
+                         stream=stream)
 
 
 @rest_call('PUT', '/project/<project>', Schema({'project': basestring}))
@@ -121,8 +155,7 @@ def project_detach_node(project, node):
     if num_attachments != 0:
         raise errors.BlockedError("Node attached to a network")
     for nic in node.nics:
-        if nic.current_action is not None and \
-           nic.current_action.status == 'PENDING':
+        if nic.has_pending_action():
             raise errors.BlockedError("Node has pending network actions")
 
     project.nodes.remove(node)
@@ -310,6 +343,79 @@ def node_power_status(node):
     return _obmd_redirect(node, '/power_status')
 
 
+# The OBMd request for each operation of `node_power_batch`:
+_POWER_BATCH_REQUESTS = {
+    'on': ('POST', '/power_on'),
+    'off': ('POST', '/power_off'),
+    'cycle': ('POST', '/power_cycle'),
+    'status': ('GET', '/power_status'),
+}
+
+
+@rest_call('POST', '/node_power_batch', Schema({
+    'op': Or('on', 'off', 'cycle', 'status'),
+    Optional('nodes'): [basestring],
+    Optional('project'): basestring,
+    Optional('force'): bool,
+}))
+def node_power_batch(op, nodes=None, project=None, force=False):
+    """Perform a power operation on many nodes at once.
+
+    ``op`` is 'on', 'off', 'cycle' or 'status'. The nodes are either those
+    listed in ``nodes``, or all of the nodes in ``project``; exactly one of
+    these must be given. ``force`` is as for `node_power_cycle`.
+
+    Rather than redirecting the client to OBMd once per node, HIL makes the
+    requests itself, concurrently (see `hil.obmd.fan_out`), and returns the
+    results for every node together. A failure on one node doesn't affect
+    the others.
+    """
+    auth_backend = get_auth_backend()
+    if (nodes is None) == (project is None):
+        raise errors.BadArgumentError(
+            'Exactly one of "nodes" and "project" must be given.')
+    if force and op != 'cycle':
+        raise errors.BadArgumentError(
+            '"force" may only be given for the "cycle" operation.')
+
+    if project is not None:
+        project = get_or_404(model.Project, project)
+        auth_backend.require_project_access(project)
+        node_objs = project.nodes
+    else:
+        node_objs = list(model.query_in(
+            model.Node.query.options(db.joinedload('project')),
+            model.Node.label, set(nodes)))
+        missing = set(nodes) - set(node.label for node in node_objs)
+        if missing:
+            raise errors.NotFoundError(
+                'Node(s) %s not found' % ', '.join(sorted(missing)))
+        for node_project in set(node.project for node in node_objs):
+            auth_backend.require_project_access(node_project)
+
+    targets = [obmd.NodeTarget.for_node(node) for node in node_objs]
+    # Don't hold a transaction open while we wait for OBMd:
+    db.session.commit()
+    method, path = _POWER_BATCH_REQUESTS[op]
+    results = obmd.fan_out(targets, method, path,
+                           body={'force': force} if op == 'cycle' else None)
+
+    response = {}
+    for label, result in results.items():
+        node_result = {'ok': result['ok'],
+                       'status_code': result['status_code']}
+        if result['error'] is not None:
+            node_result['error'] = result['error']
+        if op == 'status' and isinstance(result['body'], dict):
+            node_result['power_status'] = result['body'].get('power_status')
+        response[label] = node_result
+    ok = sum(1 for result in response.values() if result['ok'])
+    return json.dumps({
+        'counts': {'ok': ok, 'failed': len(response) - ok},
+        'nodes': response,
+    })
+
+
 @rest_call('DELETE', '/node/<node>', Schema({'node': basestring}))
 def node_delete(node):
     """Delete node.
@@ -365,8 +471,8 @@ def node_delete_nic(node, nic):
     if node.project:
         raise errors.BlockedError("Nic is on a node that belongs to a project."
                                   " Remove node from project and try again")
-    if nic.current_action:
-        db.session.delete(nic.current_action)
+    for action in nic.actions:
+        db.session.delete(action)
     db.session.delete(nic)
     db.session.commit()
 
@@ -390,47 +496,115 @@ def node_connect_network(node, nic, network, channel=None):
 
     Raises BadArgumentError if the channel is invalid for the network.
     """
+    auth_backend = get_auth_backend()
+
+    node = get_or_404(model.Node, node)
+    nic = get_child_or_404(node, model.Nic, nic)
+    network = get_or_404(model.Network, network)
+
+    if not node.project:
+        raise errors.ProjectMismatchError("Node not in project")
+    auth_backend.require_project_access(node.project)
+
+    action = _connect_action(nic, network, channel)
+    db.session.add(action)
+    db.session.commit()
+    return json.dumps({'status_id': action.uuid}), 202
+
+
+@rest_call('POST', '/node/<node>/nic/<nic>/detach_network', Schema({
+    'node': basestring, 'nic': basestring, 'network': basestring,
+}))
+def node_detach_network(node, nic, network):
+    """Detach network ``network`` from physical nic ``nic``.
+
+    Raises ProjectMismatchError if the node is not in a project.
 
-    def _have_attachment(nic, query):
-        """Return if there are any attachments matching ``query`` for ``nic``.
+    Raises BlockedError if there is already a pending network action.
 
-        ``query`` should an argument suitable to pass to db.query(...).filter
-        """
-        return model.NetworkAttachment.query.filter(
-            model.NetworkAttachment.nic == nic,
-            query,
-        ).first() is not None
+    Raises BadArgumentError if the network is not attached to the nic.
+    """
     auth_backend = get_auth_backend()
 
     node = get_or_404(model.Node, node)
-    nic = get_child_or_404(node, model.Nic, nic)
     network = get_or_404(model.Network, network)
+    nic = get_child_or_404(node, model.Nic, nic)
 
     if not node.project:
         raise errors.ProjectMismatchError("Node not in project")
     auth_backend.require_project_access(node.project)
 
-    project = node.project
+    action = _detach_action(nic, network)
+    db.session.add(action)
+    db.session.commit()
+    return json.dumps({'status_id': action.uuid}), 202
+
+
+class _PlannedAttachment(namedtuple('_PlannedAttachment',
+                                    ['channel', 'network_id'])):
+    """An attachment which a nic will have once the actions queued so far in
+    a batch have been applied; see `_PlannedNic`."""
+
+
+class _PlannedNic(object):
+    """A stand-in for a nic, with the attachments it will have once the
+    actions queued so far in a batch have been applied.
 
+    This is passed to `Switch.ensure_legal_operation` when checking the later
+    actions on a nic in `networking_action_batch`, so that (for example) a
+    batch may attach a native network and then trunked ones. All other
+    attributes are those of the nic.
+    """
+
+    def __init__(self, nic, attachments):
+        self._nic = nic
+        self.attachments = attachments
+
+    def __getattr__(self, name):
+        return getattr(self._nic, name)
+
+
+def _connect_action(nic, network, channel, attachments=None):
+    """Check that ``network`` may be connected to ``nic`` on ``channel``.
+
+    This does the checks for `node_connect_network`, other than those on
+    the node and the caller's access to it. Returns the NetworkingAction to
+    queue; raises an APIError if the network can't be connected.
+
+    If ``attachments`` is given, it is a list of `_PlannedAttachment`s to
+    check against instead of the nic's current attachments, and the nic is
+    not checked for pending actions; see `networking_action_batch`.
+
+    ``nic.port.owner``, ``nic.actions``, ``nic.attachments`` and
+    ``network.access`` are used, so callers checking many nics at once can
+    eager-load them.
+    """
+    project = nic.owner.project
     allocator = get_network_allocator()
 
     if nic.port is None:
         raise errors.NotFoundError("No port is connected to given nic.")
 
-    check_pending_action(nic)
+    if attachments is None:
+        check_pending_action(nic)
+        checked_nic = nic
+    else:
+        checked_nic = _PlannedNic(nic, attachments)
 
     if (network.access) and (project not in network.access):
         raise errors.ProjectMismatchError(
             "Project does not have access to given network.")
 
-    if _have_attachment(nic, model.NetworkAttachment.network == network):
+    if any(attachment.network_id == network.id
+           for attachment in checked_nic.attachments):
         raise errors.BlockedError(
             "The network is already attached to the nic.")
 
     if channel is None:
         channel = allocator.get_default_channel()
 
-    if _have_attachment(nic, model.NetworkAttachment.channel == channel):
+    if any(attachment.channel == channel
+           for attachment in checked_nic.attachments):
         raise errors.BlockedError("The channel is already in use on the nic.")
 
     if not allocator.is_legal_channel_for(channel, network.network_id):
@@ -438,62 +612,171 @@ def node_connect_network(node, nic, network, channel=None):
             "Channel %r, is not legal for this network." % channel)
 
     switch = nic.port.owner
-    switch.ensure_legal_operation(nic, 'connect', channel)
-
-    unique_id = str(uuid.uuid4())
-    db.session.add(model.NetworkingAction(type='modify_port',
-                                          nic=nic,
-                                          new_network=network,
-                                          channel=channel,
-                                          uuid=unique_id,
-                                          status='PENDING'))
-    db.session.commit()
-    return json.dumps({'status_id': unique_id}), 202
-
+    switch.ensure_legal_operation(checked_nic, 'connect', channel)
 
-@rest_call('POST', '/node/<node>/nic/<nic>/detach_network', Schema({
-    'node': basestring, 'nic': basestring, 'network': basestring,
-}))
-def node_detach_network(node, nic, network):
-    """Detach network ``network`` from physical nic ``nic``.
+    return model.NetworkingAction(type='modify_port',
+                                  nic=nic,
+                                  new_network=network,
+                                  channel=channel,
+                                  uuid=str(uuid.uuid4()),
+                                  status='PENDING')
 
-    Raises ProjectMismatchError if the node is not in a project.
 
-    Raises BlockedError if there is already a pending network action.
+def _detach_action(nic, network, attachments=None):
+    """Check that ``network`` may be detached from ``nic``.
 
-    Raises BadArgumentError if the network is not attached to the nic.
+    This is the `node_detach_network` counterpart of `_connect_action`.
     """
-    auth_backend = get_auth_backend()
-
-    node = get_or_404(model.Node, node)
-    network = get_or_404(model.Network, network)
-    nic = get_child_or_404(node, model.Nic, nic)
-
-    if not node.project:
-        raise errors.ProjectMismatchError("Node not in project")
-    auth_backend.require_project_access(node.project)
-
-    check_pending_action(nic)
+    if attachments is None:
+        check_pending_action(nic)
+        checked_nic = nic
+    else:
+        checked_nic = _PlannedNic(nic, attachments)
 
-    attachment = model.NetworkAttachment.query \
-        .filter_by(nic=nic, network=network).one_or_none()
-    if attachment is None:
+    for attachment in checked_nic.attachments:
+        if attachment.network_id == network.id:
+            break
+    else:
         raise errors.BadArgumentError(
             "The network is not attached to the nic.")
 
     switch = nic.port.owner
-    switch.ensure_legal_operation(nic, 'detach', attachment.channel)
+    switch.ensure_legal_operation(checked_nic, 'detach', attachment.channel)
+
+    return model.NetworkingAction(type='modify_port',
+                                  nic=nic,
+                                  channel=attachment.channel,
+                                  uuid=str(uuid.uuid4()),
+                                  status='PENDING',
+                                  new_network=None)
+
+
+@rest_call('POST', '/networking_action_batch', Schema({
+    'actions': [{
+        Optional('op'): Or('connect', 'detach'),
+        'node': basestring,
+        'nic': basestring,
+        'network': basestring,
+        Optional('channel'): basestring,
+    }],
+}))
+def networking_action_batch(actions):
+    """Queue many connect/detach operations at once.
+
+    Each item of ``actions`` has the arguments of `node_connect_network`
+    (if its ``op`` is 'connect', the default) or `node_detach_network` (if
+    it is 'detach'), plus the node and nic.
+
+    The objects involved are looked up with a few queries for the whole batch,
+    rather than per action, and the actions are all queued in a single
+    transaction; this also lets the network daemon claim them together
+    (see ``batch_size`` in `deferred.apply_networking`). Either every
+    action is queued, or (if any of them fails its checks) none are, and a
+    NetworkingBatchError listing the problems is raised.
+
+    Several actions may be given for the same nic (e.g. attaching a native
+    network and then trunked ones). They are applied in the order given, and
+    each is checked as if the ones before it had already been applied. The
+    network daemon hands consecutive actions on the same nic to the switch
+    together, where the switch supports it (see
+    `deferred.DaemonSession.handle_actions`).
+
+    Returns the id of the batch (see `show_networking_action_batch`), and
+    the status ids of the actions, in order. There must be at least one
+    action; an empty batch has no status to show.
+    """
+    if not actions:
+        raise errors.BadArgumentError('No actions were given.')
 
-    unique_id = str(uuid.uuid4())
-    db.session.add(model.NetworkingAction(type='modify_port',
-                                          nic=nic,
-                                          channel=attachment.channel,
-                                          uuid=unique_id,
-                                          status='PENDING',
-                                          new_network=None))
+    auth_backend = get_auth_backend()
 
+    node_labels = set(action['node'] for action in actions)
+    existing_nodes = set(label for (label,) in model.query_in(
+        db.session.query(model.Node.label), model.Node.label, node_labels))
+    nics = {}
+    for nic in model.query_in(
+            model.Nic.query.join(model.Node, model.Nic.owner)
+            .options(db.contains_eager(model.Nic.owner)
+                     .joinedload('project'),
+                     db.joinedload('port').joinedload('owner'),
+                     db.selectinload('actions'),
+                     db.selectinload('attachments')),
+            model.Node.label, node_labels):
+        nics[(nic.owner.label, nic.label)] = nic
+    networks = dict((network.label, network) for network in model.query_in(
+        model.Network.query.options(db.selectinload('access')),
+        model.Network.label, set(action['network'] for action in actions)))
+
+    # Check access once per project, before saying anything about the
+    # objects in it:
+    projects = set(nic.owner.project for nic in nics.values())
+    for project in projects:
+        if project is not None:
+            auth_backend.require_project_access(project)
+
+    problems = []
+    queued = []
+    # For each nic with actions in the batch so far, the attachments it will
+    # have once they've been applied:
+    planned = {}
+    batch_id = str(uuid.uuid4())
+    with db.session.no_autoflush:
+        for i, item in enumerate(actions):
+            where = 'actions[%d] (%s %s)' % (i, item['node'], item['nic'])
+            op = item.get('op', 'connect')
+            nic = nics.get((item['node'], item['nic']))
+            network = networks.get(item['network'])
+            if item['node'] not in existing_nodes:
+                problems.append('%s: node does not exist' % where)
+            elif nic is None:
+                problems.append('%s: nic does not exist' % where)
+            elif network is None:
+                problems.append('%s: network %s does not exist' %
+                                (where, item['network']))
+            elif nic.owner.project is None:
+                problems.append('%s: node not in project' % where)
+            elif op == 'detach' and 'channel' in item:
+                problems.append('%s: a channel may only be given when '
+                                'connecting' % where)
+            else:
+                try:
+                    if nic.id not in planned:
+                        check_pending_action(nic)
+                        planned[nic.id] = [
+                            _PlannedAttachment(attachment.channel,
+                                               attachment.network_id)
+                            for attachment in nic.attachments]
+                    attachments = planned[nic.id]
+                    if op == 'connect':
+                        action = _connect_action(nic, network,
+                                                 item.get('channel'),
+                                                 attachments)
+                        attachments.append(
+                            _PlannedAttachment(action.channel, network.id))
+                    else:
+                        action = _detach_action(nic, network, attachments)
+                        attachments[:] = [
+                            attachment for attachment in attachments
+                            if attachment.network_id != network.id]
+                except errors.APIError as e:
+                    problems.append('%s: %s' % (where, e.message))
+                    continue
+                action.batch_id = batch_id
+                queued.append(action)
+
+    if problems:
+        # The actions are already in the session, via their nics:
+        db.session.rollback()
+        raise errors.NetworkingBatchError(problems)
+
+    db.session.add_all(queued)
+    # Read these before the commit expires the actions:
+    status_ids = [action.uuid for action in queued]
     db.session.commit()
-    return json.dumps({'status_id': unique_id}), 202
+    return json.dumps({
+        'batch_id': batch_id,
+        'status_ids': status_ids,
+    }), 202
 
 
 @rest_call('PUT', '/node/<node>/metadata/<label>', Schema({
@@ -723,26 +1006,39 @@ def headnode_detach_network(headnode, hnic):
 # Network Code #
 ################
 
-@rest_call('GET', '/networks', Schema({}))
-def list_networks():
-    """Lists all networks"""
-    result = {}
+@rest_call('GET', '/networks', list_schema())
+def list_networks(limit=None, after=None, prefix=None, stream=False):
+    """Lists all networks
+
+    See `list_schema` for the optional arguments.
+    """
+    query = db.session.query(model.Network) \
+        .options(db.selectinload('access'))
     # Admin Operation
-    if get_auth_backend().have_admin():
-        networks = db.session.query(model.Network).all()
-    else:
-        networks = db.session.query(model.Network).filter_by(access=None).all()
+    if not get_auth_backend().have_admin():
+        query = query.filter_by(access=None)
 
-    for n in networks:
+    def network_info(n):
+        """Return the entry for ``n`` in the result."""
         if n.access:
             projects = sorted([p.label for p in n.access])
-            result[n.label] = {'network_id': n.network_id,
-                               'projects': projects}
         else:
-            result[n.label] = {'network_id': n.network_id,
-                               'projects': None}
+            projects = None
+        return n.label, {'network_id': n.network_id, 'projects': projects}
+
+    return list_response(query, model.Network.label, network_info,
+                         keyed=True, limit=limit, after=after, prefix=prefix,
+                         stream=stream)
 
-    return json.dumps(result, sort_keys=True)
+
+# Load a network's projects and attachments (with their nodes and the
+# nodes' projects) up front, in a fixed number of queries:
+_NETWORK_ATTACHMENTS_OPTIONS = (
+    db.joinedload('owner'),
+    db.selectinload('access'),
+    db.selectinload('attachments').joinedload('nic').joinedload('owner')
+    .joinedload('project'),
+)
 
 
 @rest_call('GET', '/network/<network>/attachments', schema=Schema({
@@ -754,7 +1050,8 @@ def list_network_attachments(network, project=None):
     If <project> is `None`, lists all attachments for <network>
     """
     auth_backend = get_auth_backend()
-    network = get_or_404(model.Network, network)
+    network = get_or_404(model.Network, network,
+                         options=_NETWORK_ATTACHMENTS_OPTIONS)
 
     # Determine if caller has access to owning project
     owner_access = auth_backend.have_project_access(network.owner)
@@ -894,7 +1191,8 @@ def show_network(network):
     allocator = get_network_allocator()
     auth_backend = get_auth_backend()
 
-    network = get_or_404(model.Network, network)
+    network = get_or_404(model.Network, network,
+                         options=_NETWORK_ATTACHMENTS_OPTIONS)
 
     if network.access:
         authorized = False
@@ -920,8 +1218,9 @@ def show_network(network):
         result['access'] = None
 
     connected_nodes = {}
+    owner_access = auth_backend.have_project_access(network.owner)
     for n in network.attachments:
-        if auth_backend.have_project_access(network.owner) or \
+        if owner_access or \
                 auth_backend.have_project_access(n.nic.owner.project):
             node, nic = n.nic.owner.label, n.nic.label
             # build a dictonary mapping a node to list of nics
@@ -1037,6 +1336,27 @@ def show_switch(switch):
     }, sort_keys=True)
 
 
+@rest_call('GET', '/switch/<switch>/snapshot', Schema({
+    'switch': basestring,
+}))
+def show_switch_snapshot(switch):
+    """Read the vlans of every registered port on a switch.
+
+    Unlike most switch related calls, this talks to the switch directly,
+    rather than going through the network daemon. See `docs/rest_api.md`
+    for a full description of the output.
+    """
+    get_auth_backend().require_admin()
+    switch = get_or_404(model.Switch, switch)
+    ports = list(switch.ports)
+    session = switch.session()
+    try:
+        snapshot = session.snapshot(ports)
+    finally:
+        session.disconnect()
+    return json.dumps(snapshot, sort_keys=True)
+
+
 @rest_call('GET', '/switch/<switch>/port/<path:port>', Schema({
     'switch': basestring, 'port': basestring}))
 def show_port(switch, port):
@@ -1046,7 +1366,11 @@ def show_port(switch, port):
     """
     get_auth_backend().require_admin()
     switch = get_or_404(model.Switch, switch)
-    port = get_child_or_404(switch, model.Port, port)
+    port = get_child_or_404(switch, model.Port, port, options=(
+        db.joinedload('nic').joinedload('owner'),
+        db.joinedload('nic').selectinload('attachments')
+        .joinedload('network'),
+    ))
     nic = port.nic
     return_obj = {}
     if nic:
@@ -1058,18 +1382,22 @@ def show_port(switch, port):
     return json.dumps(return_obj)
 
 
-@rest_call('GET', '/switches', Schema({}))
-def list_switches():
+@rest_call('GET', '/switches', list_schema())
+def list_switches(limit=None, after=None, prefix=None, stream=False):
     """List all switches.
 
     Returns a JSON array of strings representing a list of switches.
 
     Example:  '["cisco3", "brocade1", "mock2"]'
+
+    See `list_schema` for the optional arguments.
     """
     get_auth_backend().require_admin()
-    switches = model.Switch.query.all()
-    snames = sorted([s.label for s in switches])
-    return json.dumps(snames)
+    return list_response(db.session.query(model.Switch.label),
+                         model.Switch.label,
+                         lambda switch: switch.label,
+                         limit=limit, after=after, prefix=prefix,
+                         stream=stream)
 
 
 @rest_call('POST', '/switch/<switch>/port/<path:port>/connect_nic', Schema({
@@ -1162,15 +1490,229 @@ def port_revert(switch, port):
 def show_networking_action(status_id):
     """Returns the status of the networking action by finding the status_id
     in the networking actions table.
+
+    Actions which have been moved out of the journal (see `hil.journal`) are
+    looked up in the archive.
     """
     action = model.NetworkingAction.query.filter_by(uuid=status_id).first()
     if action is None:
-        raise errors.NotFoundError('status_id not found')
+        return _show_archived_action(status_id)
 
     project = action.nic.owner.project
     get_auth_backend().require_project_access(project)
 
-    action_info = {'status': action.status,
+    return json.dumps(_networking_action_info(action))
+
+
+def _show_archived_action(status_id):
+    """Implement show_networking_action for an archived action."""
+    action = model.ArchivedNetworkingAction.query \
+        .filter_by(uuid=status_id).first()
+    if action is None:
+        raise errors.NotFoundError('status_id not found')
+    _require_actions_access([action])
+    return json.dumps(_networking_action_info(action))
+
+
+def _require_actions_access(actions):
+    """Check that the user may see all of ``actions``.
+
+    ``actions`` may include both `NetworkingAction`s and
+    `ArchivedNetworkingAction`s. Access is checked against the project of
+    each action's node. For archived actions, this is the node which now has
+    the archived node label; if there is no longer such a node, only an
+    admin may see the action.
+    """
+    projects = set()
+    archived_nodes = set()
+    for action in actions:
+        if isinstance(action, model.ArchivedNetworkingAction):
+            archived_nodes.add(action.node)
+        else:
+            projects.add(action.nic.owner.project)
+    if archived_nodes:
+        nodes = dict((node.label, node) for node in model.query_in(
+            model.Node.query.options(db.joinedload('project')),
+            model.Node.label, archived_nodes))
+        for label in archived_nodes:
+            node = nodes.get(label)
+            projects.add(node.project if node is not None else None)
+
+    auth_backend = get_auth_backend()
+    for project in projects:
+        auth_backend.require_project_access(project)
+
+
+# Options for loading networking actions, for `_networking_actions_status`:
+_NETWORKING_ACTION_OPTIONS = (
+    db.joinedload('nic').joinedload('owner').joinedload('project'),
+    db.joinedload('new_network'),
+)
+
+# Schema for the ``wait`` parameter of the networking action status calls:
+_WAIT_SCHEMA = And(Use(float), lambda wait: wait >= 0)
+
+
+@rest_call('GET', '/networking_actions', Schema({
+    'status_ids': basestring,
+    Optional('wait'): _WAIT_SCHEMA,
+}))
+def show_networking_actions(status_ids, wait=None):
+    """Returns the status of several networking actions at once.
+
+    ``status_ids`` is a comma-separated list of the actions' status ids;
+    ids which are not found are left out. Archived actions (see
+    `hil.journal`) are included. If ``wait`` is given, the call
+    blocks until none of the actions are pending, or until ``wait`` seconds
+    have passed; see `_wait_for_actions`.
+
+    The result is as for `show_networking_action_batch`.
+    """
+    status_ids = [status_id for status_id in status_ids.split(',')
+                  if status_id]
+
+    def load():
+        """Load the actions, in the order they were asked for."""
+        actions = dict((action.uuid, action) for action in model.query_in(
+            model.NetworkingAction.query.options(
+                *_NETWORKING_ACTION_OPTIONS),
+            model.NetworkingAction.uuid, set(status_ids)))
+        # Look in the archive after the journal, so that actions archived
+        # in between are still found:
+        archived = set(status_ids) - set(actions)
+        if archived:
+            actions.update((action.uuid, action) for action in model.query_in(
+                model.ArchivedNetworkingAction.query,
+                model.ArchivedNetworkingAction.uuid, archived))
+        return [actions.pop(status_id) for status_id in status_ids
+                if status_id in actions]
+
+    return _networking_actions_status(load, wait, 'status_ids')
+
+
+@rest_call('GET', '/networking_action_batch/<batch_id>', Schema({
+    'batch_id': basestring,
+    Optional('wait'): _WAIT_SCHEMA,
+}))
+def show_networking_action_batch(batch_id, wait=None):
+    """Returns the status of a batch of networking actions, as queued by
+    `networking_action_batch`.
+
+    The batch's status is 'PENDING' if any of its actions are, otherwise
+    'ERROR' if any of them failed, and otherwise 'DONE'. Actions which have
+    been deleted (because a newer action was queued on the same nic) are
+    left out, but archived actions (see `hil.journal`) are included.
+    ``wait`` is as for `show_networking_actions`.
+    """
+    def load():
+        """Load the batch's actions, in the order they were queued."""
+        actions = model.NetworkingAction.query \
+            .filter_by(batch_id=batch_id) \
+            .options(*_NETWORKING_ACTION_OPTIONS).all()
+        # As in show_networking_actions, the archive is read second; an
+        # action archived in between may turn up in both:
+        live = set(action.uuid for action in actions)
+        actions.extend(action for action in model.ArchivedNetworkingAction
+                       .query.filter_by(batch_id=batch_id)
+                       if action.uuid not in live)
+        # Archived actions keep their original ids:
+        return sorted(actions, key=lambda action: action.id)
+
+    return _networking_actions_status(load, wait, 'batch_id')
+
+
+def _networking_actions_status(load, wait, what):
+    """Return the aggregate status of some networking actions, as JSON.
+
+    ``load`` is a function which returns the actions, which may include
+    archived actions. If it doesn't return any, a NotFoundError is raised,
+    saying that ``what`` was not found. ``wait`` is as for
+    `show_networking_actions`.
+    """
+    actions = load()
+    if not actions:
+        raise errors.NotFoundError('%s not found' % what)
+
+    _require_actions_access(actions)
+
+    pending = [action.id for action in actions if action.is_pending()]
+    if wait and pending:
+        _wait_for_actions(pending, wait)
+        actions = load()
+
+    result = []
+    counts = {'PENDING': 0, 'DONE': 0, 'ERROR': 0}
+    for action in actions:
+        action_info = _networking_action_info(action)
+        action_info['status_id'] = action.uuid
+        result.append(action_info)
+        counts[action_info['status']] = \
+            counts.get(action_info['status'], 0) + 1
+    if counts['PENDING']:
+        status = 'PENDING'
+    elif counts['ERROR']:
+        status = 'ERROR'
+    else:
+        status = 'DONE'
+    return json.dumps({
+        'status': status,
+        'counts': counts,
+        'actions': result,
+    })
+
+
+def _wait_for_actions(action_ids, wait):
+    """Block until none of the actions with the given ids are pending.
+
+    Returns after ``wait`` seconds even if some still are; ``wait`` is
+    capped by the ``networking_action_max_wait`` option in the ``[general]``
+    section (60 seconds by default). The database is checked every
+    ``networking_action_poll_interval`` seconds (by default, 0.5), with a
+    single query, and no transaction is held open in between.
+    """
+    max_wait = 60
+    if cfg.has_option('general', 'networking_action_max_wait'):
+        max_wait = cfg.getfloat('general', 'networking_action_max_wait')
+    interval = 0.5
+    if cfg.has_option('general', 'networking_action_poll_interval'):
+        interval = cfg.getfloat('general', 'networking_action_poll_interval')
+
+    table = model.NetworkingAction
+    pending = db.session.query(table.id) \
+        .filter(table.status.in_(table.pending_statuses))
+    deadline = time.time() + min(wait, max_wait)
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        # Let the next query see the network daemon's progress:
+        db.session.commit()
+        time.sleep(min(interval, remaining))
+        if next(model.query_in(pending, table.id, action_ids), None) is None:
+            return
+
+
+def _networking_action_info(action):
+    """Return the description of ``action`` reported by the API.
+
+    ``action`` may be a `NetworkingAction` or an `ArchivedNetworkingAction`.
+    """
+    if isinstance(action, model.ArchivedNetworkingAction):
+        return {'status': action.status,
+                'node': action.node,
+                'nic': action.nic,
+                'type': action.type,
+                'channel': action.channel,
+                'new_network': action.new_network}
+
+    # Actions which the network daemon has claimed, but not yet finished,
+    # are still reported as pending.
+    if action.is_pending():
+        status = 'PENDING'
+    else:
+        status = action.status
+
+    action_info = {'status': status,
                    'node': action.nic.owner.label,
                    'nic': action.nic.label,
                    'type': action.type,
@@ -1180,25 +1722,25 @@ def show_networking_action(status_id):
         action_info['new_network'] = None
     else:
         action_info['new_network'] = action.new_network.label
+    return action_info
 
-    return json.dumps(action_info)
 
-
-@rest_call('GET', '/nodes/<is_free>', Schema({'is_free': basestring}))
-def list_nodes(is_free):
+@rest_call('GET', '/nodes/<is_free>', list_schema({'is_free': basestring}))
+def list_nodes(is_free, limit=None, after=None, prefix=None, stream=False):
     """List all nodes or all free nodes
 
     Returns a JSON array of strings representing a list of nodes.
 
     Example:  '["node1", "node2", "node3"]'
+
+    See `list_schema` for the optional arguments.
     """
+    query = db.session.query(model.Node.label)
     if is_free == "free":
-        nodes = model.Node.query.filter_by(project_id=None).all()
-    else:
-        nodes = model.Node.query.all()
-
-    nodes = sorted([n.label for n in nodes])
-    return json.dumps(nodes)
+        query = query.filter_by(project_id=None)
+    return list_response(query, model.Node.label, lambda node: node.label,
+                         limit=limit, after=after, prefix=prefix,
+                         stream=stream)
 
 
 @rest_call('GET', '/project/<project>/nodes', Schema({'project': basestring}))
@@ -1233,6 +1775,54 @@ def list_project_networks(project):
     return json.dumps(networks)
 
 
+# Load everything show_node needs up front, in a fixed number of queries:
+_NODE_NIC_OPTIONS = (
+    db.selectinload('nics').joinedload('port').joinedload('owner'),
+    db.selectinload('nics').selectinload('attachments')
+    .joinedload('network'),
+)
+_SHOW_NODE_OPTIONS = (
+    db.joinedload('project'),
+    db.selectinload('metadata'),
+) + _NODE_NIC_OPTIONS
+
+
+# The fields a client may ask list_node_details for:
+_NODE_DETAIL_FIELDS = ('name', 'project', 'nics', 'metadata')
+
+
+def _node_details(node, admin, fields=_NODE_DETAIL_FIELDS):
+    """Return the details of ``node``, as shown by show_node.
+
+    ``admin`` says whether the caller is an admin; if not, the port and
+    switch of each nic are left out. Only the keys in ``fields`` are
+    included.
+    """
+    details = {}
+    if 'name' in fields:
+        details['name'] = node.label
+    if 'project' in fields:
+        details['project'] = \
+            None if node.project_id is None else node.project.label
+    if 'nics' in fields:
+        details['nics'] = []
+        for n in node.nics:
+            nic = {'label': n.label,
+                   'macaddr': n.mac_addr,
+                   'networks': dict([(attachment.channel,
+                                      attachment.network.label)
+                                     for attachment in n.attachments]),
+                   }
+            # port and switch info is only shown to admins:
+            if admin:
+                nic['port'] = None if n.port is None else n.port.label
+                nic['switch'] = None if n.port is None else n.port.owner.label
+            details['nics'].append(nic)
+    if 'metadata' in fields:
+        details['metadata'] = {m.label: m.value for m in node.metadata}
+    return details
+
+
 @rest_call('GET', '/node/<nodename>', Schema({'nodename': basestring}))
 def show_node(nodename):
     """Show the details of a node.
@@ -1240,32 +1830,70 @@ def show_node(nodename):
     Returns a JSON object representing a node.
     """
 
-    node = get_or_404(model.Node, nodename)
+    node = get_or_404(model.Node, nodename, options=_SHOW_NODE_OPTIONS)
     if node.project is not None:
         get_auth_backend().require_project_access(node.project)
 
-    # build list of nics
-    nic = [{'label': n.label,
-            'macaddr': n.mac_addr,
-            'port': None if n.port is None else n.port.label,
-            'switch': None if n.port is None else n.port.owner.label,
-            'networks': dict([(attachment.channel,
-                               attachment.network.label)
-                             for attachment in n.attachments]),
-            } for n in node.nics]
-
-    # remove port and switch info if the user is not an admin
-    if not get_auth_backend().have_admin():
-        for nics in nic:
-            del nics['port']
-            del nics['switch']
+    return json.dumps(_node_details(node, get_auth_backend().have_admin()),
+                      sort_keys=True)
 
-    return json.dumps({
-        'name': node.label,
-        'project': None if node.project_id is None else node.project.label,
-        'nics': nic,
-        'metadata': {m.label: m.value for m in node.metadata}
-    }, sort_keys=True)
+
+@rest_call('GET', '/nodes/<is_free>/details', Schema({
+    'is_free': basestring,
+    Optional('project'): basestring,
+    Optional('fields'): basestring,
+}))
+def list_node_details(is_free, project=None, fields=None):
+    """Show the details of many nodes at once.
+
+    Like list_nodes, ``is_free`` is either "free" or "all". If ``project``
+    is given, only the nodes belonging to that project are listed.
+    ``fields`` is a comma-separated list of the keys to include for each
+    node (see `_NODE_DETAIL_FIELDS`); by default, all of them are.
+
+    Returns a JSON array of objects, in the format of show_node, sorted by
+    node name. Nodes belonging to projects the caller does not have access
+    to are left out.
+    """
+    auth_backend = get_auth_backend()
+    if fields is None:
+        fields = _NODE_DETAIL_FIELDS
+    else:
+        fields = fields.split(',')
+        for field in fields:
+            if field not in _NODE_DETAIL_FIELDS:
+                raise errors.BadArgumentError(
+                    "Unknown field %r; must be one of %s" %
+                    (field, ', '.join(_NODE_DETAIL_FIELDS)))
+
+    # Only load what we are going to show:
+    options = [db.joinedload('project')]
+    if 'nics' in fields:
+        options.extend(_NODE_NIC_OPTIONS)
+    if 'metadata' in fields:
+        options.append(db.selectinload('metadata'))
+    query = model.Node.query.options(*options)
+
+    if is_free == 'free':
+        query = query.filter_by(project_id=None)
+    if project is not None:
+        project = get_or_404(model.Project, project)
+        auth_backend.require_project_access(project)
+        query = query.filter_by(project_id=project.id)
+
+    # Check access once per project, rather than once per node:
+    access = {None: True}
+    nodes = []
+    for node in query.order_by(model.Node.label):
+        if node.project_id not in access:
+            access[node.project_id] = \
+                auth_backend.have_project_access(node.project)
+        if access[node.project_id]:
+            nodes.append(node)
+
+    admin = auth_backend.have_admin()
+    return json.dumps([_node_details(node, admin, fields) for node in nodes],
+                      sort_keys=True)
 
 
 @rest_call('GET', '/project/<project>/headnodes', Schema({
@@ -1318,6 +1946,30 @@ def list_headnode_images():
     return json.dumps(valid_imgs)
 
 
+# Layout code #
+###############
+
+@rest_call('POST', '/layout', Schema({
+    Optional('switches'): list,
+    Optional('nodes'): list,
+}))
+def layout_import(switches=(), nodes=()):
+    """Register many switches, ports, nodes and nics at once.
+
+    See `hil.layout` for the format of the arguments. Either everything is
+    registered, or (if there are any problems) nothing is, and a
+    LayoutError listing the problems is raised.
+
+    Returns a JSON object counting the objects registered, e.g.
+    '{"nics": 2, "nodes": 1, "ports": 2, "switches": 1}'
+    """
+    get_auth_backend().require_admin()
+    result = layout.import_layout({'switches': list(switches),
+                                   'nodes': list(nodes)})
+    db.session.commit()
+    return json.dumps(result, sort_keys=True)
+
+
 # Extension code #
 #################
 @rest_call('GET', '/active_extensions', Schema({}))
@@ -1328,6 +1980,17 @@ def list_active_extensions():
     return json.dumps(extensions)
 
 
+@rest_call('GET', '/metrics', Schema({}))
+def show_metrics():
+    """Return the server's metrics, in the Prometheus text format.
+
+    See `hil.metrics` for the metrics included.
+    """
+    get_auth_backend().require_admin()
+    return flask.Response(metrics.render(),
+                          mimetype='text/plain; version=0.0.4')
+
+
 # Console code #
 ################
 @rest_call('GET', '/node/<nodename>/console', Schema({'nodename': basestring}))
@@ -1358,7 +2021,7 @@ def absent_or_conflict(cls, name):
                                                                name))
 
 
-def get_or_404(cls, name):
+def get_or_404(cls, name, options=()):
     """Raises a NotFoundError if the given object doesn't exist in the datbase.
     Otherwise returns the object
 
@@ -1368,16 +2031,106 @@ def get_or_404(cls, name):
 
     cls - the class of the object to query.
     name - the name of the object in question.
+    options - query options (e.g. `db.joinedload(...)`) to apply, so that
+        related objects can be loaded up front, rather than one query at a
+        time as they are accessed.
 
     Must be called within a request context.
     """
-    obj = db.session.query(cls).filter_by(label=name).first()
+    obj = db.session.query(cls).options(*options) \
+        .filter_by(label=name).first()
     if not obj:
         raise errors.NotFoundError("%s %s does not exist." % (cls.__name__,
                                                               name))
     return obj
 
 
+# How many rows a streamed list response fetches at a time:
+_STREAM_CHUNK_SIZE = 500
+
+
+def _iter_by_label(query, label, limit=None, after=None, prefix=None,
+                   chunk_size=None):
+    """Yield the results of ``query`` in order of ``label``.
+
+    ``label`` is the (indexed) label column of the objects being listed.
+    The other arguments are as described in `list_schema`. Each result must
+    have a ``label`` attribute, i.e. either be a model object or a row which
+    includes the label column.
+
+    If ``chunk_size`` is not None, the results are fetched that many at a
+    time, each chunk picking up after the last label of the previous one,
+    and model objects are expunged from the session once they have been
+    yielded, so that they need not all be held in memory at once.
+    """
+    if prefix is not None:
+        query = query.filter(label.startswith(prefix, autoescape=True))
+    query = query.order_by(label)
+    while limit is None or limit > 0:
+        size = limit
+        if chunk_size is not None:
+            size = chunk_size if limit is None else min(limit, chunk_size)
+        chunk = query
+        if after is not None:
+            chunk = chunk.filter(label > after)
+        if size is not None:
+            chunk = chunk.limit(size)
+        rows = chunk.all()
+        for row in rows:
+            yield row
+            if chunk_size is not None and isinstance(row, db.Model):
+                db.session.expunge(row)
+        if size is None or len(rows) < size:
+            return
+        if limit is not None:
+            limit -= len(rows)
+        after = rows[-1].label
+
+
+def _json_chunks(items, keyed):
+    """Yield the JSON encoding of ``items`` a piece at a time.
+
+    ``items`` are encoded as a JSON array, unless ``keyed`` is True, in
+    which case they must be (key, value) pairs, and are encoded as a JSON
+    object, with the keys in the order given.
+    """
+    yield '{' if keyed else '['
+    for i, item in enumerate(items):
+        if i > 0:
+            yield ', '
+        if keyed:
+            yield json.dumps(item[0]) + ': ' + json.dumps(item[1],
+                                                          sort_keys=True)
+        else:
+            yield json.dumps(item, sort_keys=True)
+    yield '}' if keyed else ']'
+
+
+def list_response(query, label, to_json, keyed=False, limit=None, after=None,
+                  prefix=None, stream=False):
+    """Return the response body for a call which lists objects by label.
+
+    ``query`` selects the objects (or rows) to list, and ``label`` is their
+    label column; results are ordered by it. ``to_json`` is applied to each
+    result to get the JSON-serializable item to return for it. The result
+    is a JSON array of these items, or, if ``keyed`` is True, a JSON object
+    (in which case the items must be (key, value) pairs).
+
+    The remaining arguments are those described in `list_schema`. If
+    ``stream`` is True, a streaming `flask.Response` is returned instead of
+    a string, and the rows are fetched from the database in chunks as the
+    response is sent.
+    """
+    rows = _iter_by_label(query, label, limit=limit, after=after,
+                          prefix=prefix,
+                          chunk_size=_STREAM_CHUNK_SIZE if stream else None)
+    chunks = _json_chunks((to_json(row) for row in rows), keyed)
+    if stream:
+        return flask.Response(flask.stream_with_context(chunks),
+                              mimetype='application/json')
+    return ''.join(chunks)
+
+
 def _obmd_redirect(node, path):
     if not node.obm_is_enabled():
         raise errors.BlockedError("OBM is not enabled")
@@ -1390,9 +2143,9 @@ def _obmd_redirect(node, path):
     )
 
 
-def _namespaced_query(obj_outer, cls_inner, name_inner):
+def _namespaced_query(obj_outer, cls_inner, name_inner, options=()):
     """Helper function to search for subobjects of an object."""
-    return db.session.query(cls_inner) \
+    return db.session.query(cls_inner).options(*options) \
         .filter_by(owner=obj_outer) \
         .filter_by(label=name_inner).first()
 
@@ -1420,7 +2173,7 @@ def absent_child_or_conflict(obj_outer, cls_inner, name_inner):
                                                obj_outer.label))
 
 
-def get_child_or_404(obj_outer, cls_inner, name_inner):
+def get_child_or_404(obj_outer, cls_inner, name_inner, options=()):
     """Search the database for a "namespaced" object, such as a nic on a node.
 
     Raises NotFoundError if there is none.  Otherwise returns the object.
@@ -1430,10 +2183,11 @@ def get_child_or_404(obj_outer, cls_inner, name_inner):
     obj_outer - the "owner" object
     cls_inner - the "owned" class
     name_inner - the name of the "owned" object
+    options - query options to apply; see `get_or_404`.
 
     Must be called within a request context.
     """
-    obj_inner = _namespaced_query(obj_outer, cls_inner, name_inner)
+    obj_inner = _namespaced_query(obj_outer, cls_inner, name_inner, options)
     if obj_inner is None:
         raise errors.NotFoundError("%s %s on %s %s does not exist." %
                                    (cls_inner.__name__,
@@ -1482,11 +2236,10 @@ def _maintain(project, node, node_label):
 
 def check_pending_action(nic):
     """Raises an error if the nic has a pending action
-    Otherwise deletes the completed action"""
-    if nic.current_action:
-        if nic.current_action.status == 'PENDING':
-            raise errors.BlockedError(
-                "A networking operation is already active on the nic.")
-        else:
-            db.session.delete(nic.current_action)
+    Otherwise deletes the completed actions"""
+    if nic.has_pending_action():
+        raise errors.BlockedError(
+            "A networking operation is already active on the nic.")
+    for action in nic.actions:
+        db.session.delete(action)
     return
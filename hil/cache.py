@@ -0,0 +1,138 @@
+"""A small in-process cache, whose entries expire after a fixed time.
+
+This is used to remember the results of expensive checks (e.g. verifying a
+password) for a short while, so they needn't be repeated on every request.
+`MemcacheStore` offers the same interface, for caches which should be
+shared between processes.
+"""
+
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """A bounded, thread-safe mapping whose entries expire.
+
+    Entries expire ``ttl`` seconds after they are stored. If more than
+    ``max_size`` entries are stored, the least recently used ones are
+    evicted. A ``ttl`` of 0 disables the cache: nothing is stored, and every
+    lookup misses.
+
+    ``hits`` and ``misses`` count the lookups made with `get`.
+    """
+
+    def __init__(self, ttl, max_size, clock=time.time):
+        """Create an empty cache.
+
+        ``clock`` is the function used to tell the time; it is only
+        replaced by tests.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Maps keys to (expiry time, value) pairs, least recently used
+        # first:
+        self._entries = OrderedDict()
+
+    @property
+    def enabled(self):
+        """Whether the cache stores anything at all."""
+        return self.ttl > 0 and self.max_size > 0
+
+    def get(self, key, default=None):
+        """Return the value stored under ``key``, or ``default``.
+
+        Expired entries are removed, and count as misses.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= self._clock():
+                self.misses += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        """Store ``value`` under ``key``, replacing any previous value."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (self._clock() + self.ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Remove the entry for ``key``, if there is one."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove every entry, and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class MemcacheStore(object):
+    """A cache kept in memcached, with the same interface as `TTLCache`.
+
+    ``client`` is a memcached client with the interface of python-memcached's
+    ``memcache.Client`` (``get``, ``set`` and ``delete``); any object with
+    those methods will do. Entries expire after ``ttl`` seconds; memcached
+    takes care of evicting entries when it is full.
+
+    Keys are hashed (and prefixed with ``prefix``), so they may be of any
+    length, and contain any characters. Values must be picklable.
+
+    The cache may be shared by several processes, but ``hits`` and
+    ``misses`` only count this process's lookups.
+    """
+
+    def __init__(self, client, ttl, prefix):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._client = client
+        self._prefix = prefix
+
+    @property
+    def enabled(self):
+        """Whether the cache stores anything at all."""
+        return self.ttl > 0
+
+    def _key(self, key):
+        """Return the memcached key for ``key``."""
+        return self._prefix + hashlib.sha256(repr(key)).hexdigest()
+
+    def get(self, key, default=None):
+        """Return the value stored under ``key``, or ``default``."""
+        value = self._client.get(self._key(key))
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store ``value`` under ``key``, replacing any previous value."""
+        if self.enabled:
+            # memcached takes whole seconds, and 0 means "never expire":
+            self._client.set(self._key(key), value,
+                             time=max(1, int(math.ceil(self.ttl))))
+
+    def invalidate(self, key):
+        """Remove the entry for ``key``, if there is one."""
+        self._client.delete(self._key(key))
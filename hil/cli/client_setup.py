@@ -17,7 +17,9 @@ def setup_http_client():
     1. If the environment variables HIL_USERNAME and HIL_PASSWORD
        are defined, it will use HTTP basic auth, with the corresponding
        user name and password.
-    2. If the `python-keystoneclient` library is installed, and the
+    2. If the environment variable HIL_TOKEN is defined, it is sent as a
+       session token (see `hil user token`).
+    3. If the `python-keystoneclient` library is installed, and the
        environment variables:
 
            * OS_AUTH_URL
@@ -26,7 +28,7 @@ def setup_http_client():
            * OS_PROJECT_NAME
 
        are defined, Keystone is used.
-    3. Otherwise, do not supply authentication information.
+    4. Otherwise, do not supply authentication information.
 
     This may be extended with other backends in the future.
 
@@ -49,6 +51,12 @@ def setup_http_client():
         http_client.auth = (basic_username, basic_password)
         # For calls using the client library
         return Client(ep, http_client), http_client
+    # Next try a session token:
+    token = os.getenv('HIL_TOKEN')
+    if token is not None:
+        http_client = RequestsHTTPClient()
+        http_client.headers['X-Auth-Token'] = token
+        return Client(ep, http_client), http_client
     # Next try keystone:
     try:
         from keystoneauth1.identity import v3
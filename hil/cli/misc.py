@@ -13,3 +13,25 @@ def networking_action():
 def show_networking_action(status_id):
     """Displays the status of the networking action"""
     print client.node.show_networking_action(status_id)
+
+
+@networking_action.command('show-batch')
+@click.argument('batch_id')
+def show_networking_action_batch(batch_id):
+    """Displays the status of a batch of networking actions"""
+    print client.node.show_networking_action_batch(batch_id)
+
+
+@networking_action.command('wait')
+@click.argument('status_ids', nargs=-1)
+@click.option('--batch', help='Wait for the actions in this batch instead')
+@click.option('--timeout', type=float, help='Give up after this many seconds')
+def wait_for_networking_actions(status_ids, batch, timeout):
+    """Waits for networking actions to finish, and displays their status"""
+    if batch is not None and status_ids:
+        raise click.UsageError('Give either status ids or --batch, not both')
+    if batch is None:
+        print client.node.wait_for_actions(status_ids=list(status_ids),
+                                           timeout=timeout)
+    else:
+        print client.node.wait_for_actions(batch_id=batch, timeout=timeout)
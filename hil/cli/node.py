@@ -20,6 +20,22 @@ def nodes_list(pool):
         sys.stdout.write('Free nodes %s\t:   %s\n' % (len(q), " ".join(q)))
 
 
+@node.command(name='details')
+@click.argument('pool', type=click.Choice(['free', 'all']), required=True)
+@click.option('--project', help='Only show nodes in this project')
+@click.option('--fields', help='Comma-separated list of fields to show')
+def nodes_details(pool, project, fields):
+    """Show information about all nodes or free nodes"""
+    if fields is not None:
+        fields = fields.split(',')
+    q = client.node.list_details(pool, project=project, fields=fields)
+    for node in q:
+        sys.stdout.write("%s\n" % node['name'])
+        for item in sorted(node.items()):
+            if item[0] != 'name':
+                sys.stdout.write("  %s\t  :  %s\n" % (item[0], item[1]))
+
+
 @node.command(name='show')
 @click.argument('node')
 def node_show(node):
@@ -164,6 +180,23 @@ def node_power_status(node):
     print(client.node.power_status(node))
 
 
+@node_power.command(name='batch')
+@click.argument('op', type=click.Choice(['on', 'off', 'cycle', 'status']))
+@click.argument('nodes', nargs=-1)
+@click.option('--project', help='Operate on all of the nodes in a project')
+@click.option('--force', is_flag=True,
+              help='Force the nodes off when power cycling')
+def node_power_batch(op, nodes, project, force):
+    """Perform <op> on many nodes at once
+
+    Give either a list of nodes, or --project.
+    """
+    if bool(nodes) == (project is not None):
+        raise click.UsageError('Give either a list of nodes or --project')
+    print(client.node.power_batch(op, nodes=list(nodes) or None,
+                                  project=project, force=force))
+
+
 @node.group(name='metadata')
 def node_metadata():
     """Node metadata commands"""
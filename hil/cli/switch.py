@@ -19,6 +19,17 @@ def node_show(switch):
         sys.stdout.write("%s\t  :  %s\n" % (item[0], item[1]))
 
 
+@switch.command(name='snapshot')
+@click.argument('switch')
+def switch_snapshot(switch):
+    """Display the vlans of each port on <switch>, as read from the switch"""
+    q = client.switch.snapshot(switch)
+    for port, networks in sorted(q.items()):
+        sys.stdout.write("%s\t  :  %s\n" % (
+            port, ', '.join('%s=%s' % item
+                            for item in sorted(networks.items()))))
+
+
 @switch.command(name='list')
 def list_switches():
     """List all switches"""
@@ -59,3 +59,13 @@ def user_set_admin(username, is_admin):
     a user is authorized for administrative privileges.
     """
     client.user.set_admin(username, is_admin == 'admin')
+
+
+@user.command(name='token')
+def user_token():
+    """Print a session token for the current user.
+
+    Setting the HIL_TOKEN environment variable to the token lets later
+    commands authenticate with it instead of HIL_USERNAME and HIL_PASSWORD.
+    """
+    click.echo(client.user.create_token()['token'])
@@ -1,5 +1,6 @@
 """ This module implements the HIL client library. """
 
+from collections import OrderedDict
 from urlparse import urljoin
 import json
 import re
@@ -22,6 +23,11 @@ class FailedAPICallException(Exception):
         self.error_type = error_type
 
 
+# The default number of results to request at a time, in
+# `ClientBase.follow_pages`:
+DEFAULT_PAGE_SIZE = 100
+
+
 class ClientBase(object):
     """Main class which contains all the methods to
 
@@ -50,15 +56,21 @@ class ClientBase(object):
         url = urljoin(self.endpoint, rel)
         return url
 
-    def check_response(self, response):
+    def check_response(self, response, ordered=False):
         """
         Check the response from an API call, and do any needed error handling
 
         Returns the body of the response as (parsed) JSON, or None if there
         was no body. Raises a FailedAPICallException on any non 2xx status.
+
+        If ``ordered`` is True, JSON objects are returned as OrderedDicts,
+        preserving the order of their keys.
         """
         if 200 <= response.status_code < 300:
             try:
+                if ordered:
+                    return json.loads(response.content,
+                                      object_pairs_hook=OrderedDict)
                 return json.loads(response.content)
             except ValueError:  # No JSON request body; typical
                                 # For methods PUT, POST, DELETE
@@ -77,6 +89,33 @@ class ClientBase(object):
                 message=response.content,
             )
 
+    def follow_pages(self, url, prefix=None, page_size=DEFAULT_PAGE_SIZE):
+        """Iterate over the results of a call which lists objects by label.
+
+        Requests ``page_size`` results at a time from ``url``, passing the
+        last label of each page as the ``after`` parameter of the next
+        request, until there are no more. If ``prefix`` is not None, only
+        results whose labels start with it are requested.
+
+        Yields the elements of each page, if the call returns a JSON array,
+        or its (key, value) pairs, if it returns a JSON object.
+        """
+        params = {'limit': page_size}
+        if prefix is not None:
+            params['prefix'] = prefix
+        while True:
+            page = self.check_response(
+                self.httpClient.request("GET", url, params=params),
+                ordered=True)
+            if isinstance(page, dict):
+                page = page.items()
+            for item in page:
+                yield item
+            if len(page) < page_size:
+                return
+            last = page[-1]
+            params['after'] = last[0] if isinstance(last, tuple) else last
+
 
 def _find_reserved(string, slashes_ok=False):
     """Returns a list of illegal characters in a string"""
@@ -1,6 +1,6 @@
 """Client support for network related api calls."""
 import json
-from hil.client.base import ClientBase
+from hil.client.base import ClientBase, DEFAULT_PAGE_SIZE
 from hil.client.base import check_reserved_chars
 
 
@@ -15,6 +15,15 @@ class Network(ClientBase):
             url = self.object_url('networks')
             return self.check_response(self.httpClient.request("GET", url))
 
+        def iter(self, prefix=None, page_size=DEFAULT_PAGE_SIZE):
+            """Iterate over the networks under HIL, a page at a time.
+
+            Yields (name, attributes) pairs. If <prefix> is given, only
+            networks whose names start with it are included.
+            """
+            url = self.object_url('networks')
+            return self.follow_pages(url, prefix, page_size)
+
         @check_reserved_chars()
         def list_network_attachments(self, network, project):
             """Lists nodes connected to a network"""
@@ -1,8 +1,14 @@
 """Client support for node related api calls."""
 import json
-from hil.client.base import ClientBase, FailedAPICallException
+import time
+from hil.client.base import ClientBase, FailedAPICallException, \
+    DEFAULT_PAGE_SIZE
 from hil.client.base import check_reserved_chars
 
+# The longest Node.wait_for_actions asks the server to wait in a single
+# request. The server may cap this further.
+WAIT_FOR_ACTIONS_REQUEST_WAIT = 30
+
 
 class Node(ClientBase):
     """Consists of calls to query and manipulate node related
@@ -15,6 +21,32 @@ class Node(ClientBase):
         url = self.object_url('nodes', is_free)
         return self.check_response(self.httpClient.request('GET', url))
 
+    def iter(self, is_free, prefix=None, page_size=DEFAULT_PAGE_SIZE):
+        """Iterate over the nodes that HIL manages, a page at a time.
+
+        If <prefix> is given, only nodes whose names start with it are
+        included.
+        """
+        url = self.object_url('nodes', is_free)
+        return self.follow_pages(url, prefix, page_size)
+
+    @check_reserved_chars(dont_check=['fields'])
+    def list_details(self, is_free, project=None, fields=None):
+        """Shows the details of all nodes, or all free nodes, at once.
+
+        If <project> is given, only nodes in that project are shown.
+        <fields> is a list of the attributes to include for each node; by
+        default, all of them are.
+        """
+        url = self.object_url('nodes', is_free, 'details')
+        params = {}
+        if project is not None:
+            params['project'] = project
+        if fields is not None:
+            params['fields'] = ','.join(fields)
+        return self.check_response(
+            self.httpClient.request('GET', url, params=params))
+
     @check_reserved_chars()
     def show(self, node_name):
         """Shows attributes of a given node """
@@ -87,6 +119,26 @@ class Node(ClientBase):
         url = self.object_url('node', node_name, 'power_status')
         return self.check_response(self.httpClient.request('GET', url))
 
+    def power_batch(self, op, nodes=None, project=None, force=False):
+        """Perform a power operation on many nodes at once.
+
+        <op> is 'on', 'off', 'cycle' or 'status'. Give either a list of
+        <nodes>, or a <project> whose nodes to operate on. <force> is as for
+        power_cycle. Returns the result for each node.
+        """
+        url = self.object_url('node_power_batch')
+        payload = {'op': op}
+        if nodes is not None:
+            payload['nodes'] = nodes
+        if project is not None:
+            payload['project'] = project
+        if force:
+            payload['force'] = force
+        return self.check_response(
+                self.httpClient.request('POST', url,
+                                        data=json.dumps(payload))
+                )
+
     @check_reserved_chars()
     def set_bootdev(self, node, dev):
         """Set <node> to boot from <dev> persistently"""
@@ -174,3 +226,70 @@ class Node(ClientBase):
         """Returns the status of the networking action"""
         url = self.object_url('networking_action', status_id)
         return self.check_response(self.httpClient.request('GET', url))
+
+    def networking_action_batch(self, actions):
+        """Queue many connect/detach operations at once.
+
+        <actions> is a list of dicts, each with a 'node', 'nic' and
+        'network', and optionally an 'op' ('connect', the default, or
+        'detach') and a 'channel' to connect on. Returns the batch's id and
+        the status ids of the actions.
+        """
+        url = self.object_url('networking_action_batch')
+        payload = json.dumps({'actions': actions})
+        return self.check_response(
+                self.httpClient.request('POST', url, data=payload)
+                )
+
+    def show_networking_action_batch(self, batch_id, wait=None):
+        """Returns the status of a batch of networking actions.
+
+        If <wait> is given, the server waits up to that many seconds for
+        the actions to finish before answering.
+        """
+        url = self.object_url('networking_action_batch', batch_id)
+        params = {}
+        if wait is not None:
+            params['wait'] = wait
+        return self.check_response(
+            self.httpClient.request('GET', url, params=params))
+
+    def show_networking_actions(self, status_ids, wait=None):
+        """Returns the status of several networking actions at once.
+
+        <status_ids> is a list of the status ids returned by the networking
+        calls. <wait> is as for show_networking_action_batch.
+        """
+        url = self.object_url('networking_actions')
+        params = {'status_ids': ','.join(status_ids)}
+        if wait is not None:
+            params['wait'] = wait
+        return self.check_response(
+            self.httpClient.request('GET', url, params=params))
+
+    def wait_for_actions(self, status_ids=None, batch_id=None, timeout=None):
+        """Wait for networking actions to finish, and return their status.
+
+        Exactly one of <status_ids> (a list of status ids) and <batch_id>
+        must be given. Rather than polling, this makes long-polling requests
+        which the server answers as soon as none of the actions are pending.
+        If <timeout> (in seconds) is given, the status is returned once it
+        has passed, even if some of the actions are still pending; check the
+        'status' of the result.
+        """
+        if (status_ids is None) == (batch_id is None):
+            raise ValueError('Exactly one of status_ids and batch_id '
+                             'must be given')
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            wait = WAIT_FOR_ACTIONS_REQUEST_WAIT
+            if timeout is not None:
+                wait = max(0, min(wait, deadline - time.time()))
+            if batch_id is not None:
+                result = self.show_networking_action_batch(batch_id, wait)
+            else:
+                result = self.show_networking_actions(status_ids, wait)
+            if result['status'] != 'PENDING' or \
+                    (timeout is not None and time.time() >= deadline):
+                return result
@@ -1,6 +1,6 @@
 """Client support for project related api calls."""
 import json
-from hil.client.base import ClientBase
+from hil.client.base import ClientBase, DEFAULT_PAGE_SIZE
 from hil.client.base import check_reserved_chars
 
 
@@ -16,6 +16,15 @@ class Project(ClientBase):
             url = self.object_url('projects')
             return self.check_response(self.httpClient.request("GET", url))
 
+        def iter(self, prefix=None, page_size=DEFAULT_PAGE_SIZE):
+            """Iterate over the projects under HIL, a page at a time.
+
+            If <prefix> is given, only projects whose names start with it are
+            included.
+            """
+            url = self.object_url('projects')
+            return self.follow_pages(url, prefix, page_size)
+
         @check_reserved_chars()
         def nodes_in(self, project_name):
             """Lists nodes allocated to project <project_name> """
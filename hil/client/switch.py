@@ -1,7 +1,7 @@
 """Client support for switch related api calls."""
 import json
 from hil.client.base import check_reserved_chars
-from hil.client.base import ClientBase
+from hil.client.base import ClientBase, DEFAULT_PAGE_SIZE
 
 
 class Switch(ClientBase):
@@ -15,6 +15,15 @@ class Switch(ClientBase):
         url = self.object_url('switches')
         return self.check_response(self.httpClient.request("GET", url))
 
+    def iter(self, prefix=None, page_size=DEFAULT_PAGE_SIZE):
+        """Iterate over the switches that HIL manages, a page at a time.
+
+        If <prefix> is given, only switches whose names start with it are
+        included.
+        """
+        url = self.object_url('switches')
+        return self.follow_pages(url, prefix, page_size)
+
     def register(self, switch, subtype, switchinfo):
         """Registers a switch with name <switch> and
         model <subtype> , and relevant arguments  in <*args>
@@ -39,6 +48,13 @@ class Switch(ClientBase):
         url = self.object_url('switch', switch)
         return self.check_response(self.httpClient.request("GET", url))
 
+    @check_reserved_chars()
+    def snapshot(self, switch):
+        """Shows the vlans of each port on <switch>, as read from the
+        switch itself."""
+        url = self.object_url('switch', switch, 'snapshot')
+        return self.check_response(self.httpClient.request("GET", url))
+
 
 class Port(ClientBase):
     """Port related operations. """
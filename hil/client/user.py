@@ -4,7 +4,7 @@ These are only meaningful if the server is configured to use
 username & password auth.
 """
 import json
-from hil.client.base import ClientBase
+from hil.client.base import ClientBase, DEFAULT_PAGE_SIZE
 from hil.client.base import check_reserved_chars
 
 
@@ -18,6 +18,15 @@ class User(ClientBase):
         url = self.object_url('auth/basic/users')
         return self.check_response(self.httpClient.request("GET", url))
 
+    def iter(self, prefix=None, page_size=DEFAULT_PAGE_SIZE):
+        """Iterate over all users, a page at a time.
+
+        Yields (username, attributes) pairs. If <prefix> is given, only users
+        whose names start with it are included.
+        """
+        url = self.object_url('auth/basic/users')
+        return self.follow_pages(url, prefix, page_size)
+
     @check_reserved_chars(dont_check=['password', 'is_admin'])
     def create(self, username, password, is_admin):
         """Create a user <username> with password <password>.
@@ -75,3 +84,16 @@ class User(ClientBase):
         return self.check_response(
                 self.httpClient.request("PATCH", url, data=payload)
                 )
+
+    def create_token(self):
+        """Get a session token for the user the client authenticates as.
+
+        Returns a dictionary with the 'token', and the number of seconds
+        it 'expires_in'. The token may be sent in the X-Auth-Token header
+        in place of a password; see `setup_http_client` in
+        ``hil.cli.client_setup``.
+        """
+        url = self.object_url('auth/basic/token')
+        return self.check_response(
+                self.httpClient.request("POST", url, data=json.dumps({}))
+                )
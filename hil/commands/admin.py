@@ -1,18 +1,58 @@
 """Implement the hil-admin command."""
-from hil import config, model, deferred, server, migrations, rest
+from hil import config, model, deferred, server, migrations, rest, notify, \
+    reconcile, layout, errors, metrics, journal
 from hil.commands import db
+from hil.commands import journal as journal_command
 from hil.commands.migrate_ipmi_info import MigrateIpmiInfo
 from hil.commands.util import ensure_not_root
 from hil.flaskapp import app
-from time import sleep
 from flask_script import Manager, Command, Option
 
+import json
 import sys
 import logging
+import signal
+from time import time
 from click import IntRange
 manager = Manager(app)
 
 
+def _daemon_option(option, default, integer=False, minimum=0):
+    """Read a numeric option from the ``[network-daemon]`` section.
+
+    Returns ``default`` if the option is not set. Exits with an error if the
+    value is malformed, or less than ``minimum``.
+    """
+    if not config.cfg.has_option('network-daemon', option):
+        return default
+    try:
+        if integer:
+            value = config.cfg.getint('network-daemon', option)
+        else:
+            value = config.cfg.getfloat('network-daemon', option)
+    except (ValueError):
+        sys.exit("Error: %s set to non-%s value" %
+                 (option, 'integer' if integer else 'float'))
+    if value < minimum:
+        sys.exit("Error: %s must be at least %s" % (option, minimum))
+    return value
+
+
+def _exit_on_signal(signum, frame):
+    """Signal handler which exits cleanly (running ``finally`` blocks)."""
+    # pylint: disable=unused-argument
+    sys.exit(0)
+
+
+def _write_metrics(path):
+    """Write the network daemon's metrics to ``path``, logging any error."""
+    try:
+        metrics.write_textfile(path, deferred.DAEMON_METRICS)
+    except (IOError, OSError):
+        logging.getLogger(__name__).exception(
+            'Could not write metrics to %s', path)
+
+
 class ServeNetworks(Command):
     """Start the HIL networking server"""
 
@@ -40,12 +80,142 @@ class ServeNetworks(Command):
         else:
             sleep_time = 2
 
-        while True:
-            # Empty the journal until it's empty; then delay so we don't tight
-            # loop.
-            while deferred.apply_networking():
-                pass
-            sleep(sleep_time)
+        switch_workers = _daemon_option('switch_workers', 1,
+                                        integer=True, minimum=1)
+        batch_size = _daemon_option('batch_size', 1, integer=True, minimum=1)
+        pool = deferred.SessionPool(
+            idle_timeout=_daemon_option('session_idle_timeout', 0),
+            max_age=_daemon_option('session_max_age', 0))
+
+        reconcile_interval = _daemon_option('reconcile_interval', 0)
+        reconcile_fix = config.cfg.has_option('network-daemon',
+                                              'reconcile_fix') and \
+            config.cfg.getboolean('network-daemon', 'reconcile_fix')
+        last_reconcile = time()
+
+        compact_interval = _daemon_option('journal_compact_interval', 0)
+        max_age, archive_max_age = journal.configured_max_ages()
+        last_compact = time()
+
+        claim_timeout = _daemon_option('claim_timeout', 3600)
+        deferred.release_claims(claim_timeout)
+
+        metrics_file = None
+        if config.cfg.has_option('network-daemon', 'metrics_file'):
+            metrics_file = config.cfg.get('network-daemon', 'metrics_file')
+        metrics_port = _daemon_option('metrics_port', 0,
+                                      integer=True, minimum=1)
+        if metrics_port:
+            address = '127.0.0.1'
+            if config.cfg.has_option('network-daemon', 'metrics_address'):
+                address = config.cfg.get('network-daemon', 'metrics_address')
+            metrics.serve_http(address, metrics_port, deferred.DAEMON_METRICS)
+
+        # Start listening before we first look at the journal, so we don't
+        # miss any notifications in between.
+        listener = notify.Listener()
+
+        # Make sure the pool is closed (which saves any unsaved changes to
+        # the switches' configs) when we're asked to stop:
+        signal.signal(signal.SIGTERM, _exit_on_signal)
+        try:
+            while True:
+                # Empty the journal until it's empty; then wait until we're
+                # told there's more work to do (or sleep_time has passed), so
+                # we don't tight loop.
+                while deferred.apply_networking(workers=switch_workers,
+                                                batch_size=batch_size,
+                                                pool=pool):
+                    pass
+                if metrics_file is not None:
+                    _write_metrics(metrics_file)
+                listener.wait(sleep_time)
+                pool.expire()
+                # Pick up the claims of any daemon which has stopped since:
+                deferred.release_claims(claim_timeout)
+                if reconcile_interval and \
+                        time() - last_reconcile >= reconcile_interval:
+                    reconcile.reconcile(fix=reconcile_fix,
+                                        workers=switch_workers,
+                                        pool=pool)
+                    last_reconcile = time()
+                if compact_interval and \
+                        time() - last_compact >= compact_interval:
+                    journal.compact(max_age, archive_max_age)
+                    last_compact = time()
+        finally:
+            pool.close()
+
+
+class Reconcile(Command):
+    """Check the networks on each switch port against HIL's database.
+
+    Any differences are printed, one port per line. With --fix, networking
+    actions are queued to correct them; the network daemon applies them as
+    usual. Only one action is queued per nic at a time, so it may take a few
+    runs to correct everything.
+
+    The exit status is 1 if there are any differences, or any switches
+    couldn't be read, and 0 otherwise.
+    """
+
+    option_list = (
+        Option('--fix', dest='fix', action='store_true', default=False),
+    )
+
+    # pylint: disable=arguments-differ
+    def run(self, fix):
+        server.init()
+        server.register_drivers()
+        server.validate_state()
+        migrations.check_db_schema()
+
+        drift, failed = reconcile.find_drift(
+            workers=_daemon_option('switch_workers', 1,
+                                   integer=True, minimum=1))
+        for switch in failed:
+            sys.stderr.write('Could not read switch %s\n' % switch)
+        for d in drift:
+            sys.stdout.write('%s\n' % d)
+        if fix:
+            actions = reconcile.fix_drift(drift)
+            model.db.session.commit()
+            sys.stdout.write('Queued %d networking actions\n' % len(actions))
+        if drift or failed:
+            sys.exit(1)
+
+
+class ImportLayout(Command):
+    """Register the switches, ports, nodes and nics described in a file.
+
+    The file is a JSON layout document, as described in ``hil.layout``. It
+    is checked as a whole before anything is registered; if there are any
+    problems, they are all printed, nothing is registered and the exit
+    status is 1.
+    """
+
+    # this is actually a positional argument
+    option_list = (Option('filename'),)
+
+    # pylint: disable=arguments-differ
+    def run(self, filename):
+        server.init()
+        migrations.check_db_schema()
+
+        try:
+            with open(filename) as f:
+                document = json.load(f)
+        except (IOError, ValueError) as e:
+            sys.exit("Error: could not read %s: %s" % (filename, e))
+        try:
+            counts = layout.import_layout(document)
+        except errors.LayoutError as e:
+            for problem in e.problems:
+                sys.stderr.write('%s\n' % problem)
+            sys.exit(1)
+        model.db.session.commit()
+        sys.stdout.write('Registered %(switches)d switches, %(ports)d ports, '
+                         '%(nodes)d nodes and %(nics)d nics\n' % counts)
 
 
 class RunDevelopmentServer(Command):
@@ -101,8 +271,11 @@ class CreateAdminUser(Command):
 
 
 manager.add_command('db', db.command)
+manager.add_command('journal', journal_command.command)
 manager.add_command('migrate-ipmi-info', MigrateIpmiInfo())
 manager.add_command('serve-networks', ServeNetworks())
+manager.add_command('reconcile', Reconcile())
+manager.add_command('import-layout', ImportLayout())
 manager.add_command('run-dev-server', RunDevelopmentServer())
 manager.add_command('create-admin-user', CreateAdminUser())
 
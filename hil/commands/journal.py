@@ -0,0 +1,28 @@
+"""Implement the ``hil-admin journal`` subcommand."""
+import sys
+
+from flask_script import Manager
+
+from hil import journal, migrations, server
+
+command = Manager(usage='Manage the journal of networking actions')
+
+
+@command.option('--max-age', dest='max_age', type=float, default=None,
+                help='archive actions which finished more than this many '
+                'seconds ago (default: journal_max_age in hil.cfg, or a '
+                'week)')
+def compact(max_age):
+    """Move finished networking actions into the archive."""
+    server.init()
+    migrations.check_db_schema()
+    default_max_age, archive_max_age = journal.configured_max_ages()
+    if max_age is None:
+        max_age = default_max_age
+    elif max_age < 0:
+        sys.exit('Error: --max-age must not be negative')
+    archived, purged = journal.compact(max_age, archive_max_age)
+    sys.stdout.write('Archived %d networking actions\n' % archived)
+    if purged:
+        sys.stdout.write('Deleted %d networking actions from the archive\n'
+                         % purged)
@@ -56,11 +56,40 @@ def string_has_vlans(option):
     return True
 
 
+def string_is_positive_int(option):
+    """Check if a string is a positive integer"""
+    return option.isdigit() and int(option) > 0
+
+
+def string_is_nonnegative_int(option):
+    """Check if a string is a non-negative integer"""
+    return option.isdigit()
+
+
+def string_is_nonnegative_number(option):
+    """Check if a string is a non-negative number"""
+    try:
+        return float(option) >= 0
+    except ValueError:
+        return False
+
+
+def string_is_positive_number(option):
+    """Check if a string is a positive number"""
+    try:
+        return float(option) > 0
+    except ValueError:
+        return False
+
+
 # Note: headnode section receiving minimal checking due to soon replacement
 core_schema = {
     Optional('general'): {
         'log_level': string_is_log_level,
         Optional('log_dir'): string_is_dir,
+        Optional('networking_action_max_wait'): string_is_nonnegative_number,
+        Optional('networking_action_poll_interval'):
+            string_is_positive_number,
     },
     Optional('auth'): {
         Optional('require_authentication'): string_is_bool,
@@ -84,8 +113,28 @@ core_schema = {
         Optional('url'): string_is_web_url,
         Optional('shutdown'): '',
     },
+    Optional('obmd'): {
+        Optional('request_timeout'): string_is_nonnegative_number,
+        Optional('bulk_workers'): string_is_positive_int,
+        Optional('request_retries'): string_is_nonnegative_int,
+        Optional('retry_backoff'): string_is_nonnegative_number,
+    },
     Optional('network-daemon'): {
         Optional('sleep_time'): int,
+        Optional('switch_workers'): string_is_positive_int,
+        Optional('batch_size'): string_is_positive_int,
+        Optional('claim_timeout'): string_is_nonnegative_number,
+        Optional('notify_socket'): str,
+        Optional('session_idle_timeout'): string_is_nonnegative_number,
+        Optional('session_max_age'): string_is_nonnegative_number,
+        Optional('reconcile_interval'): string_is_nonnegative_number,
+        Optional('reconcile_fix'): string_is_bool,
+        Optional('metrics_file'): str,
+        Optional('metrics_port'): string_is_positive_int,
+        Optional('metrics_address'): str,
+        Optional('journal_compact_interval'): string_is_nonnegative_number,
+        Optional('journal_max_age'): string_is_nonnegative_number,
+        Optional('journal_archive_max_age'): string_is_nonnegative_number,
     },
     'extensions': {
         Optional(str): '',
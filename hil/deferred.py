@@ -1,12 +1,247 @@
-"""Performs deferred networking actions."""
+"""Performs deferred networking actions.
 
-from hil import model
+The network daemon's metrics (see `hil.metrics`) are defined here, and
+listed in `DAEMON_METRICS`.
+"""
+
+from hil import model, metrics
 from hil.model import db
 from hil.errors import SwitchError
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+from sqlalchemy import func
+from time import time
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Buckets for the time actions take from being queued, in seconds:
+_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+                    300.0)
+
+journal_depth = metrics.Gauge(
+    'hil_networking_journal_depth',
+    'Networking actions in the journal which are not finished, by status.',
+    ('status',))
+actions_total = metrics.Counter(
+    'hil_networking_actions_total',
+    'Networking actions finished, by switch, type and status.',
+    ('switch', 'type', 'status'))
+action_latency = metrics.Histogram(
+    'hil_networking_action_latency_seconds',
+    'Time from queueing networking actions to finishing them.',
+    ('switch',), buckets=_LATENCY_BUCKETS)
+action_wait = metrics.Histogram(
+    'hil_networking_action_wait_seconds',
+    'Time networking actions spent in the journal before being started.',
+    ('switch',), buckets=_LATENCY_BUCKETS)
+switch_operation_duration = metrics.Histogram(
+    'hil_switch_operation_duration_seconds',
+    'Time taken by switch session operations, by switch and operation.',
+    ('switch', 'operation'))
+switch_errors = metrics.Counter(
+    'hil_switch_errors_total',
+    'Switch session operations which failed, by switch and operation.',
+    ('switch', 'operation'))
+unsaved_changes_lost = metrics.Counter(
+    'hil_switch_unsaved_changes_lost_total',
+    'Switch sessions closed without saving their changes, by switch.',
+    ('switch',))
+
+DAEMON_METRICS = [journal_depth, actions_total, action_latency, action_wait,
+                  switch_operation_duration, switch_errors,
+                  unsaved_changes_lost]
+
+
+@contextmanager
+def _timed(switch, operation):
+    """Time a switch session operation, and count it if it fails.
+
+    ``operation`` is one of 'connect', 'modify_port', 'apply_port_batch',
+    'revert_port', 'save_if_due', 'save_running_config' or 'disconnect'.
+    """
+    start = time()
+    try:
+        yield
+    except Exception:
+        switch_errors.inc((switch.label, operation))
+        raise
+    finally:
+        switch_operation_duration.observe(time() - start,
+                                          (switch.label, operation))
+
+
+class _PooledSession(object):
+    """A switch session in a SessionPool, with some bookkeeping."""
+
+    def __init__(self, switch, session):
+        self.switch = switch
+        self.session = session
+        self.created = time()
+        self.last_used = self.created
+
+
+class SessionPool(object):
+    """A pool of switch sessions, which may be reused across calls to
+    apply_networking.
+
+    Logging in to a switch can take longer than the change we want to make,
+    so the network daemon keeps sessions open between bursts of actions:
+
+    * A session which has been unused for ``idle_timeout`` seconds is
+      closed. If ``idle_timeout`` is 0, sessions are closed as soon as
+      they are returned to the pool, i.e. once the journal is drained.
+    * A session which is older than ``max_age`` seconds is closed the next
+      time it is returned to the pool, or when `expire` is called. If
+      ``max_age`` is 0, sessions may live indefinitely.
+    * Before an idle session is reused, it is checked with its
+      ``is_alive`` method (see `SwitchSession.is_alive`); if that fails, a
+      new session is opened instead.
+
+    Some drivers put off saving their running config (see
+    `SwitchSession.save_if_due`). Sessions are given the chance to save
+    whenever they are returned to the pool, and when `expire` is called; a
+    session with unsaved changes is kept open past its idle timeout until
+    they are saved. Closing a session saves any outstanding changes, so
+    `close` should be called when the daemon shuts down. If a session with
+    unsaved changes dies (or fails to save them as it is closed), this is
+    logged and counted in `unsaved_changes_lost`, and the running config is
+    saved from the next session opened for the switch; the changes are
+    still in the running config, unless the switch has been restarted.
+
+    Sessions are keyed by switch id. A session is only ever checked out by
+    one thread at a time.
+    """
+
+    def __init__(self, idle_timeout=0, max_age=0):
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._sessions = {}
+        # Ids of switches whose running config must be saved from the next
+        # session opened for them:
+        self._unsaved = set()
+
+    def checkout(self, switch):
+        """Get a session for ``switch``, reusing an idle one if possible.
+
+        Returns a `_PooledSession`, which should later be passed to either
+        `checkin` or `discard`.
+        """
+        with self._lock:
+            entry = self._sessions.pop(switch.id, None)
+        if entry is not None:
+            if self._too_old(entry, time()):
+                self._disconnect(entry)
+                entry = None
+            elif not getattr(entry.session, 'is_alive', lambda: True)():
+                logger.info('Session for switch %s is no longer alive; '
+                            'reconnecting', switch.label)
+                self._disconnect(entry)
+                entry = None
+        if entry is None:
+            # The session will outlive the current database session, so it
+            # gets a fully-loaded copy of the switch which isn't attached to
+            # any database session. (The switch may already have been
+            # detached, if we've just discarded a session for it.)
+            if switch in db.session:
+                db.session.refresh(switch)
+                db.session.expunge(switch)
+            with _timed(switch, 'connect'):
+                entry = _PooledSession(switch, switch.session())
+            with self._lock:
+                unsaved = switch.id in self._unsaved
+            if unsaved:
+                try:
+                    with _timed(switch, 'save_running_config'):
+                        entry.session.save_running_config()
+                except Exception:
+                    self._disconnect(entry)
+                    raise
+                with self._lock:
+                    self._unsaved.discard(switch.id)
+        return entry
+
+    def checkin(self, switch_id, entry):
+        """Return a session to the pool, once a worker is done with it."""
+        entry.last_used = time()
+        self._release(switch_id, entry, entry.last_used)
+
+    def discard(self, entry):
+        """Close a session which may be in a bad state.
+
+        This is used when the switch reports an error, so that the next
+        action on the switch starts from a fresh connection.
+        """
+        self._disconnect(entry)
+
+    def expire(self):
+        """Save changes that are due, and close sessions which have timed out
+        or grown too old.
+
+        This must not be called while apply_networking is running.
+        """
+        now = time()
+        with self._lock:
+            entries = self._sessions
+            self._sessions = {}
+        for switch_id, entry in entries.items():
+            self._release(switch_id, entry, now)
+
+    def close(self):
+        """Close all of the idle sessions, saving any unsaved changes."""
+        with self._lock:
+            entries = self._sessions.values()
+            self._sessions = {}
+        for entry in entries:
+            self._disconnect(entry)
+
+    def _release(self, switch_id, entry, now):
+        """Give the session a chance to save, then either keep or close it."""
+        try:
+            with _timed(entry.switch, 'save_if_due'):
+                getattr(entry.session, 'save_if_due', lambda: None)()
+        except Exception:
+            logger.exception('Error saving the running config of switch %s',
+                             entry.switch.label)
+            self._disconnect(entry)
+            return
+
+        unsaved = getattr(entry.session, 'has_unsaved_changes',
+                          lambda: False)()
+        idle = now - entry.last_used >= self.idle_timeout
+        if self._too_old(entry, now) or (idle and not unsaved):
+            self._disconnect(entry)
+        else:
+            with self._lock:
+                self._sessions[switch_id] = entry
+
+    def _too_old(self, entry, now):
+        """Return whether the session has exceeded ``max_age``."""
+        return self.max_age > 0 and now - entry.created >= self.max_age
+
+    def _disconnect(self, entry):
+        """Disconnect the session, logging (but otherwise ignoring) errors.
+
+        Disconnecting saves any unsaved changes; if it fails to, see the
+        class docstring.
+        """
+        try:
+            with _timed(entry.switch, 'disconnect'):
+                entry.session.disconnect()
+        except Exception:
+            logger.exception('Error disconnecting from switch %s',
+                             entry.switch.label)
+        if getattr(entry.session, 'has_unsaved_changes', lambda: False)():
+            logger.error('Session for switch %s was closed with unsaved '
+                         'changes; they will be saved from the next session',
+                         entry.switch.label)
+            unsaved_changes_lost.inc((entry.switch.label,))
+            with self._lock:
+                self._unsaved.add(entry.switch.id)
+
 
 class DaemonSession(object):
     """A daemon session tracks switch sessions during a call to
@@ -14,10 +249,11 @@ class DaemonSession(object):
 
     When applying a networking action, if the DaemonSession does not
     already have a switch session for the relevant switch, it will
-    create one, and cache it for next time.
+    get one from its `SessionPool`, and cache it for next time.
     """
 
-    def __init__(self):
+    def __init__(self, pool):
+        self.pool = pool
         self.switch_sessions = {}
 
     def handle_action(self, action):
@@ -31,64 +267,378 @@ class DaemonSession(object):
         else:
             getattr(self, action.type)(action)
 
+    def handle_actions(self, actions):
+        """Apply a list of networking actions, in order.
+
+        modify_port actions on the same nic (as queued together by
+        `api.networking_action_batch`) are coalesced, and handed to the
+        switch as a single batch (see `SwitchSession.apply_port_batch`),
+        unless another type of action on the nic comes between them. Actions
+        on different nics may be applied out of order relative to one
+        another; they affect different ports.
+        """
+        groups = []
+        open_groups = {}
+        for action in actions:
+            if action.type == 'modify_port' and action.nic.port:
+                if action.nic_id not in open_groups:
+                    open_groups[action.nic_id] = []
+                    groups.append(open_groups[action.nic_id])
+                open_groups[action.nic_id].append(action)
+            else:
+                open_groups.pop(action.nic_id, None)
+                groups.append([action])
+
+        for group in groups:
+            if len(group) == 1:
+                self.handle_action(group[0])
+            else:
+                self.modify_port_batch(group)
+
     def modify_port(self, action):
         """Apply a modify_port action."""
         session = self.get_session(action.nic.port.owner)
 
-        if action.new_network is None:
-            network_id = None
-        else:
-            network_id = action.new_network.network_id
+        try:
+            with _timed(action.nic.port.owner, 'modify_port'):
+                session.modify_port(action.nic.port.label,
+                                    action.channel,
+                                    _network_id(action))
+            self._modify_port_done(action)
+        except SwitchError:
+            _finish(action, 'ERROR')
+            logger.error('Modify port failed on port %s of switch %s',
+                         action.nic.port.label, action.nic.port.owner.label)
+            self.discard_session(action.nic.port.owner)
+
+    def modify_port_batch(self, actions):
+        """Apply several modify_port actions on the same nic at once.
+
+        If the switch session doesn't support batches, or the batch fails,
+        the actions are applied one at a time, so that each of them is
+        marked DONE or ERROR individually.
+        """
+        port = actions[0].nic.port
+        session = self.get_session(port.owner)
+
+        if not hasattr(session, 'apply_port_batch'):
+            for action in actions:
+                self.modify_port(action)
+            return
 
         try:
-            session.modify_port(action.nic.port.label,
-                                action.channel,
-                                network_id)
-            if action.new_network is None:
-                model.NetworkAttachment.query \
-                    .filter_by(nic=action.nic, channel=action.channel)\
-                    .delete()
-            else:
+            with _timed(port.owner, 'apply_port_batch'):
+                session.apply_port_batch(
+                    port.label,
+                    [(action.channel, _network_id(action))
+                     for action in actions])
+        except SwitchError:
+            logger.warn('Batch of %d changes failed on port %s of switch %s; '
+                        'retrying them individually',
+                        len(actions), port.label, port.owner.label)
+            self.discard_session(port.owner)
+            for action in actions:
+                self.modify_port(action)
+            return
+
+        for action in actions:
+            self._modify_port_done(action)
+
+    @staticmethod
+    def _modify_port_done(action):
+        """Record the completion of a modify_port action."""
+        if action.new_network is None:
+            model.NetworkAttachment.query \
+                .filter_by(nic=action.nic, channel=action.channel)\
+                .delete()
+        else:
+            # The channel is normally free (the API checks), but actions
+            # queued by hil.reconcile may re-apply an existing attachment:
+            attachment = model.NetworkAttachment.query \
+                .filter_by(nic=action.nic, channel=action.channel).first()
+            if attachment is None:
                 db.session.add(model.NetworkAttachment(
                     nic=action.nic,
                     network=action.new_network,
                     channel=action.channel))
-            action.status = 'DONE'
-        except SwitchError:
-            action.status = 'ERROR'
-            logger.error('Modify port failed on port %s of switch %s',
-                         action.nic.port.label, action.nic.port.owner.label)
+            else:
+                attachment.network = action.new_network
+        _finish(action, 'DONE')
 
     def revert_port(self, action):
         """Apply a revert_port action."""
         session = self.get_session(action.nic.port.owner)
         try:
-            session.revert_port(action.nic.port.label)
+            with _timed(action.nic.port.owner, 'revert_port'):
+                session.revert_port(action.nic.port.label)
             model.NetworkAttachment.query.filter_by(nic=action.nic).delete()
-            action.status = 'DONE'
+            _finish(action, 'DONE')
         except SwitchError:
-            action.status = 'ERROR'
+            _finish(action, 'ERROR')
             logger.error('Revert port failed on port %s of switch %s',
                          action.nic.port.label, action.nic.port.owner.label)
+            self.discard_session(action.nic.port.owner)
 
     def get_session(self, switch):
         """Get a session for the switch.
 
-        If we don't already have one, create a new one and cache it. Otherwise,
-        return the cached session.
+        If we don't already have one, get one from the pool and cache it.
+        Otherwise, return the cached session.
         """
-        if switch.label not in self.switch_sessions:
-            self.switch_sessions[switch.label] = switch.session()
-        return self.switch_sessions[switch.label]
+        if switch.id not in self.switch_sessions:
+            self.switch_sessions[switch.id] = self.pool.checkout(switch)
+        return self.switch_sessions[switch.id].session
 
-    def close(self):
-        """Shut down all of the open switch sessions."""
-        for session in self.switch_sessions.values():
-            session.disconnect()
+    def discard_session(self, switch):
+        """Close our session for the switch, if any.
+
+        The next call to `get_session` will open a new one.
+        """
+        entry = self.switch_sessions.pop(switch.id, None)
+        if entry is not None:
+            self.pool.discard(entry)
+
+    def close(self, discard=False):
+        """Return all of our switch sessions to the pool.
+
+        If ``discard`` is True, they are closed instead; see
+        `SessionPool.discard`.
+        """
+        for switch_id, entry in self.switch_sessions.items():
+            if discard:
+                self.pool.discard(entry)
+            else:
+                self.pool.checkin(switch_id, entry)
         self.switch_sessions = {}
 
 
-def apply_networking():
+def _finish(action, status):
+    """Mark ``action`` as finished, with ``status``, and record its metrics.
+
+    ``status`` is 'DONE' or 'ERROR'.
+    """
+    action.status = status
+    action.finished_at = datetime.utcnow()
+    switch = action.nic.port.owner.label
+    actions_total.inc((switch, action.type, status))
+    if action.created_at is not None:
+        action_latency.observe(
+            (action.finished_at - action.created_at).total_seconds(),
+            (switch,))
+
+
+def _observe_wait(action):
+    """Record the time ``action`` spent in the journal before it started."""
+    if action.created_at is not None and action.started_at is not None \
+            and action.nic.port is not None:
+        action_wait.observe(
+            (action.started_at - action.created_at).total_seconds(),
+            (action.nic.port.owner.label,))
+
+
+def _network_id(action):
+    """Return the network id that a modify_port action moves its nic to.
+
+    This is None if the action detaches the nic.
+    """
+    if action.new_network is None:
+        return None
+    return action.new_network.network_id
+
+
+def _pending_switch_ids():
+    """Return the ids of the switches which have pending actions.
+
+    Actions on nics which are not attached to a port are not included; they
+    cannot be applied to any switch.
+    """
+    rows = db.session.query(model.Port.owner_id) \
+        .join(model.Nic, model.Nic.port_id == model.Port.id) \
+        .join(model.NetworkingAction,
+              model.NetworkingAction.nic_id == model.Nic.id) \
+        .filter(model.NetworkingAction.unclaimed()) \
+        .distinct().all()
+    return sorted(row[0] for row in rows)
+
+
+def _next_action(switch_id):
+    """Return the oldest pending action for the switch, or None."""
+    return model.NetworkingAction.query \
+        .join(model.Nic, model.NetworkingAction.nic_id == model.Nic.id) \
+        .join(model.Port, model.Nic.port_id == model.Port.id) \
+        .filter(model.Port.owner_id == switch_id,
+                model.NetworkingAction.unclaimed()) \
+        .order_by(model.NetworkingAction.id).first()
+
+
+def _claim_actions(switch_id, batch_size):
+    """Claim up to ``batch_size`` of the switch's pending actions.
+
+    The claimed actions are marked 'IN_PROGRESS' with a single UPDATE; the
+    caller is responsible for committing the claim. On PostgreSQL, the rows
+    are selected with ``FOR UPDATE SKIP LOCKED``, so that rows which another
+    transaction is in the middle of claiming are passed over rather than
+    waited on. SQLite doesn't support row locks, but it serializes writers,
+    and the UPDATE only touches rows which are still 'PENDING'.
+
+    Returns the ids of the claimed actions, in order.
+    """
+    ids = db.session.query(model.NetworkingAction.id) \
+        .join(model.Nic, model.NetworkingAction.nic_id == model.Nic.id) \
+        .join(model.Port, model.Nic.port_id == model.Port.id) \
+        .filter(model.Port.owner_id == switch_id,
+                model.NetworkingAction.unclaimed()) \
+        .order_by(model.NetworkingAction.id) \
+        .limit(batch_size) \
+        .with_for_update(skip_locked=True, of=model.NetworkingAction) \
+        .all()
+    ids = [row[0] for row in ids]
+    if ids:
+        model.NetworkingAction.query \
+            .filter(model.NetworkingAction.id.in_(ids),
+                    model.NetworkingAction.status == 'PENDING') \
+            .update({'status': 'IN_PROGRESS',
+                     'started_at': datetime.utcnow()},
+                    synchronize_session=False)
+    return ids
+
+
+def _unclaim(ids):
+    """Return those of the actions with the given ids which are still
+    'IN_PROGRESS' to the journal.
+
+    The caller is responsible for committing.
+    """
+    model.NetworkingAction.query \
+        .filter(model.NetworkingAction.id.in_(ids),
+                model.NetworkingAction.status == 'IN_PROGRESS') \
+        .update({'status': 'PENDING'}, synchronize_session=False)
+
+
+def _claimed_actions(ids):
+    """Return the claimed actions with the given ids, in order."""
+    if not ids:
+        return []
+    return model.NetworkingAction.query \
+        .filter(model.NetworkingAction.id.in_(ids),
+                model.NetworkingAction.status == 'IN_PROGRESS') \
+        .order_by(model.NetworkingAction.id).all()
+
+
+def _drain_switch(switch_id, pool, batch_size=1):
+    """Apply all of the pending actions for a single switch.
+
+    Actions are applied in the order they were queued, so changes to any
+    given port happen in order.
+
+    If ``batch_size`` is 1, each action is fetched and committed on its own.
+    Otherwise, actions are claimed ``batch_size`` at a time, and the results
+    for each batch are committed together with the claim on the next one.
+
+    If anything other than the switch raises an error (which is handled in
+    `DaemonSession`), the error is propagated, and the current batch is
+    returned to the journal rather than being left claimed. Unless the error
+    is a `SwitchError`, the switch sessions are discarded rather than
+    returned to the pool, since they may have been left in any state (e.g.
+    part way through reading a prompt).
+    """
+    session = DaemonSession(pool)
+    # The ids of the batch whose claim, but not results, has been committed:
+    claimed = []
+    try:
+        if batch_size > 1:
+            ids = _claim_actions(switch_id, batch_size)
+            db.session.commit()
+            claimed = ids
+            while ids:
+                actions = _claimed_actions(ids)
+                session.handle_actions(actions)
+                for action in actions:
+                    _observe_wait(action)
+                ids = _claim_actions(switch_id, batch_size)
+                db.session.commit()
+                claimed = ids
+        else:
+            action = _next_action(switch_id)
+            while action is not None:
+                started_at = datetime.utcnow()
+                session.handle_action(action)
+                # Setting this any earlier would have it flushed before the
+                # switch is done with, holding the database's write lock
+                # while we wait on the switch:
+                action.started_at = started_at
+                _observe_wait(action)
+                db.session.commit()
+                action = _next_action(switch_id)
+            # The last query opened a transaction; close it out.
+            db.session.commit()
+    except Exception as e:
+        if not isinstance(e, SwitchError):
+            session.close(discard=True)
+        db.session.rollback()
+        if claimed:
+            _unclaim(claimed)
+            db.session.commit()
+        raise
+    finally:
+        session.close()
+
+
+def _drain_switch_in_thread(args):
+    """Like _drain_switch, but for use in a worker thread.
+
+    ``args`` is a tuple of the arguments to _drain_switch.
+
+    Each thread gets its own database session (db.session is thread-local),
+    which must be discarded when the thread is done with it. Exceptions are
+    logged rather than propagated, so that a failure on one switch does not
+    prevent the others from being serviced.
+    """
+    try:
+        _drain_switch(*args)
+    except Exception:
+        logger.exception('Unexpected error applying networking actions '
+                         'on switch with id %d', args[0])
+        db.session.rollback()
+    finally:
+        db.session.remove()
+
+
+def release_claims(max_age):
+    """Return stale claimed but unfinished actions to the journal.
+
+    If a network daemon is stopped while it is part way through a batch,
+    the remaining actions are left 'IN_PROGRESS'. This marks those which
+    were claimed more than ``max_age`` seconds ago 'PENDING' again, so they
+    will be retried. Several daemons may be running at once, so more recent
+    claims are left alone; they may belong to a daemon which is still
+    applying them. ``max_age`` should therefore be longer than a batch can
+    take to apply. If it is 0, every claim is released.
+    """
+    table = model.NetworkingAction
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    count = table.query \
+        .filter(table.status == 'IN_PROGRESS',
+                db.or_(table.started_at <= cutoff,
+                       table.started_at.is_(None))) \
+        .update({'status': 'PENDING'}, synchronize_session=False)
+    db.session.commit()
+    if count:
+        logger.info('Returned %d unfinished networking actions to the '
+                    'journal', count)
+
+
+def _update_journal_depth():
+    """Count the unfinished actions in the journal, for `journal_depth`."""
+    status = model.NetworkingAction.status
+    counts = dict(db.session.query(status, func.count())
+                  .filter(status.in_(model.NetworkingAction.pending_statuses))
+                  .group_by(status))
+    for name in model.NetworkingAction.pending_statuses:
+        journal_depth.set((name,), counts.get(name, 0))
+
+
+def apply_networking(workers=1, batch_size=1, pool=None):
     """Do each networking action in the journal, then cross them off.
 
     Returns False if the journal was empty, and True if there were journal
@@ -104,28 +654,47 @@ def apply_networking():
     returns immediately, the server should sleep, because there was no time for
     new entries to be added.  This keeps the networking server from
     tight-looping.
-    """
 
-    action = model.NetworkingAction.query \
-        .order_by(model.NetworkingAction.id) \
-        .filter_by(status='PENDING').first()
+    Pending actions are partitioned by switch. ``workers`` is the maximum
+    number of switches to work on concurrently; each switch gets its own
+    worker thread, which applies that switch's actions in order. If
+    ``workers`` is 1 (the default), switches are processed one after another
+    in the calling thread.
 
-    if action is None:
-        db.session.commit()
-        return False
+    ``batch_size`` is the number of actions to claim from the journal at a
+    time; see `_drain_switch`.
 
-    session = DaemonSession()
-    while action is not None:
-        session.handle_action(action)
-        db.session.commit()
-        # Get the next action
-        action = model.NetworkingAction.query \
-            .order_by(model.NetworkingAction.id)\
-            .filter_by(status='PENDING').first()
-
-    # the last statement in the while loop opens a new db session that we must
-    # close when we exit the loop.
+    ``pool`` is the `SessionPool` to get switch sessions from. If it is
+    None, a new pool is used, and all of its sessions are closed before
+    returning.
+    """
+    _update_journal_depth()
+    switch_ids = _pending_switch_ids()
     db.session.commit()
 
-    session.close()
+    if not switch_ids:
+        return False
+
+    own_pool = pool is None
+    if own_pool:
+        pool = SessionPool()
+
+    try:
+        if workers <= 1 or len(switch_ids) == 1:
+            for switch_id in switch_ids:
+                _drain_switch(switch_id, pool, batch_size)
+        else:
+            threads = ThreadPool(min(workers, len(switch_ids)))
+            try:
+                threads.map(_drain_switch_in_thread,
+                            [(switch_id, pool, batch_size)
+                             for switch_id in switch_ids])
+            finally:
+                threads.close()
+                threads.join()
+    finally:
+        # Sessions with unsaved changes outlive their idle timeout, so
+        # they'd be left open if we didn't close the pool:
+        if own_pool:
+            pool.close()
     return True
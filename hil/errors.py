@@ -63,6 +63,44 @@ class BadArgumentError(APIError):
     """An exception indicating an invalid request on the part of the user."""
 
 
+class ProblemListError(BadArgumentError):
+    """An exception indicating that a request which is checked as a whole
+    (a layout document, a batch of networking actions...) was rejected.
+
+    ``problems`` is a list of strings, one for each problem found. They are
+    included in the response body as the list ``problems``.
+    """
+
+    # What was checked, for use in the message:
+    subject = 'the request'
+
+    def __init__(self, problems):
+        BadArgumentError.__init__(
+            self, '%d problem(s) found in %s:\n%s' %
+            (len(problems), self.subject, '\n'.join(problems)))
+        self.problems = problems
+
+    def get_response(self, environ=None):
+        """The body of the http response corresponding to this error."""
+        return flask.make_response(json.dumps({
+            'type': self.__class__.__name__,
+            'msg': self.message,
+            'problems': self.problems,
+        }), self.status_code)
+
+
+class LayoutError(ProblemListError):
+    """An exception indicating that a layout document (see ``hil.layout``)
+    could not be imported."""
+    subject = 'the layout'
+
+
+class NetworkingBatchError(ProblemListError):
+    """An exception indicating that a batch of networking actions could not
+    be queued."""
+    subject = 'the batch'
+
+
 class ProjectMismatchError(APIError):
     """An exception indicating that the resources given don't belong to the
     same project.
@@ -1,24 +1,57 @@
 """Auth plugin using usernames & passwords in the DB, with HTTP basic auth.
 
 Includes API calls for managing users.
+
+Verifying a password is deliberately slow, so successful verifications are
+cached for a while (see `DatabaseAuthBackend`). Clients may also trade
+their password for a session token (see `token_create`), if the server is
+configured with a ``token_secret``.
 """
-from hil import api, model, auth, errors
+from hil import api, model, auth, errors, metrics
+from hil.cache import TTLCache
+from hil.config import cfg, core_schema, string_is_nonnegative_number, \
+    string_is_positive_int
 from hil.model import db
 from hil.auth import get_auth_backend
 from hil.rest import rest_call, local, ContextLogger
+from itsdangerous import URLSafeTimedSerializer, BadData
 from passlib.hash import sha512_crypt
 from schema import Schema, Optional
 import flask
+import hashlib
+import hmac
+import json
 import logging
+import os
 from os.path import join, dirname
 from hil.migrations import paths
 from hil.model import BigIntegerType
-import json
 
 logger = ContextLogger(logging.getLogger(__name__), {})
 
 paths[__name__] = join(dirname(__file__), 'migrations', 'database')
 
+core_schema[Optional(__name__)] = {
+    Optional('credential_cache_ttl'): string_is_nonnegative_number,
+    Optional('credential_cache_size'): string_is_positive_int,
+    Optional('token_secret'): str,
+    Optional('token_ttl'): string_is_positive_int,
+}
+
+# The header in which clients present session tokens:
+TOKEN_HEADER = 'X-Auth-Token'
+
+# Passwords which have been verified recently; see DatabaseAuthBackend.
+# Replaced by setup():
+credential_cache = TTLCache(ttl=0, max_size=0)
+
+metrics.register_cache('auth_database_credentials',
+                       lambda: credential_cache)
+
+# The key for the hashes of passwords kept in credential_cache. It is never
+# stored anywhere, so the hashes are useless outside of this process:
+_CACHE_KEY = os.urandom(32)
+
 
 class User(db.Model):
     """A user of the HIL.
@@ -52,6 +85,16 @@ class User(db.Model):
     def set_password(self, password):
         """Set the user's password to `password` (which must be plaintext)."""
         self.hashed_password = sha512_crypt.encrypt(password)
+        credential_cache.invalidate(self.label)
+
+    def password_fingerprint(self):
+        """Return a short digest of the user's hashed password.
+
+        This is embedded in session tokens, so that changing the password
+        revokes them.
+        """
+        return hashlib.sha256(
+            self.hashed_password.encode('utf-8')).hexdigest()[:16]
 
 
 # A joining table for users and projects, which have a many to many
@@ -61,17 +104,19 @@ user_projects = db.Table('user_projects',
                          db.Column('project_id', db.ForeignKey('project.id')))
 
 
-@rest_call('GET', '/auth/basic/users', schema=Schema({}))
-def list_users():
-    """List all users with database authentication"""
+@rest_call('GET', '/auth/basic/users', schema=api.list_schema())
+def list_users(limit=None, after=None, prefix=None, stream=False):
+    """List all users with database authentication
+
+    See `hil.api.list_schema` for the optional arguments.
+    """
     get_auth_backend().require_admin()
-    users = User.query.all()
-    result = {}
-    for u in users:
-        user = {'is_admin': u.is_admin,
-                'projects': sorted(p.label for p in u.projects)}
-        result[u.label] = user
-    return json.dumps(result, sort_keys=True)
+    return api.list_response(
+        User.query.options(db.selectinload('projects')),
+        User.label,
+        lambda u: (u.label, {'is_admin': u.is_admin,
+                             'projects': sorted(p.label for p in u.projects)}),
+        keyed=True, limit=limit, after=after, prefix=prefix, stream=stream)
 
 
 @rest_call('PUT', '/auth/basic/user/<user>', schema=Schema({
@@ -107,6 +152,7 @@ def user_delete(user):
     # hil.api:
     user = api.get_or_404(User, user)
 
+    credential_cache.invalidate(user.label)
     db.session.delete(user)
     db.session.commit()
 
@@ -127,6 +173,7 @@ def user_add_project(user, project):
         raise errors.DuplicateError(
             'User %s is already in project %s' % (user.label, project.label))
     user.projects.append(project)
+    local.pop('auth_project_ids', None)
     db.session.commit()
 
 
@@ -146,6 +193,7 @@ def user_remove_project(user, project):
         raise errors.NotFoundError(
             "User %s is not in project %s" % (user.label, project.label))
     user.projects.remove(project)
+    local.pop('auth_project_ids', None)
     db.session.commit()
 
 
@@ -159,26 +207,90 @@ def user_set_admin(user, is_admin):
     user = api.get_or_404(User, user)
     if user.label == local.auth.label:
         raise errors.IllegalStateError("Cannot set own admin status")
+    credential_cache.invalidate(user.label)
     user.is_admin = is_admin
     db.session.commit()
 
 
+@rest_call('POST', '/auth/basic/token', Schema({}))
+def token_create():
+    """Issue a session token for the authenticated user.
+
+    The token may be sent in the ``X-Auth-Token`` header in place of the
+    user's password, until it expires or the password is changed. Returns
+    the token, and the number of seconds it is valid for.
+
+    Raises NotFoundError if the server has no ``token_secret`` configured.
+    """
+    serializer = _token_serializer()
+    if serializer is None:
+        raise errors.NotFoundError(
+            "Session tokens are not enabled on this server.")
+    user = local.auth
+    if user is None:
+        raise errors.AuthorizationError(
+            "A session token can only be issued to an authenticated user.")
+    return json.dumps({
+        'token': serializer.dumps({
+            'user': user.label,
+            'password': user.password_fingerprint(),
+        }),
+        'expires_in': _token_ttl(),
+    })
+
+
+def _token_serializer():
+    """Return the serializer for session tokens.
+
+    Returns None if session tokens aren't enabled.
+    """
+    if not cfg.has_option(__name__, 'token_secret'):
+        return None
+    return URLSafeTimedSerializer(cfg.get(__name__, 'token_secret'),
+                                  salt=__name__ + '.token')
+
+
+def _token_ttl():
+    """Return the number of seconds a session token is valid for."""
+    if cfg.has_option(__name__, 'token_ttl'):
+        return cfg.getint(__name__, 'token_ttl')
+    return 3600
+
+
+def _password_digest(password):
+    """Return a keyed hash of ``password``, for use in credential_cache."""
+    if isinstance(password, unicode):
+        password = password.encode('utf-8')
+    return hmac.new(_CACHE_KEY, password, hashlib.sha256).digest()
+
+
 class DatabaseAuthBackend(auth.AuthBackend):
     """
     Auth backend using basic auth, with usernames & passwords stored in the DB.
+
+    Requests may instead carry a session token (see `token_create`) in the
+    ``X-Auth-Token`` header.
+
+    When a user's password is verified, a keyed hash of it is stored in
+    `credential_cache`, along with the user's hashed password at the time.
+    Later requests with the same password skip the (expensive) verification,
+    as long as the user's hashed password hasn't changed since.
     """
 
     def authenticate(self):
         # pylint: disable=missing-docstring
         local.auth = None
-        if flask.request.authorization is None:
-            return False
         authorization = flask.request.authorization
+        if authorization is None:
+            token = flask.request.headers.get(TOKEN_HEADER)
+            if token is None:
+                return False
+            return self._authenticate_token(token)
         if authorization.password is None:
             return False
 
         user = api.get_or_404(User, authorization.username)
-        if user.verify_password(authorization.password):
+        if self._verify_password(user, authorization.password):
             local.auth = user
             logger.info("Successful authentication for user %r", user.label)
             return True
@@ -186,15 +298,87 @@ class DatabaseAuthBackend(auth.AuthBackend):
             logger.info("Failed authentication for user %r", user.label)
             return False
 
+    def _verify_password(self, user, password):
+        """Return whether ``password`` is ``user``'s password.
+
+        Consults and updates `credential_cache`.
+        """
+        digest = _password_digest(password)
+        cached = credential_cache.get(user.label)
+        if cached is not None:
+            cached_digest, hashed_password = cached
+            if hmac.compare_digest(cached_digest, digest) and \
+                    hashed_password == user.hashed_password:
+                return True
+        if not user.verify_password(password):
+            return False
+        credential_cache.put(user.label, (digest, user.hashed_password))
+        return True
+
+    def _authenticate_token(self, token):
+        """Authenticate the request with a session token."""
+        serializer = _token_serializer()
+        if serializer is None:
+            logger.info("Session token presented, but tokens are disabled")
+            return False
+        try:
+            payload = serializer.loads(token, max_age=_token_ttl())
+        except BadData:
+            logger.info("Invalid or expired session token")
+            return False
+        user = User.query.filter_by(label=payload.get('user')).first()
+        if user is None or \
+                payload.get('password') != user.password_fingerprint():
+            logger.info("Session token for user %r has been revoked",
+                        payload.get('user'))
+            return False
+        local.auth = user
+        logger.info("Successful authentication for user %r (session token)",
+                    user.label)
+        return True
+
     def _have_admin(self):
         user = local.auth
         return user is not None and user.is_admin
 
     def _have_project_access(self, project):
         user = local.auth
-        return user is not None and project in user.projects
+        if user is None:
+            return False
+        return project.id in _project_ids(user)
+
+
+def _project_ids(user):
+    """Return the set of ids of the projects ``user`` is a member of.
+
+    API calls may check access to many projects (e.g. ``show_network``
+    checks every attachment), so the set is loaded with one query, and
+    remembered until the end of the request.
+    """
+    memo = local.get('auth_project_ids')
+    if memo is not None and memo[0] == user.id:
+        return memo[1]
+    project_ids = frozenset(
+        project_id for (project_id,) in db.session.query(
+            user_projects.c.project_id).filter(
+                user_projects.c.user_id == user.id))
+    local.auth_project_ids = (user.id, project_ids)
+    return project_ids
+
+
+def _make_credential_cache():
+    """Return an empty credential cache, configured as per the config."""
+    ttl = 300
+    max_size = 1024
+    if cfg.has_option(__name__, 'credential_cache_ttl'):
+        ttl = cfg.getfloat(__name__, 'credential_cache_ttl')
+    if cfg.has_option(__name__, 'credential_cache_size'):
+        max_size = cfg.getint(__name__, 'credential_cache_size')
+    return TTLCache(ttl=ttl, max_size=max_size)
 
 
 def setup(*args, **kwargs):
     """Set a DatabaseAuthBackend as the auth backend."""
+    global credential_cache
+    credential_cache = _make_credential_cache()
     auth.set_auth_backend(DatabaseAuthBackend())
@@ -1,13 +1,24 @@
 """Keystone authentication backend.
 
 This is a thin wrapper around the `keystonemiddleware` library.
+
+Validating a token means a round trip to keystone (or at least to
+keystonemiddleware's token cache), so the identities of recently validated
+tokens are cached in front of the middleware; see `IdentityCache`. The
+projects which are known to be registered with HIL are cached too. Both
+caches are kept in-process, unless ``cache_memcached_servers`` is set, in
+which case they are kept in memcached and shared between processes.
 """
 from keystonemiddleware.auth_token import filter_factory
 from flask import request
+from hil.cache import TTLCache, MemcacheStore
 from hil.flaskapp import app
-from hil.config import cfg, core_schema, string_is_web_url
+from hil.config import cfg, core_schema, string_is_web_url, \
+    string_is_nonnegative_number, string_is_positive_int
 from hil.model import Project
-from hil import auth, rest
+from hil import auth, metrics, rest
+from schema import Optional
+import hashlib
 import logging
 import sys
 
@@ -21,8 +32,89 @@ core_schema[__name__] = {
     'project_name': str,
     'admin_user': str,
     'admin_password': str,
+    Optional('identity_cache_ttl'): string_is_nonnegative_number,
+    Optional('identity_cache_size'): string_is_positive_int,
+    Optional('project_cache_ttl'): string_is_nonnegative_number,
+    Optional('project_cache_size'): string_is_positive_int,
+    Optional('cache_memcached_servers'): str,
+}
+
+# Options in our section of hil.cfg which are for us, rather than for
+# keystonemiddleware, with their defaults:
+_CACHE_OPTIONS = {
+    'identity_cache_ttl': '60',
+    'identity_cache_size': '1024',
+    'project_cache_ttl': '60',
+    'project_cache_size': '1024',
+    'cache_memcached_servers': '',
 }
 
+# The wsgi environment variables which keystonemiddleware sets, and which we
+# read; see KeystoneAuthBackend.authenticate:
+_IDENTITY_VARS = ('HTTP_X_IDENTITY_STATUS',
+                  'HTTP_X_PROJECT_ID',
+                  'HTTP_X_ROLES')
+
+# The caches of validated tokens' identities, and of the labels of
+# registered projects. Replaced by setup():
+identity_cache = TTLCache(ttl=0, max_size=0)
+project_cache = TTLCache(ttl=0, max_size=0)
+
+metrics.register_cache('keystone_identity', lambda: identity_cache)
+metrics.register_cache('keystone_project', lambda: project_cache)
+
+
+class IdentityCache(object):
+    """WSGI middleware which caches keystonemiddleware's results.
+
+    ``keystone_factory`` is keystonemiddleware's filter factory, and ``app``
+    is the wsgi app to wrap. ``cache`` is a `TTLCache` or `MemcacheStore`,
+    in which the identity variables of validated tokens are kept, keyed by a
+    hash of the token.
+
+    When a request carries a token which is in the cache, keystonemiddleware
+    is skipped, and the cached identity is put in the environment instead.
+    Otherwise the request goes through keystonemiddleware, and if the token
+    was valid, its identity is cached on the way to the app. A revoked token
+    may thus keep working for as long as the cache's ttl.
+    """
+
+    def __init__(self, keystone_factory, app, cache):
+        self.app = app
+        self.cache = cache
+        self.keystone = keystone_factory(self._remember)
+
+    def __call__(self, environ, start_response):
+        token = environ.get('HTTP_X_AUTH_TOKEN')
+        if token is None or not self.cache.enabled:
+            return self.keystone(environ, start_response)
+        identity = self.cache.get(_token_key(token))
+        if identity is None:
+            return self.keystone(environ, start_response)
+        # Anything the client sent in these must not survive:
+        for var in _IDENTITY_VARS:
+            environ.pop(var, None)
+        environ.update(identity)
+        return self.app(environ, start_response)
+
+    def _remember(self, environ, start_response):
+        """Cache the identity keystonemiddleware found, then call the app."""
+        token = environ.get('HTTP_X_AUTH_TOKEN')
+        if token is not None and self.cache.enabled and \
+                environ.get('HTTP_X_IDENTITY_STATUS') == 'Confirmed':
+            self.cache.put(_token_key(token),
+                           dict((var, environ[var]) for var in _IDENTITY_VARS
+                                if var in environ))
+        return self.app(environ, start_response)
+
+
+def _token_key(token):
+    """Return the cache key for ``token``.
+
+    Tokens are credentials, so only a hash of them is kept.
+    """
+    return hashlib.sha256(token).hexdigest()
+
 
 class KeystoneAuthBackend(auth.AuthBackend):
     """Authenticate with keystone."""
@@ -48,12 +140,14 @@ class KeystoneAuthBackend(auth.AuthBackend):
             return True
 
         project_id = request.environ['HTTP_X_PROJECT_ID']
+        if project_cache.get(project_id) is not None:
+            return True
         if Project.query.filter_by(label=project_id).first() is None:
             logger.info("Successful authentication by Openstack project %r, "
                         "but this project is not registered with HIL",
                         project_id)
             return False
-
+        project_cache.put(project_id, True)
         return True
 
     def _have_project_access(self, project):
@@ -63,22 +157,56 @@ class KeystoneAuthBackend(auth.AuthBackend):
         return 'admin' in request.environ['HTTP_X_ROLES'].split(',')
 
 
+def _make_caches(options):
+    """Return the identity and project caches, as configured by ``options``.
+
+    ``options`` maps the names in _CACHE_OPTIONS to their (string) values.
+    """
+    identity_ttl = float(options['identity_cache_ttl'])
+    project_ttl = float(options['project_cache_ttl'])
+    servers = [server.strip()
+               for server in options['cache_memcached_servers'].split(',')
+               if server.strip()]
+    if not servers:
+        return (TTLCache(ttl=identity_ttl,
+                         max_size=int(options['identity_cache_size'])),
+                TTLCache(ttl=project_ttl,
+                         max_size=int(options['project_cache_size'])))
+    try:
+        import memcache
+    except ImportError:
+        logger.error('cache_memcached_servers is set in [%s], but the '
+                     'python-memcached library is not installed.', __name__)
+        sys.exit(1)
+    client = memcache.Client(servers)
+    return (MemcacheStore(client, ttl=identity_ttl,
+                          prefix='hil-keystone-identity:'),
+            MemcacheStore(client, ttl=project_ttl,
+                          prefix='hil-keystone-project:'))
+
+
 def setup(*args, **kwargs):
     """Set a KeystoneAuthBackend as the auth backend.
 
     Loads keystone settings from hil.cfg.
     """
+    global identity_cache, project_cache
     if not cfg.has_section(__name__):
         logger.error('No section for [%s] in hil.cfg; authentication will '
                      'not work without this. Please add this section and try '
                      'again.', __name__)
         sys.exit(1)
     keystone_cfg = {}
+    cache_options = dict(_CACHE_OPTIONS)
     for key in cfg.options(__name__):
-        keystone_cfg[key] = cfg.get(__name__, key)
+        if key in cache_options:
+            cache_options[key] = cfg.get(__name__, key)
+        else:
+            keystone_cfg[key] = cfg.get(__name__, key)
+    identity_cache, project_cache = _make_caches(cache_options)
 
     # Great job with the API design Openstack! </sarcasm>
     factory = filter_factory(keystone_cfg)
-    app.wsgi_app = factory(app.wsgi_app)
+    app.wsgi_app = IdentityCache(factory, app.wsgi_app, identity_cache)
 
     auth.set_auth_backend(KeystoneAuthBackend())
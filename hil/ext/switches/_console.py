@@ -5,7 +5,8 @@ import pexpect
 
 from abc import ABCMeta, abstractmethod
 from hil.model import Port, NetworkAttachment, SwitchSession
-from hil.ext.switches.common import should_save
+from hil.ext.switches.common import should_save, save_policy
+from time import time
 import re
 
 _CHANNEL_RE = re.compile(r'vlan/(\d+)')
@@ -17,6 +18,16 @@ class Session(SwitchSession):
 
     __metaclass__ = ABCMeta
 
+    # Times of the first and last changes since the running config was last
+    # saved (None if there are no unsaved changes), and of the last save.
+    # See `save_if_due`.
+    _dirty_since = None
+    _last_change = None
+    _last_save = 0
+
+    # Seconds to wait for the main prompt in `is_alive`:
+    _alive_timeout = 10
+
     @abstractmethod
     def enter_if_prompt(self, interface):
         """Navigate from the main prompt to the prompt for configuring
@@ -65,55 +76,127 @@ class Session(SwitchSession):
     def save_running_config(self):
         """saves the running config to startup config"""
 
+    def has_unsaved_changes(self):
+        return self._dirty_since is not None and should_save(self)
+
+    def save_if_due(self, force=False):
+        """Implement save_if_due.
+
+        Saving the running config can take a long time, so drivers can be
+        configured to put it off (see `save_policy`):
+
+        * A save happens no sooner than ``save_min_interval`` seconds after
+          the previous one.
+        * A save is put off until the session has been idle for
+          ``save_quiet_period`` seconds, unless there have been unsaved
+          changes for at least ``save_min_interval`` seconds (if that is
+          non-zero).
+
+        With both set to 0 (the default), changes are saved as soon as this
+        is called.
+        """
+        if not self.has_unsaved_changes():
+            return
+        if not force:
+            min_interval, quiet_period = save_policy(self)
+            now = time()
+            if now - self._last_save < min_interval:
+                return
+            if now - self._last_change < quiet_period and \
+                    not (min_interval > 0 and
+                         now - self._dirty_since >= min_interval):
+                return
+        self.save_running_config()
+        self._last_save = time()
+        self._dirty_since = None
+
+    def _changed(self):
+        """Record that the running config has been changed."""
+        self._last_change = time()
+        if self._dirty_since is None:
+            self._dirty_since = self._last_change
+
     def disconnect(self):
         """End the session. Must be at the main prompt. Handles the scenario
         where the switch only exits out of enable mode and doesn't actually
-        log out"""
+        log out
+
+        Any unsaved changes are saved first."""
 
-        if should_save(self):
-            self.save_running_config()
+        self.save_if_due(force=True)
         self._sendline('exit')
         alternatives = [pexpect.EOF, '>']
         if self.console.expect(alternatives):
             self._sendline('exit')
         logger.debug('Logged out of switch %r', self.switch)
 
+    def is_alive(self):
+        """Check that the switch still responds with its main prompt.
+
+        Output left over from earlier commands (e.g. the prompt after
+        ``exit_if_prompt``, which nothing waits for) is discarded first, so
+        that it can't be mistaken for a response.
+        """
+        if not self.console.isalive():
+            return False
+        try:
+            self._discard_output()
+            self._sendline('')
+            self.console.expect(self.main_prompt, timeout=self._alive_timeout)
+        except (pexpect.TIMEOUT, pexpect.EOF):
+            return False
+        return True
+
     def modify_port(self, port, channel, new_network):
+        self.apply_port_batch(port, [(channel, new_network)])
+
+    def apply_port_batch(self, port, changes):
+        """Implement apply_port_batch.
+
+        All of the changes are made from a single visit to the interface
+        prompt.
+        """
         interface = port
         port = Port.query.filter_by(label=port,
                                     owner_id=self.switch.id).one()
 
-        self.enter_if_prompt(interface)
-        self.console.expect(self.if_prompt)
-
-        if channel == 'vlan/native':
+        if any(channel == 'vlan/native' for channel, _ in changes):
             old_native = NetworkAttachment.query.filter_by(
                 channel='vlan/native',
                 nic_id=port.nic.id).one_or_none()
             if old_native is not None:
                 old_native = old_native.network.network_id
 
-            if new_network is not None:
-                self.set_native(old_native, new_network)
-            elif old_native is not None:
-                self.disable_native(old_native)
-        else:
-            match = re.match(_CHANNEL_RE, channel)
-            # TODO: I'd be more okay with this assertion if it weren't possible
-            # to mis-configure HIL in a way that triggers this; currently the
-            # administrator needs to line up the network allocator with the
-            # switches; this is unsatisfactory. --isd
-            assert match is not None, "HIL passed an invalid channel to the" \
-                "switch!"
-            vlan_id = match.groups()[0]
-            if new_network is None:
-                self.disable_vlan(vlan_id)
+        self.enter_if_prompt(interface)
+        self.console.expect(self.if_prompt)
+
+        for channel, new_network in changes:
+            if channel == 'vlan/native':
+                if new_network is not None:
+                    self.set_native(old_native, new_network)
+                elif old_native is not None:
+                    self.disable_native(old_native)
+                # The attachments in the database aren't updated until the
+                # whole batch is done, so keep track of the native here:
+                old_native = new_network
             else:
-                assert new_network == vlan_id
-                self.enable_vlan(vlan_id)
+                match = re.match(_CHANNEL_RE, channel)
+                # TODO: I'd be more okay with this assertion if it weren't
+                # possible to mis-configure HIL in a way that triggers this;
+                # currently the administrator needs to line up the network
+                # allocator with the switches; this is unsatisfactory. --isd
+                assert match is not None, "HIL passed an invalid channel to " \
+                    "the switch!"
+                vlan_id = match.groups()[0]
+                if new_network is None:
+                    self.disable_vlan(vlan_id)
+                else:
+                    assert new_network == vlan_id
+                    self.enable_vlan(vlan_id)
 
         self.exit_if_prompt()
         self.console.expect(self.config_prompt)
+        self._changed()
 
     def revert_port(self, port):
         self.enter_if_prompt(port)
@@ -123,6 +206,7 @@ class Session(SwitchSession):
 
         self.exit_if_prompt()
         self.console.expect(self.config_prompt)
+        self._changed()
 
     def _set_terminal_lines(self, lines):
         """set the terminal lines to unlimited or default"""
@@ -132,6 +216,15 @@ class Session(SwitchSession):
         elif lines == 'default':
             self.console.sendline('terminal length 40')
 
+    def _discard_output(self):
+        """Discard any output the switch has sent which we haven't read."""
+        self.console.buffer = ''
+        try:
+            while True:
+                self.console.read_nonblocking(size=4096, timeout=0)
+        except pexpect.TIMEOUT:
+            pass
+
     def _sendline(self, line):
         """logs switch command and then sends it"""
         logger.debug('Sending to switch %r: %r',
@@ -96,6 +96,27 @@ class _BaseSession(_console.Session):
             result[k] = network_list
         return result
 
+    def snapshot(self, ports):
+        """Implement snapshot.
+
+        Rather than running ``show int sw`` once per port, this reads the
+        whole running config in one go and parses the interface sections.
+        """
+        configs = _parse_running_config(self.get_config('running'))
+        # The dummy vlan (if any) is an implementation detail of the driver:
+        dummy_vlan = getattr(self.switch, 'dummy_vlan', None)
+        result = {}
+        for port in ports:
+            native, vlans = configs.get(port.label.lower(), (None, set()))
+            if native == dummy_vlan:
+                native = None
+            networks = dict(('vlan/%s' % vlan, vlan) for vlan in vlans
+                            if vlan not in (native, dummy_vlan))
+            if native is not None:
+                networks['vlan/native'] = native
+            result[port.label] = networks
+        return result
+
     def disable_port(self):
         self._sendline('sw trunk allowed vlan none')
         self._sendline('sw trunk native vlan none')
@@ -157,6 +178,60 @@ class _BaseSession(_console.Session):
         return config
 
 
+def _parse_running_config(config):
+    """Extract the vlans of each interface from a running config.
+
+    Returns a dictionary from (lower case) interface names to tuples of the
+    form (native_vlan, trunk_vlans), where native_vlan is None if there is no
+    native vlan and trunk_vlans is a set. Example input:
+
+        interface gi1/0/3
+        switchport mode trunk
+        switchport trunk native vlan 23
+        switchport trunk allowed vlan add 23,52-53
+        exit
+
+    Interfaces with no trunk configuration are left out.
+    """
+    result = {}
+    interface = None
+    for line in config.splitlines():
+        line = line.strip()
+        match = re.match(r'interface (\S+)$', line)
+        if match is not None:
+            interface = match.group(1).lower()
+            continue
+        if line == 'exit':
+            interface = None
+            continue
+        if interface is None:
+            continue
+
+        native, vlans = result.get(interface, (None, set()))
+        match = re.match(r'switchport trunk native vlan (\d+|none)$', line)
+        if match is not None:
+            native = match.group(1)
+            if native == 'none':
+                native = None
+        match = re.match(r'switchport trunk allowed vlan '
+                         r'(?:(add|remove) )?(\S+)$', line)
+        if match is not None:
+            op, ranges = match.groups()
+            if ranges in ('none', 'all'):
+                # "all" isn't something HIL ever configures; treat it like
+                # "none" rather than listing 4000-odd vlans.
+                vlans = set()
+            elif op == 'remove':
+                vlans = vlans.difference(parse_vlans(ranges))
+            elif op == 'add':
+                vlans = vlans.union(parse_vlans(ranges))
+            else:
+                vlans = set(parse_vlans(ranges))
+        if native is not None or vlans or interface in result:
+            result[interface] = (native, vlans)
+    return result
+
+
 def _make_vlan_list(dirty_list):
     '''Create vlan list from switch config vlan ranges.'''
     ranges = dirty_list.replace(' (Inactive)', '')
@@ -4,7 +4,10 @@ an API to talk to. This only works with the vlan_pool network allocator."""
 import logging
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 
+from hil.config import cfg
 from hil.errors import SwitchError
 from hil.model import SwitchSession
 from hil.network_allocator import get_network_allocator
@@ -39,6 +42,44 @@ class Session(SwitchSession):
                 assert new_network == vlan_id
                 self._add_vlan_to_trunk(port, vlan_id)
 
+    def apply_port_batch(self, port, changes):
+        """Implement apply_port_batch.
+
+        Runs of consecutive trunk changes are combined into a single call to
+        `_modify_trunk_vlans`; if a vlan is changed more than once in a run,
+        only its final state is pushed to the switch. Changes to the native
+        vlan are applied individually, in order.
+        """
+        added = []
+        removed = []
+        for channel, new_network in changes:
+            if channel == 'vlan/native':
+                if added or removed:
+                    self._modify_trunk_vlans(port, added, removed)
+                    added, removed = [], []
+                self.modify_port(port, channel, new_network)
+                continue
+
+            match = re.match(_CHANNEL_RE, channel)
+            assert match is not None, "Malformed channel: No VLAN ID found"
+            vlan_id = match.groups()[0]
+            legal = get_network_allocator(). \
+                is_legal_channel_for(channel, vlan_id)
+            assert legal, "Invalid VLAN ID"
+
+            if vlan_id in added:
+                added.remove(vlan_id)
+            if vlan_id in removed:
+                removed.remove(vlan_id)
+            if new_network is None:
+                removed.append(vlan_id)
+            else:
+                assert new_network == vlan_id
+                added.append(vlan_id)
+
+        if added or removed:
+            self._modify_trunk_vlans(port, added, removed)
+
     def revert_port(self, port):
         """Implements revert port for switches that use VLANs"""
         self._remove_all_vlans_from_trunk(port)
@@ -47,7 +88,14 @@ class Session(SwitchSession):
         self._port_shutdown(port)
 
     def disconnect(self):
-        pass
+        """Close any connections to the switch.
+
+        The connections will be re-opened if the session is used again.
+        """
+        self._forget_port_state()
+        http = self.__dict__.pop('_http_session', None)
+        if http is not None:
+            http.close()
 
     def get_port_networks(self, ports):
         """Implements get_port_networks. See hil/model.py for more details
@@ -55,6 +103,8 @@ class Session(SwitchSession):
 
         response = {}
         for port in ports:
+            # Always ask the switch, rather than trusting the cache:
+            self._forget_port_state(port.label)
             native = self._get_native_vlan(port.label)
             if native is not None:
                 response[port] = [native]
@@ -63,14 +113,81 @@ class Session(SwitchSession):
             response[port] += self._get_vlans(port.label)
         return response
 
+    def _http_option(self, option, default):
+        """Return a numeric option from the driver's config section.
+
+        The options are:
+
+        * ``http_pool_size``: the maximum number of connections to keep
+          open to the switch (default 10).
+        * ``http_timeout``: the timeout for requests to the switch, in
+          seconds (default: no timeout).
+        * ``http_retries``: the number of times to retry a request which
+          fails to connect, or (for idempotent requests) fails with a
+          connection error or a 502, 503 or 504 response (default 0).
+        * ``http_backoff``: the backoff factor between retries; see
+          urllib3's ``Retry`` (default 0.5).
+        """
+        switch_ext = self.__class__.__module__
+        if cfg.has_option(switch_ext, option):
+            return cfg.getfloat(switch_ext, option)
+        return default
+
+    @property
+    def _http(self):
+        """The session's `requests.Session`.
+
+        It is created on first use, and keeps connections to the switch open
+        across requests (and across actions, for as long as the network
+        daemon keeps this session). See `_http_option` for the settings.
+        """
+        http = self.__dict__.get('_http_session')
+        if http is None:
+            http = requests.Session()
+            http.auth = self._auth
+            retries = Retry(total=int(self._http_option('http_retries', 0)),
+                            backoff_factor=self._http_option('http_backoff',
+                                                             0.5),
+                            status_forcelist=(502, 503, 504),
+                            raise_on_status=False)
+            pool_size = int(self._http_option('http_pool_size', 10))
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=pool_size,
+                                  max_retries=retries)
+            http.mount('http://', adapter)
+            http.mount('https://', adapter)
+            self.__dict__['_http_session'] = http
+        return http
+
+    def _request(self, method, url, data=None):
+        """Make an http request to the switch, and return the response.
+
+        Unlike `_make_request`, this doesn't check the response's status.
+        If the switch can't be reached (including timeouts, and running out
+        of retries), raises `SwitchError`.
+        """
+        try:
+            return self._http.request(method, url, data=data,
+                                      timeout=self._http_option(
+                                          'http_timeout', None))
+        except requests.exceptions.RequestException as e:
+            # We don't know whether the switch saw the request:
+            self._forget_port_state()
+            raise SwitchError('Error making %s request to switch: %s'
+                              % (method, e))
+        except Exception:
+            self._forget_port_state()
+            raise
+
     def _make_request(self, method, url, data=None,
                       acceptable_error_codes=()):
         """This can make the http request for you.
         Also accepts a list of acceptable error codes if you need."""
 
-        r = requests.request(method, url, data=data, auth=self._auth)
+        r = self._request(method, url, data=data)
         if r.status_code >= 400 and \
            r.status_code not in acceptable_error_codes:
+            self._forget_port_state()
             logger.error('Bad Request to switch. '
                          'Response: %s and '
                          'Reason: %s', r.text, r.reason)
@@ -79,6 +196,47 @@ class Session(SwitchSession):
                               'Reason: %s', r.text, r.reason)
         return r
 
+    def _port_state(self, interface):
+        """Return the cached state of <interface>.
+
+        Drivers use this to avoid asking the switch for things they already
+        know: the returned dict is populated with what has been read from the
+        switch, and updated as changes are made to the port. Keys are up to
+        the driver; the ones used by `_update_trunk_state` are ``'vlans'``
+        (in the form returned by `_get_vlans`) and ``'native'`` (the native
+        vlan's id, or None).
+
+        The cache lasts as long as the session, except that it is cleared
+        whenever a request to the switch fails, since we can no longer be sure
+        what state the switch is in.
+        """
+        states = self.__dict__.setdefault('_port_states', {})
+        return states.setdefault(interface, {})
+
+    def _forget_port_state(self, interface=None):
+        """Clear the cached state of <interface>, or of every interface if
+        <interface> is None."""
+        states = self.__dict__.get('_port_states', {})
+        if interface is None:
+            states.clear()
+        else:
+            states.pop(interface, None)
+
+    def _update_trunk_state(self, interface, added=(), removed=()):
+        """Record that vlans were added to/removed from a trunk port.
+
+        This only updates the cached list of vlans if there is one; the
+        changes are not enough to know the whole list otherwise.
+        """
+        state = self._port_state(interface)
+        if 'vlans' not in state:
+            return
+        vlans = set(vlan for _, vlan in state['vlans'])
+        vlans.difference_update(removed)
+        vlans.update(added)
+        state['vlans'] = [('vlan/%s' % vlan, vlan)
+                          for vlan in sorted(vlans, key=int)]
+
     @property
     def _auth(self):
         """Returns tuple for authentication"""
@@ -123,6 +281,23 @@ class Session(SwitchSession):
         """
         assert False, "Subclasses MUST override _add_vlan_to_trunk"
 
+    def _modify_trunk_vlans(self, interface, added, removed):
+        """ Add and remove several vlans on a trunk port.
+
+        Drivers which can make several changes in one request should
+        override this; by default, it calls `_add_vlan_to_trunk` and
+        `_remove_vlan_from_trunk` for each vlan.
+
+        Args:
+            interface: interface to modify
+            added: list of vlans to add
+            removed: list of vlans to remove
+        """
+        for vlan in removed:
+            self._remove_vlan_from_trunk(interface, vlan)
+        for vlan in added:
+            self._add_vlan_to_trunk(interface, vlan)
+
     def _remove_all_vlans_from_trunk(self, interface):
         """ Remove all vlan from a trunk port.
 
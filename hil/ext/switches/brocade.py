@@ -7,7 +7,6 @@ import logging
 from lxml import etree
 from os.path import dirname, join
 import re
-import requests
 from schema import Schema, Optional
 
 from hil.migrations import paths
@@ -15,7 +14,9 @@ from hil.model import db, Switch
 from hil.errors import BadArgumentError
 from hil.model import BigIntegerType
 from hil.ext.switches.common import check_native_networks, parse_vlans
-from hil.config import core_schema, string_is_bool
+from hil.config import core_schema, string_is_bool, \
+    string_is_positive_int, string_is_nonnegative_int, \
+    string_is_positive_number, string_is_nonnegative_number
 from hil.ext.switches import _vlan_http
 
 
@@ -23,7 +24,11 @@ paths[__name__] = join(dirname(__file__), 'migrations', 'brocade')
 
 logger = logging.getLogger(__name__)
 core_schema[__name__] = {
-    Optional('save'): string_is_bool
+    Optional('save'): string_is_bool,
+    Optional('http_pool_size'): string_is_positive_int,
+    Optional('http_timeout'): string_is_positive_number,
+    Optional('http_retries'): string_is_nonnegative_int,
+    Optional('http_backoff'): string_is_nonnegative_number,
 }
 
 
@@ -127,10 +132,37 @@ class Brocade(Switch, _vlan_http.Session):
         Returns: List containing the vlans of the form:
         [('vlan/vlan1', vlan1), ('vlan/vlan2', vlan2)]
         """
+        return self._trunk_state(interface)['vlans']
+
+    def _get_native_vlan(self, interface):
+        """ Return the native vlan of an interface.
+
+        Args:
+            interface: interface to return the native vlan of
+
+        Returns: Tuple of the form ('vlan/native', vlan) or None
+        """
+        native = self._trunk_state(interface)['native']
+        if native is None:
+            return None
+        return ('vlan/native', native)
+
+    def _trunk_state(self, interface):
+        """ Return the cached state of <interface>, making sure that it
+        includes the vlans (under 'vlans') and native vlan (under 'native').
+
+        Both are read from the same url, so fetching one gets the other for
+        free.
+        """
+        state = self._port_state(interface)
+        if 'vlans' in state and 'native' in state:
+            return state
+
+        url = self._construct_url(interface, suffix='trunk')
+        response = self._make_request('GET', url)
+        root = etree.fromstring(response.text)
+
         try:
-            url = self._construct_url(interface, suffix='trunk')
-            response = self._make_request('GET', url)
-            root = etree.fromstring(response.text)
             vlans = root. \
                 find(self._construct_tag('allowed')).\
                 find(self._construct_tag('vlan')).\
@@ -140,30 +172,20 @@ class Brocade(Switch, _vlan_http.Session):
             # Sample: 12,14-18,23,28,80-90 or 20 or 20,22 or 20-22
             match = re.search(r'(\d+(-\d+)?)(,\d+(-\d+)?)*', vlans)
             if match is None:
-                return []
-
-            vlan_list = parse_vlans(match.group())
-
-            return [('vlan/%s' % x, x) for x in vlan_list]
+                vlan_list = []
+            else:
+                vlan_list = parse_vlans(match.group())
         except AttributeError:
-            return []
-
-    def _get_native_vlan(self, interface):
-        """ Return the native vlan of an interface.
-
-        Args:
-            interface: interface to return the native vlan of
+            vlan_list = []
 
-        Returns: Tuple of the form ('vlan/native', vlan) or None
-        """
         try:
-            url = self._construct_url(interface, suffix='trunk')
-            response = self._make_request('GET', url)
-            root = etree.fromstring(response.text)
-            vlan = root.find(self._construct_tag('native-vlan')).text
-            return ('vlan/native', vlan)
+            native = root.find(self._construct_tag('native-vlan')).text
         except AttributeError:
-            return None
+            native = None
+
+        state.update(vlans=[('vlan/%s' % x, x) for x in vlan_list],
+                     native=native)
+        return state
 
     def _add_vlan_to_trunk(self, interface, vlan):
         """ Add a vlan to a trunk port.
@@ -178,6 +200,27 @@ class Brocade(Switch, _vlan_http.Session):
         url = self._construct_url(interface, suffix='trunk/allowed/vlan')
         payload = '<vlan><add>%s</vlan></vlan>' % vlan
         self._make_request('PUT', url, data=payload)
+        self._update_trunk_state(interface, added=[vlan])
+
+    def _modify_trunk_vlans(self, interface, added, removed):
+        """ Add and remove several vlans on a trunk port.
+
+        The port's mode is only set once, rather than once per added vlan.
+
+        Args:
+            interface: interface to modify
+            added: list of vlans to add
+            removed: list of vlans to remove
+        """
+        for vlan in removed:
+            self._remove_vlan_from_trunk(interface, vlan)
+        if added:
+            self._enable_and_set_mode(interface, 'trunk')
+        url = self._construct_url(interface, suffix='trunk/allowed/vlan')
+        for vlan in added:
+            payload = '<vlan><add>%s</vlan></vlan>' % vlan
+            self._make_request('PUT', url, data=payload)
+            self._update_trunk_state(interface, added=[vlan])
 
     def _remove_vlan_from_trunk(self, interface, vlan):
         """ Remove a vlan from a trunk port.
@@ -189,6 +232,7 @@ class Brocade(Switch, _vlan_http.Session):
         url = self._construct_url(interface, suffix='trunk/allowed/vlan')
         payload = '<vlan><remove>%s</remove></vlan>' % vlan
         self._make_request('PUT', url, data=payload)
+        self._update_trunk_state(interface, removed=[vlan])
 
     def _remove_all_vlans_from_trunk(self, interface):
         """ Remove all vlan from a trunk port.
@@ -198,7 +242,11 @@ class Brocade(Switch, _vlan_http.Session):
         """
         url = self._construct_url(interface, suffix='trunk/allowed/vlan')
         payload = '<vlan><none>true</none></vlan>'
-        requests.put(url, data=payload, auth=self._auth)
+        r = self._request('PUT', url, data=payload)
+        if r.status_code < 400:
+            self._port_state(interface)['vlans'] = []
+        else:
+            self._forget_port_state(interface)
 
     def _set_native_vlan(self, interface, vlan):
         """ Set the native vlan of an interface.
@@ -212,6 +260,7 @@ class Brocade(Switch, _vlan_http.Session):
         url = self._construct_url(interface, suffix='trunk')
         payload = '<trunk><native-vlan>%s</native-vlan></trunk>' % vlan
         self._make_request('PUT', url, data=payload)
+        self._port_state(interface)['native'] = vlan
 
     def _remove_native_vlan(self, interface):
         """ Remove the native vlan from an interface.
@@ -221,6 +270,7 @@ class Brocade(Switch, _vlan_http.Session):
         """
         url = self._construct_url(interface, suffix='trunk/native-vlan')
         self._make_request('DELETE', url)
+        self._port_state(interface)['native'] = None
 
     def _disable_native_tag(self, interface):
         """ Disable tagging of the native vlan
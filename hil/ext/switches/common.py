@@ -1,7 +1,5 @@
 """Helper methods for switches"""
 from hil.config import cfg
-from hil import model
-from hil.model import db
 from hil.errors import BlockedError
 import ast
 
@@ -54,20 +52,39 @@ def should_save(switch_obj):
     return True
 
 
+def save_policy(switch_obj):
+    """Return the switch driver's policy for saving its running config.
+
+    The return value is a tuple ``(min_interval, quiet_period)``, taken from
+    the ``save_min_interval`` and ``save_quiet_period`` options in the
+    driver's section of the config file. Both are in seconds, and default to
+    0. See ``_console.Session.save_if_due`` for what they mean.
+    """
+    switch_ext = switch_obj.__class__.__module__
+
+    def _get(option):
+        if cfg.has_option(switch_ext, option):
+            return cfg.getfloat(switch_ext, option)
+        return 0
+    return _get('save_min_interval'), _get('save_quiet_period')
+
+
 def check_native_networks(nic, op_type, channel):
     """Check to ensure that native network is the first one to be added
     and last one to be removed
+
+    The check uses ``nic.attachments``, so callers checking many nics at
+    once can eager-load them.
     """
-    table = model.NetworkAttachment
-    query = db.session.query(table).filter(table.nic_id == nic.id)
+    channels = [attachment.channel for attachment in nic.attachments]
 
     if channel != 'vlan/native' and op_type == 'connect' and \
-       query.filter(table.channel == 'vlan/native').count() == 0:
+       'vlan/native' not in channels:
         # checks if it is trying to attach a trunked network, and then in
         # in the db see if nic does not have any networks attached natively
         raise BlockedError("Please attach a native network first")
     elif channel == 'vlan/native' and op_type == 'detach' and \
-            query.filter(table.channel != 'vlan/native').count() > 0:
+            any(c != 'vlan/native' for c in channels):
         # if it is detaching a network, then check in the database if there
         # are any trunked vlans.
         raise BlockedError("Please remove all trunked Vlans"
@@ -12,7 +12,9 @@ from hil.model import db, Switch
 from hil.errors import BadArgumentError
 from hil.model import BigIntegerType
 from hil.ext.switches.common import check_native_networks, parse_vlans
-from hil.config import core_schema, string_is_bool
+from hil.config import core_schema, string_is_bool, \
+    string_is_positive_int, string_is_nonnegative_int, \
+    string_is_positive_number, string_is_nonnegative_number
 from hil.ext.switches import _vlan_http
 
 
@@ -23,7 +25,11 @@ SHOW = 'show-command'
 EXEC = 'exec-command'
 
 core_schema[__name__] = {
-    Optional('save'): string_is_bool
+    Optional('save'): string_is_bool,
+    Optional('http_pool_size'): string_is_positive_int,
+    Optional('http_timeout'): string_is_positive_number,
+    Optional('http_retries'): string_is_nonnegative_int,
+    Optional('http_backoff'): string_is_nonnegative_number,
 }
 
 
@@ -81,25 +87,7 @@ class DellNOS9(Switch, _vlan_http.Session):
         [('vlan/vlan1', vlan1), ('vlan/vlan2', vlan2)]
         """
 
-        # It uses the REST API CLI which is slow but it is the only way
-        # because the switch is VLAN centric. Doing a GET on interface won't
-        # return the VLANs on it, we would have to do get on all vlans (if that
-        # worked reliably in the first place) and then find our interface there
-        # which is not feasible.
-
-        if not self._is_port_on(interface):
-            return []
-        response = self._get_port_info(interface)
-
-        # finds a comma separated list of integers and/or ranges starting with
-        # T. Sample T12,14-18,23,28,80-90 or T20 or T20,22 or T20-22
-        match = re.search(r'T(\d+(-\d+)?)(,\d+(-\d+)?)*', response)
-        if match is None:
-            return []
-
-        vlan_list = parse_vlans(match.group().replace('T', ''))
-
-        return [('vlan/%s' % x, x) for x in vlan_list]
+        return self._switchport_state(interface)['vlans']
 
     def _get_native_vlan(self, interface):
         """ Return the native vlan of an interface.
@@ -111,17 +99,96 @@ class DellNOS9(Switch, _vlan_http.Session):
 
         Similar to _get_vlans()
         """
-        if not self._is_port_on(interface):
+        state = self._switchport_state(interface)
+        if state['native'] is None:
+            if state['on']:
+                logger.error('Unexpected: No native vlan found')
             return None
-        response = self._get_port_info(interface)
-        match = re.search(r'NativeVlanId:(\d+)\.', response)
-        if match is not None:
-            vlan = match.group(1)
+        return ('vlan/native', state['native'])
+
+    def _switchport_state(self, interface):
+        """ Return the cached state of <interface>, making sure that it
+        includes the vlans (under 'vlans') and native vlan (under 'native').
+
+        Both are parsed from the same response, so fetching one gets the
+        other for free.
+        """
+        state = self._port_state(interface)
+        if 'vlans' in state and 'native' in state:
+            return state
+
+        if not self._is_port_on(interface):
+            state.update(on=False, vlans=[], native=None)
+            return state
+
+        # It uses the REST API CLI which is slow but it is the only way
+        # because the switch is VLAN centric. Doing a GET on interface won't
+        # return the VLANs on it, we would have to do get on all vlans (if that
+        # worked reliably in the first place) and then find our interface there
+        # which is not feasible.
+        vlans, native = self._parse_port_info(self._get_port_info(interface))
+        state.update(on=True, vlans=vlans, native=native)
+        return state
+
+    @staticmethod
+    def _parse_port_info(response):
+        """ Parse the output of `_get_port_info`.
+
+        Returns a tuple (vlans, native), where vlans is in the form returned
+        by `_get_vlans` and native is the native vlan's id, or None.
+        """
+        # finds a comma separated list of integers and/or ranges starting with
+        # T. Sample T12,14-18,23,28,80-90 or T20 or T20,22 or T20-22
+        match = re.search(r'T(\d+(-\d+)?)(,\d+(-\d+)?)*', response)
+        if match is None:
+            vlan_list = []
         else:
-            logger.error('Unexpected: No native vlan found')
-            return
+            vlan_list = parse_vlans(match.group().replace('T', ''))
 
-        return ('vlan/native', vlan)
+        match = re.search(r'NativeVlanId:(\d+)\.', response)
+        native = match.group(1) if match is not None else None
+        return [('vlan/%s' % x, x) for x in vlan_list], native
+
+    def snapshot(self, ports):
+        """Implement snapshot.
+
+        This runs ``show interfaces switchport`` once for the whole switch,
+        rather than once per port. Ports which are shut down are reported as
+        having no networks, as in `_get_vlans`; the switch still lists their
+        vlans, so we also ask it which ports are on, with a single request
+        (see `_read_ports_on`). Ports which the switch doesn't have are
+        logged, and left out of the result.
+        """
+        ports_on = self._read_ports_on()
+        response = self._execute(SHOW, 'interfaces switchport').text
+        response = response.replace(' ', '')
+
+        # The output has one section per switchport, starting with its name,
+        # e.g. "Name:GigabitEthernet1/3". See `_get_port_info`.
+        sections = {}
+        for section in response.split('Name:')[1:]:
+            name = section.split('\r\n', 1)[0].strip()
+            if name.startswith(self.interface_type):
+                sections[name[len(self.interface_type):]] = section
+
+        result = {}
+        missing = []
+        for port in ports:
+            if port.label not in ports_on:
+                missing.append(port.label)
+                continue
+            # Ports which aren't switchports have no section:
+            vlans, native = self._parse_port_info(sections.get(port.label, ''))
+            networks = dict(vlans)
+            if native is not None:
+                networks['vlan/native'] = native
+            if not ports_on[port.label]:
+                networks = {}
+            result[port.label] = networks
+        if missing:
+            logger.warn('Ports not found on switch %s: %s',
+                        self.label, ', '.join(missing))
+        return result
 
     def _get_port_info(self, interface):
         """Returns the output of a show interface command. This removes all
@@ -157,6 +224,7 @@ class DellNOS9(Switch, _vlan_http.Session):
         command = 'interface vlan ' + vlan + '\r\n tagged ' + \
             self.interface_type + ' ' + interface
         self._execute(CONFIG, command)
+        self._update_trunk_state(interface, added=[vlan])
 
     def _remove_vlan_from_trunk(self, interface, vlan):
         """ Remove a vlan from a trunk port.
@@ -167,6 +235,27 @@ class DellNOS9(Switch, _vlan_http.Session):
         """
         command = self._remove_vlan_command(interface, vlan)
         self._execute(CONFIG, command)
+        self._update_trunk_state(interface, removed=[vlan])
+
+    def _modify_trunk_vlans(self, interface, added, removed):
+        """ Add and remove several vlans on a trunk port.
+
+        All of the changes are sent to the switch in a single request.
+
+        Args:
+            interface: interface to modify
+            added: list of vlans to add
+            removed: list of vlans to remove
+        """
+        if added and not self._is_port_on(interface):
+            self._port_on(interface)
+        commands = [self._remove_vlan_command(interface, vlan)
+                    for vlan in removed]
+        commands += ['interface vlan ' + vlan + '\r\n tagged ' +
+                     self.interface_type + ' ' + interface
+                     for vlan in added]
+        self._execute(CONFIG, '\r\n '.join(commands))
+        self._update_trunk_state(interface, added=added, removed=removed)
 
     def _remove_all_vlans_from_trunk(self, interface):
         """ Remove all vlan from a trunk port.
@@ -181,6 +270,7 @@ class DellNOS9(Switch, _vlan_http.Session):
         # the switch complains
         if command is not '':
             self._execute(CONFIG, command)
+        self._port_state(interface)['vlans'] = []
 
     def _remove_vlan_command(self, interface, vlan):
         """Returns command to remove <vlan> from <interface>"""
@@ -201,6 +291,7 @@ class DellNOS9(Switch, _vlan_http.Session):
         command = 'interface vlan ' + vlan + '\r\n untagged ' + \
             self.interface_type + ' ' + interface
         self._execute(CONFIG, command)
+        self._port_state(interface)['native'] = vlan
 
     def _remove_native_vlan(self, interface):
         """ Remove the native vlan from an interface.
@@ -213,6 +304,7 @@ class DellNOS9(Switch, _vlan_http.Session):
             command = 'interface vlan ' + vlan + '\r\n no untagged ' + \
                 self.interface_type + ' ' + interface
             self._execute(CONFIG, command)
+            self._port_state(interface)['native'] = None
         except TypeError:
             logger.error('No native vlan to remove')
 
@@ -224,13 +316,15 @@ class DellNOS9(Switch, _vlan_http.Session):
         """
 
         url = self._construct_url(interface=interface)
-        interface = self._convert_interface_type(self.interface_type) + \
+        name = self._convert_interface_type(self.interface_type) + \
             interface.replace('/', '-')
         payload = '<interface><name>%s</name><portmode><hybrid>false' \
                   '</hybrid></portmode><shutdown>true</shutdown>' \
-                  '</interface>' % interface
+                  '</interface>' % name
 
         self._make_request('PUT', url, data=payload)
+        # A port which is shut down has no vlans, as far as we are concerned:
+        self._port_state(interface).update(on=False, vlans=[], native=None)
 
     def _port_on(self, interface):
         """ Turns on <interface>
@@ -239,16 +333,27 @@ class DellNOS9(Switch, _vlan_http.Session):
         """
 
         url = self._construct_url(interface=interface)
-        interface = self._convert_interface_type(self.interface_type) + \
+        name = self._convert_interface_type(self.interface_type) + \
             interface.replace('/', '-')
         payload = '<interface><name>%s</name><portmode><hybrid>true' \
                   '</hybrid></portmode><switchport></switchport>' \
-                  '<shutdown>false</shutdown></interface>' % interface
+                  '<shutdown>false</shutdown></interface>' % name
 
         self._make_request('PUT', url, data=payload)
+        # The switch may have put the port in its default vlan, so we have
+        # to ask it again:
+        self._forget_port_state(interface)
+        self._port_state(interface)['on'] = True
 
     def _is_port_on(self, port):
         """ Returns a boolean that tells the status of a switchport"""
+        state = self._port_state(port)
+        if 'on' not in state:
+            state['on'] = self._read_is_port_on(port)
+        return state['on']
+
+    def _read_is_port_on(self, port):
+        """ Ask the switch whether a switchport is on. """
 
         # the url here requires a suffix to GET the shutdown tag in response.
         url = self._construct_url(interface=port) + r'\?with-defaults'
@@ -259,6 +364,29 @@ class DellNOS9(Switch, _vlan_http.Session):
         assert shutdown in ('false', 'true'), "unexpected state of switchport"
         return shutdown == 'false'
 
+    def _read_ports_on(self):
+        """ Ask the switch which of its ports are on, with a single request.
+
+        Returns a dictionary from the names of the switch's ports of type
+        ``interface_type`` (e.g. '1/3') to booleans, like those returned by
+        `_read_is_port_on`.
+        """
+        url = '%s/api/running/dell/interfaces' % self.hostname + \
+            r'\?with-defaults'
+        root = etree.fromstring(self._make_request('GET', url).text)
+        prefix = self._convert_interface_type(self.interface_type)
+
+        result = {}
+        for interface in root.iter(self._construct_tag('interface')):
+            name = interface.find(self._construct_tag('name'))
+            shutdown = interface.find(self._construct_tag('shutdown'))
+            if name is None or shutdown is None or \
+                    not name.text.startswith(prefix):
+                continue
+            port = name.text[len(prefix):].replace('-', '/')
+            result[port] = shutdown.text == 'false'
+        return result
+
     def save_running_config(self):
         """save running config to startup config"""
         command = 'write'
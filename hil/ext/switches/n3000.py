@@ -15,13 +15,16 @@ from hil.ext.switches._dell_base import _BaseSession
 from os.path import dirname, join
 from hil.errors import BadArgumentError
 from hil.model import BigIntegerType
-from hil.config import core_schema, string_is_bool
+from hil.config import core_schema, string_is_bool, \
+    string_is_nonnegative_number
 
 logger = logging.getLogger(__name__)
 paths[__name__] = join(dirname(__file__), 'migrations', 'n3000')
 
 core_schema[__name__] = {
-    Optional('save'): string_is_bool
+    Optional('save'): string_is_bool,
+    Optional('save_min_interval'): string_is_nonnegative_number,
+    Optional('save_quiet_period'): string_is_nonnegative_number,
 }
 
 
@@ -14,7 +14,8 @@ from hil.errors import BadArgumentError
 from os.path import join, dirname
 from hil.migrations import paths
 from hil.model import BigIntegerType
-from hil.config import core_schema, string_is_bool
+from hil.config import core_schema, string_is_bool, \
+    string_is_nonnegative_number
 from hil.ext.switches.common import parse_vlans
 
 logger = logging.getLogger(__name__)
@@ -22,7 +23,9 @@ logger = logging.getLogger(__name__)
 paths[__name__] = join(dirname(__file__), 'migrations', 'nexus')
 
 core_schema[__name__] = {
-    Optional('save'): string_is_bool
+    Optional('save'): string_is_bool,
+    Optional('save_min_interval'): string_is_nonnegative_number,
+    Optional('save_quiet_period'): string_is_nonnegative_number,
 }
 
 
@@ -158,27 +161,62 @@ class _Session(_console.Session):
             elif index == 3:
                 break
 
-        # The output of show int sw calls things "EthernetX/YY", but
-        # everything else calls things "ethernet X/YY". Let's do the conversion
-        # here.
+        # The output of show int sw calls things "EthernetX/YY", but ports
+        # may be registered as e.g. "ethernetX/YY"; see _interface_key.
         names_result = {}
-        pattern = re.compile(r'Ethernet(\d+)/(\d+)')
         for k, v in info.iteritems():
-            match = re.match(pattern, k)
-            # sometimes switch has custom interface names, so we skip those
-            if match is None:
-                continue
-            # TODO: We should verify there is in fact a match (there always
-            # should be, but let's be paranoid).
-            switch, port = match.groups()
-            names_result['Ethernet%s/%s' % (switch, port)] = v
+            names_result[_interface_key(k)] = v
 
         result = {}
         for port in ports:
-            result[port] = names_result[port.label]
+            key = _interface_key(port.label)
+            if key in names_result:
+                result[port] = names_result[key]
+
+        return result
+
+    def snapshot(self, ports):
+        """Implement snapshot.
 
+        This reads the interface sections of the running config once, rather
+        than parsing ``show int sw`` as `get_port_networks` does. Interface
+        names are matched regardless of case, so ports may be registered as
+        e.g. ``Ethernet1/12`` or ``ethernet1/12``. Ports which the switch
+        doesn't have are logged, and left out of the result.
+        """
+        configs = _parse_running_config(self._interface_config())
+        result = {}
+        missing = []
+        for port in ports:
+            key = _interface_key(port.label)
+            if key not in configs:
+                missing.append(port.label)
+                continue
+            native, vlans = configs[key]
+            # The dummy vlan is how the driver says "no native vlan":
+            if native == self.dummy_vlan:
+                native = None
+            networks = dict(('vlan/%s' % vlan, vlan) for vlan in vlans
+                            if vlan not in (native, self.dummy_vlan))
+            if native is not None:
+                networks['vlan/native'] = native
+            result[port.label] = networks
+        if missing:
+            logger.warn('Ports not found on switch %s: %s',
+                        self.switch.label, ', '.join(missing))
         return result
 
+    def _interface_config(self):
+        """Return the interface sections of the running config."""
+        self._set_terminal_lines('unlimited')
+        self.console.expect(self.main_prompt)
+        self._sendline('show running-config interface')
+        self.console.expect(self.main_prompt)
+        config = self.console.before
+        self._set_terminal_lines('default')
+        self.console.expect(self.main_prompt)
+        return config
+
     def get_port_networks(self, ports):
         '''Returns dictionary of ports, each containing a list of related
         VLANs.'''
@@ -249,3 +287,69 @@ class _Session(_console.Session):
     def disable_port(self):
         self._sendline('sw trunk allowed vlan none')
         self._sendline('sw trunk native vlan ' + self.dummy_vlan)
+
+
+def _interface_key(name):
+    """Return the name by which to look up the interface ``name``.
+
+    The switch calls interfaces e.g. "Ethernet1/12", but ports may be
+    registered as "ethernet1/12" (see `Nexus.validate_port_name`), so the
+    names are compared in lower case, with the "Eth" abbreviation expanded.
+    """
+    return re.sub(r'^eth(ernet)?\s*', 'ethernet', name.strip().lower())
+
+
+def _parse_running_config(config):
+    """Extract the vlans of each interface from a Nexus running config.
+
+    Returns a dictionary from interface names (see `_interface_key`) to
+    tuples of the form (native_vlan, trunk_vlans), where native_vlan is None
+    if there is no native vlan and trunk_vlans is a set. Every interface
+    section is included, even those with no vlans. Example input:
+
+        interface Ethernet1/3
+          switchport mode trunk
+          switchport trunk native vlan 23
+          switchport trunk allowed vlan 23,52-53
+          switchport trunk allowed vlan add 60
+
+    A section ends at the next line which isn't indented.
+    """
+    result = {}
+    interface = None
+    for line in config.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            match = re.match(r'interface (\S+)\s*$', line)
+            if match is None:
+                interface = None
+            else:
+                interface = _interface_key(match.group(1))
+                result[interface] = (None, set())
+            continue
+        if interface is None:
+            continue
+
+        line = line.strip()
+        native, vlans = result[interface]
+        match = re.match(r'switchport trunk native vlan (\d+)$', line)
+        if match is not None:
+            native = match.group(1)
+        match = re.match(r'switchport trunk allowed vlan '
+                         r'(?:(add|remove|except) )?(\S+)$', line)
+        if match is not None:
+            op, ranges = match.groups()
+            if ranges in ('none', 'all') or op == 'except':
+                # HIL never configures "all" (the default, if there is no
+                # such line) or "except"; treat them like "none" rather than
+                # listing 4000-odd vlans.
+                vlans = set()
+            elif op == 'remove':
+                vlans = vlans.difference(parse_vlans(ranges))
+            elif op == 'add':
+                vlans = vlans.union(parse_vlans(ranges))
+            else:
+                vlans = set(parse_vlans(ranges))
+        result[interface] = (native, vlans)
+    return result
@@ -0,0 +1,122 @@
+"""Move finished networking actions out of the journal.
+
+The network daemon marks the actions in the `NetworkingAction` table as
+'DONE' or 'ERROR' when it's finished with them, but leaves them there, so
+that their status can be looked up. They are only deleted when another
+action is queued on the same nic, so the journal keeps growing with
+actions on nics which are never touched again.
+
+`compact` moves finished actions older than a given age into the
+`ArchivedNetworkingAction` table, which keeps just enough about each action
+for ``show_networking_action`` to report it, and nothing which refers to
+other tables. It can be run with ``hil-admin journal compact``, or
+periodically by the network daemon (see ``journal_compact_interval`` in
+``examples/hil.cfg``).
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from hil import model
+from hil.config import cfg
+from hil.model import db
+
+logger = logging.getLogger(__name__)
+
+# The number of actions to archive in each transaction:
+DEFAULT_CHUNK_SIZE = 1000
+
+# The default for the ``journal_max_age`` option: one week.
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+
+
+def configured_max_ages():
+    """Return the ``max_age`` and ``archive_max_age`` set in the config.
+
+    These are the ``journal_max_age`` and ``journal_archive_max_age``
+    options in the ``[network-daemon]`` section.
+    """
+    ages = []
+    for option, default in [('journal_max_age', DEFAULT_MAX_AGE),
+                            ('journal_archive_max_age', 0)]:
+        if cfg.has_option('network-daemon', option):
+            ages.append(cfg.getfloat('network-daemon', option))
+        else:
+            ages.append(default)
+    return tuple(ages)
+
+
+def _archive_row(action, now):
+    """Return the archive table's row for ``action``, as a dict."""
+    return {
+        'id': action.id,
+        'uuid': action.uuid,
+        'batch_id': action.batch_id,
+        'status': action.status,
+        'type': action.type,
+        'channel': action.channel,
+        'node': action.nic.owner.label,
+        'nic': action.nic.label,
+        'new_network': (action.new_network.label
+                        if action.new_network is not None else None),
+        'created_at': action.created_at,
+        'started_at': action.started_at,
+        'finished_at': action.finished_at,
+        'archived_at': now,
+    }
+
+
+def compact(max_age, archive_max_age=0, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Archive the finished actions which are older than ``max_age``.
+
+    ``max_age`` is in seconds, and counts from when the action finished.
+    Actions which finished before HIL recorded such things are archived
+    regardless of ``max_age``. If ``archive_max_age`` is non-zero, archived
+    actions are deleted once they have been in the archive for that many
+    seconds.
+
+    The actions are archived ``chunk_size`` at a time, with a commit after
+    each chunk, so that the network daemon isn't blocked for long, and
+    progress isn't lost if we're interrupted.
+
+    Returns a tuple of the numbers of actions archived and deleted from the
+    archive.
+    """
+    now = datetime.utcnow()
+    table = model.NetworkingAction
+    finished = db.session.query(table.id) \
+        .filter(~table.status.in_(table.pending_statuses),
+                db.or_(table.finished_at < now - timedelta(seconds=max_age),
+                       table.finished_at.is_(None))) \
+        .order_by(table.id)
+
+    archived = 0
+    while True:
+        ids = [row[0] for row in finished.limit(chunk_size)]
+        if not ids:
+            break
+        actions = table.query \
+            .filter(table.id.in_(ids)) \
+            .options(db.joinedload('nic').joinedload('owner'),
+                     db.joinedload('new_network'))
+        db.session.execute(
+            model.ArchivedNetworkingAction.__table__.insert(),
+            [_archive_row(action, now) for action in actions])
+        table.query.filter(table.id.in_(ids)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        archived += len(ids)
+
+    purged = 0
+    if archive_max_age:
+        archive = model.ArchivedNetworkingAction
+        purged = archive.query \
+            .filter(archive.archived_at <
+                    now - timedelta(seconds=archive_max_age)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+
+    if archived or purged:
+        logger.info('Archived %d finished networking actions; deleted %d '
+                    'from the archive', archived, purged)
+    return archived, purged
@@ -0,0 +1,295 @@
+"""Import switches, nodes and their wiring from a layout document.
+
+Onboarding a rack one API call at a time (``node_register``,
+``node_register_nic``, ``switch_register_port``, ``port_connect_nic``...)
+means one HTTP request and one database commit per object. This module
+instead takes a description of the whole layout, checks all of it, and
+then adds everything in a single transaction.
+
+A layout is a JSON object of the same form as ``site-layout.json`` (see
+``docs/testing.md``), with two optional fields:
+
+* ``"switches"``, a list of switches to register. Each has the fields
+  required by the body of the ``switch_register`` API call, plus
+  ``"switch"``, the name of the switch, and optionally ``"ports"``, a list
+  of the names of ports to register on it.
+* ``"nodes"``, a list of nodes to register. Each has a ``"name"``, an
+  ``"obmd"`` object as in ``node_register``, optionally ``"metadata"``,
+  and a list of ``"nics"``, each of which has a ``"name"``, a ``"mac"``
+  address, and optionally the ``"switch"`` and ``"port"`` the nic is
+  connected to.
+
+Switches referenced by nics may either be in the layout, or already
+registered. Ports referenced by nics are registered if they don't already
+exist; if they do, they must not be connected to another nic.
+"""
+
+import json
+from urlparse import urlparse
+
+from schema import Schema, And, Optional, SchemaError
+
+from hil import model, errors
+from hil.model import db
+from hil.class_resolver import concrete_class_for
+
+_SWITCH_SCHEMA = Schema({
+    'switch': basestring,
+    'type': basestring,
+    Optional('ports'): [basestring],
+    Optional(basestring): object,
+})
+
+_NODE_SCHEMA = Schema({
+    'name': basestring,
+    'obmd': {
+        'uri': And(basestring,
+                   lambda s: urlparse(s).scheme in ('http', 'https')),
+        'admin_token': basestring,
+    },
+    Optional('nics'): [{
+        'name': basestring,
+        'mac': basestring,
+        Optional('switch'): basestring,
+        Optional('port'): basestring,
+    }],
+    Optional('metadata'): {basestring: object},
+    # Older layouts describe the node's OBM directly; it is ignored:
+    Optional('obm'): object,
+})
+
+
+class _Importer(object):
+    """Checks and builds the objects described by a layout.
+
+    Problems are collected in ``self.problems``, rather than raised, so
+    that they can all be reported at once.
+    """
+
+    def __init__(self):
+        self.problems = []
+        # Switches, by label, whether new or existing:
+        self.switches = {}
+        # Ports, by (switch label, port label), whether new or existing:
+        self.ports = {}
+        # The keys of the switches and ports in the above which are new:
+        self.new_switches = set()
+        self.new_ports = set()
+        # Ports which some nic in the layout is connected to:
+        self.wired_ports = set()
+        # The labels of the nodes which are already registered:
+        self.existing_nodes = set()
+        # New nodes, by label:
+        self.nodes = {}
+        self.nics = 0
+
+    def problem(self, where, msg, *args):
+        """Record a problem with the item described by ``where``."""
+        self.problems.append('%s: %s' % (where, msg % args))
+
+    def load_existing(self, layout):
+        """Look up the registered objects which the layout refers to.
+
+        Registered switches referenced by the layout (and their ports) are
+        added to ``self.switches`` and ``self.ports``. Registered nodes with
+        the same names as nodes in the layout are noted, so they can be
+        reported.
+        """
+        switch_labels = set()
+        node_labels = set()
+        for switch in layout['switches']:
+            if isinstance(switch, dict):
+                switch_labels.add(switch.get('switch'))
+        for node in layout['nodes']:
+            if not isinstance(node, dict):
+                continue
+            node_labels.add(node.get('name'))
+            for nic in node.get('nics', []):
+                if isinstance(nic, dict):
+                    switch_labels.add(nic.get('switch'))
+        switch_labels.discard(None)
+        node_labels.discard(None)
+
+        existing = list(model.query_in(model.Switch.query,
+                                       model.Switch.label, switch_labels))
+        for switch in existing:
+            self.switches[switch.label] = switch
+        ports = model.query_in(
+            model.Port.query.options(db.joinedload('nic'),
+                                     db.joinedload('owner')),
+            model.Port.owner_id,
+            [switch.id for switch in existing])
+        for port in ports:
+            self.ports[(port.owner.label, port.label)] = port
+        self.existing_nodes = set(
+            label for (label,) in model.query_in(
+                db.session.query(model.Node.label),
+                model.Node.label, node_labels))
+
+    def check_switch(self, where, switch):
+        """Check and build a switch from the layout."""
+        try:
+            switch = _SWITCH_SCHEMA.validate(switch)
+        except SchemaError as e:
+            self.problem(where, 'not a valid switch: %s', e)
+            return
+        label = switch.pop('switch')
+        type_ = switch.pop('type')
+        ports = switch.pop('ports', [])
+        where = '%s (%s)' % (where, label)
+        if label in self.new_switches:
+            self.problem(where, 'switch is listed twice')
+            return
+        if label in self.switches:
+            self.problem(where, 'switch already exists')
+            return
+        cls = concrete_class_for(model.Switch, type_)
+        if cls is None:
+            self.problem(where, '%r is not a valid switch type', type_)
+            return
+        try:
+            cls.validate(switch)
+        except SchemaError:
+            self.problem(where,
+                         'the arguments are not valid for this switch type')
+            return
+        obj = cls(**switch)
+        obj.label = label
+        obj.type = type_
+        self.switches[label] = obj
+        self.new_switches.add(label)
+        for port in ports:
+            if (label, port) in self.ports:
+                self.problem(where, 'port %s is listed twice', port)
+            else:
+                self.add_port(where, obj, port)
+
+    def add_port(self, where, switch, port):
+        """Build a new port on ``switch``, if its name is valid.
+
+        Returns the port, or None if the name is invalid.
+        """
+        try:
+            switch.validate_port_name(port)
+        except errors.BadArgumentError as e:
+            self.problem(where, '%s', e.message)
+            return None
+        obj = model.Port(port, switch)
+        self.ports[(switch.label, port)] = obj
+        self.new_ports.add((switch.label, port))
+        return obj
+
+    def check_node(self, where, node):
+        """Check and build a node (and its nics) from the layout."""
+        try:
+            node = _NODE_SCHEMA.validate(node)
+        except SchemaError as e:
+            self.problem(where, 'not a valid node: %s', e)
+            return
+        label = node['name']
+        where = '%s (%s)' % (where, label)
+        if label in self.nodes:
+            self.problem(where, 'node is listed twice')
+            return
+        if label in self.existing_nodes:
+            self.problem(where, 'node already exists')
+            return
+        obj = model.Node(label=label,
+                         obmd_uri=node['obmd']['uri'],
+                         obmd_admin_token=node['obmd']['admin_token'])
+        for key, value in node.get('metadata', {}).items():
+            model.Metadata(key, json.dumps(value), obj)
+
+        nic_labels = set()
+        for nic in node.get('nics', []):
+            nic_where = '%s nic %s' % (where, nic['name'])
+            if nic['name'] in nic_labels:
+                self.problem(nic_where, 'nic is listed twice')
+                continue
+            nic_labels.add(nic['name'])
+            nic_obj = model.Nic(obj, nic['name'], nic['mac'])
+            self.nics += 1
+            if 'switch' not in nic and 'port' not in nic:
+                continue
+            if 'switch' not in nic or 'port' not in nic:
+                self.problem(nic_where,
+                             'either both or neither of "switch" and "port" '
+                             'must be given')
+                continue
+            nic_obj.port = self.wire_port(nic_where, nic['switch'],
+                                          nic['port'])
+        self.nodes[label] = obj
+
+    def wire_port(self, where, switch, port):
+        """Return the port a nic is to be connected to.
+
+        The port is created if need be. Returns None (having recorded a
+        problem) if the port can't be used.
+        """
+        if switch not in self.switches:
+            self.problem(where, 'switch %s does not exist', switch)
+            return None
+        if (switch, port) in self.wired_ports:
+            self.problem(where, 'port %s on switch %s is connected to '
+                         'another nic in the layout', port, switch)
+            return None
+        obj = self.ports.get((switch, port))
+        if obj is None:
+            obj = self.add_port(where, self.switches[switch], port)
+        elif obj.nic is not None:
+            self.problem(where, 'port %s on switch %s is already connected '
+                         'to nic %s on node %s', port, switch,
+                         obj.nic.label, obj.nic.owner.label)
+            return None
+        if obj is not None:
+            self.wired_ports.add((switch, port))
+        return obj
+
+
+def import_layout(layout):
+    """Register the switches, ports, nodes and nics described by ``layout``.
+
+    ``layout`` is a layout as described in the module's docstring, already
+    parsed from JSON. Nothing is registered unless the whole layout is
+    valid; if it isn't, a `LayoutError` listing every problem found is
+    raised.
+
+    On success, the new objects are added to the session, and a dict
+    counting the new ``switches``, ``ports``, ``nodes`` and ``nics`` is
+    returned. The caller is responsible for committing.
+    """
+    if not isinstance(layout, dict) or \
+            not isinstance(layout.get('switches', []), list) or \
+            not isinstance(layout.get('nodes', []), list):
+        raise errors.LayoutError(['the layout must be a JSON object, whose '
+                                  '"switches" and "nodes" are lists'])
+    layout = {
+        'switches': layout.get('switches', []),
+        'nodes': layout.get('nodes', []),
+    }
+    importer = _Importer()
+    # Don't let any of the new objects be flushed before they've all been
+    # checked:
+    with db.session.no_autoflush:
+        importer.load_existing(layout)
+        for i, switch in enumerate(layout['switches']):
+            importer.check_switch('switches[%d]' % i, switch)
+        for i, node in enumerate(layout['nodes']):
+            importer.check_node('nodes[%d]' % i, node)
+
+    if importer.problems:
+        # Some of the objects we built may have been added to the session
+        # via their relationships with existing ones:
+        db.session.rollback()
+        raise errors.LayoutError(importer.problems)
+
+    db.session.add_all(importer.switches[label]
+                       for label in importer.new_switches)
+    db.session.add_all(importer.ports[key] for key in importer.new_ports)
+    db.session.add_all(importer.nodes.values())
+    return {
+        'switches': len(importer.new_switches),
+        'ports': len(importer.new_ports),
+        'nodes': len(importer.nodes),
+        'nics': importer.nics,
+    }
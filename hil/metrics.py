@@ -0,0 +1,322 @@
+"""Metrics about the API server, in the Prometheus text format.
+
+`hil.rest` records, for each API call:
+
+* ``hil_http_requests_total``: the number of requests, by endpoint (the name
+  of the API call), method and status code.
+* ``hil_http_request_duration_seconds``: a histogram of the time taken to
+  handle requests, by endpoint. For streamed responses, this is the time
+  taken to start the response.
+* ``hil_auth_duration_seconds``: a histogram of the time spent in the auth
+  backend, by endpoint.
+* ``hil_db_queries_total`` and ``hil_db_duration_seconds_total``: the
+  number of SQL statements run while handling requests, and the time they
+  took, by endpoint.
+
+Caches registered with `register_cache` are reported in
+``hil_cache_hits_total`` and ``hil_cache_misses_total``, by cache. Other
+modules may add their own metrics with `register_collector`. The metrics
+are kept in memory, per process, and are exported by the ``show_metrics``
+API call.
+"""
+
+import BaseHTTPServer
+import os
+import threading
+import time
+
+import flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# The upper bounds of the histograms' buckets, in seconds:
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+_lock = threading.Lock()
+
+# Functions returning extra metrics; see register_collector:
+_collectors = []
+
+# Functions returning caches, by name; see register_cache:
+_caches = {}
+
+
+def _format_labels(names, values):
+    """Format a set of labels, e.g. '{endpoint="show_node",status="200"}'."""
+    if not names:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in zip(names, values))
+
+
+def _format_value(value):
+    """Format a sample's value."""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """A counter, with a value for each combination of labels."""
+
+    type = 'counter'
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def inc(self, labels=(), amount=1):
+        """Add ``amount`` to the value for ``labels`` (a tuple)."""
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        """Return the value for ``labels``."""
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        """Return the lines of the text format for the counter's values."""
+        with _lock:
+            return ['%s%s %s' % (self.name,
+                                 _format_labels(self.label_names, labels),
+                                 _format_value(value))
+                    for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    """A value which may go up and down, for each combination of labels."""
+
+    type = 'gauge'
+
+    def set(self, labels=(), value=0):
+        """Set the value for ``labels`` (a tuple)."""
+        with _lock:
+            self._values[labels] = value
+
+
+class Histogram(object):
+    """A histogram, with a set of buckets for each combination of labels."""
+
+    type = 'histogram'
+
+    def __init__(self, name, description, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # Maps labels to (bucket counts, sum):
+        self._values = {}
+
+    def observe(self, value, labels=()):
+        """Record ``value``, for ``labels`` (a tuple)."""
+        with _lock:
+            counts, total = self._values.get(labels,
+                                             ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[labels] = (counts, total + value)
+
+    def count(self, labels=()):
+        """Return the number of values recorded for ``labels``."""
+        return self._values.get(labels, ([0], 0))[0][-1]
+
+    def samples(self):
+        """Return the lines of the text format for the histogram."""
+        names = self.label_names + ('le',)
+        lines = []
+        with _lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, counts):
+                    bucket_labels = labels + (_format_value(bound),)
+                    lines.append('%s_bucket%s %d' % (
+                        self.name, _format_labels(names, bucket_labels),
+                        count))
+                lines.append('%s_sum%s %s' % (
+                    self.name, _format_labels(self.label_names, labels),
+                    _format_value(total)))
+                lines.append('%s_count%s %d' % (
+                    self.name, _format_labels(self.label_names, labels),
+                    counts[-1]))
+        return lines
+
+
+requests_total = Counter('hil_http_requests_total',
+                         'API requests handled.',
+                         ('endpoint', 'method', 'status'))
+request_duration = Histogram('hil_http_request_duration_seconds',
+                             'Time taken to handle API requests.',
+                             ('endpoint',))
+auth_duration = Histogram('hil_auth_duration_seconds',
+                          'Time spent authenticating API requests.',
+                          ('endpoint',))
+db_queries = Counter('hil_db_queries_total',
+                     'SQL statements run while handling API requests.',
+                     ('endpoint',))
+db_duration = Counter('hil_db_duration_seconds_total',
+                      'Time spent running SQL statements while handling '
+                      'API requests.',
+                      ('endpoint',))
+
+_METRICS = [requests_total, request_duration, auth_duration, db_queries,
+            db_duration]
+
+
+def register_collector(collector):
+    """Add the metrics returned by ``collector`` to the output of `render`.
+
+    ``collector`` is called with no arguments, and must return a list of
+    `Counter`s and `Histogram`s (or objects with the same ``name``,
+    ``description``, ``type`` and ``samples``).
+    """
+    _collectors.append(collector)
+
+
+def register_cache(name, get_cache):
+    """Report the hits and misses of a cache.
+
+    ``get_cache`` is called with no arguments, and must return an object
+    with ``hits`` and ``misses`` attributes, such as a `hil.cache.TTLCache`.
+    """
+    _caches[name] = get_cache
+
+
+def _cache_metrics():
+    """Return the counters for the caches registered with register_cache."""
+    hits = Counter('hil_cache_hits_total', 'Cache lookups which hit.',
+                   ('cache',))
+    misses = Counter('hil_cache_misses_total', 'Cache lookups which missed.',
+                     ('cache',))
+    for name, get_cache in _caches.items():
+        cache = get_cache()
+        hits.inc((name,), cache.hits)
+        misses.inc((name,), cache.misses)
+    return [hits, misses]
+
+
+def render(metric_list=None):
+    """Return metrics in the Prometheus text format.
+
+    ``metric_list`` is the list of metrics to include. By default, it is the
+    API server's metrics, plus those of registered caches and collectors.
+    """
+    if metric_list is None:
+        metric_list = list(_METRICS)
+        if _caches:
+            metric_list.extend(_cache_metrics())
+        for collector in _collectors:
+            metric_list.extend(collector())
+    lines = []
+    for metric in metric_list:
+        lines.append('# HELP %s %s' % (metric.name, metric.description))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, metric_list):
+    """Write ``metric_list`` to the file ``path``, in the text format.
+
+    This is meant for the Prometheus node exporter's textfile collector.
+    The file is replaced atomically, so the collector never sees a partly
+    written file.
+    """
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(render(metric_list))
+    os.rename(tmp_path, path)
+
+
+def serve_http(address, port, metric_list):
+    """Serve ``metric_list`` over HTTP, from a background thread.
+
+    Any GET request to ``address``:``port`` is answered with the metrics.
+    Returns the server; call its ``shutdown`` method to stop it.
+    """
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        """Answers every GET request with the metrics."""
+
+        def do_GET(self):
+            # pylint: disable=invalid-name,missing-docstring
+            body = render(metric_list)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            # pylint: disable=arguments-differ
+            pass
+
+    server = BaseHTTPServer.HTTPServer((address, port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+class RequestTimer(object):
+    """Accumulates the metrics for one API request.
+
+    `hil.rest` creates one of these for each request, and stores it in
+    ``flask.g.request_timer``; SQL statements run while it is there are
+    counted towards it.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.time()
+        self.queries = 0
+        self.db_time = 0.0
+
+    def time_auth(self, authenticate):
+        """Call ``authenticate``, and record the time it took."""
+        start = time.time()
+        try:
+            return authenticate()
+        finally:
+            auth_duration.observe(time.time() - start, (self.endpoint,))
+
+    def finish(self, method, status):
+        """Record the metrics for the request."""
+        labels = (self.endpoint,)
+        requests_total.inc((self.endpoint, method, str(status)))
+        request_duration.observe(time.time() - self.start, labels)
+        db_queries.inc(labels, self.queries)
+        db_duration.inc(labels, self.db_time)
+
+
+def _current_timer():
+    """Return the current request's `RequestTimer`, or None."""
+    if not flask.has_app_context():
+        return None
+    return flask.g.get('request_timer')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    """Note when a statement starts, if it's part of an API request."""
+    # pylint: disable=unused-argument,too-many-arguments
+    if context is not None and _current_timer() is not None:
+        context.hil_query_start = time.time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """Count a statement towards the current API request."""
+    # pylint: disable=unused-argument,too-many-arguments
+    timer = _current_timer()
+    start = getattr(context, 'hil_query_start', None)
+    if timer is None or start is None:
+        return
+    timer.queries += 1
+    timer.db_time += time.time() - start
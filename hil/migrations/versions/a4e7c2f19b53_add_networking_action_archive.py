@@ -0,0 +1,47 @@
+"""add networking action archive
+
+Revision ID: a4e7c2f19b53
+Revises: f3d9b6a2c7e1
+Create Date: 2026-10-19 13:05:52.730416
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a4e7c2f19b53'
+down_revision = 'f3d9b6a2c7e1'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.create_table(
+        'networking_action_archive',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('uuid', sa.String(), nullable=False),
+        sa.Column('batch_id', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.Column('type', sa.String(), nullable=False),
+        sa.Column('channel', sa.String(), nullable=False),
+        sa.Column('node', sa.String(), nullable=False),
+        sa.Column('nic', sa.String(), nullable=False),
+        sa.Column('new_network', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    for column in 'uuid', 'batch_id', 'archived_at':
+        op.create_index(op.f('ix_networking_action_archive_' + column),
+                        'networking_action_archive', [column], unique=False)
+
+
+def downgrade():
+    for column in 'uuid', 'batch_id', 'archived_at':
+        op.drop_index(op.f('ix_networking_action_archive_' + column),
+                      table_name='networking_action_archive')
+    op.drop_table('networking_action_archive')
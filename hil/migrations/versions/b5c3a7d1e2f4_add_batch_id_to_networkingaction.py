@@ -0,0 +1,30 @@
+"""add batch_id to networkingaction
+
+Revision ID: b5c3a7d1e2f4
+Revises: 02f7e9607e16
+Create Date: 2026-10-18 10:12:31.402175
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'b5c3a7d1e2f4'
+down_revision = '02f7e9607e16'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.add_column('networking_action', sa.Column('batch_id', sa.String(),
+                  nullable=True))
+    op.create_index(op.f('ix_networking_action_batch_id'),
+                    'networking_action', ['batch_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_networking_action_batch_id'),
+                  table_name='networking_action')
+    op.drop_column('networking_action', 'batch_id')
@@ -0,0 +1,32 @@
+"""add timestamps to networkingaction
+
+Revision ID: e8a1c6b2d4f0
+Revises: b5c3a7d1e2f4
+Create Date: 2026-10-19 09:41:07.118254
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e8a1c6b2d4f0'
+down_revision = 'b5c3a7d1e2f4'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    op.add_column('networking_action', sa.Column('created_at', sa.DateTime(),
+                  nullable=True))
+    op.add_column('networking_action', sa.Column('started_at', sa.DateTime(),
+                  nullable=True))
+    op.add_column('networking_action', sa.Column('finished_at', sa.DateTime(),
+                  nullable=True))
+
+
+def downgrade():
+    op.drop_column('networking_action', 'finished_at')
+    op.drop_column('networking_action', 'started_at')
+    op.drop_column('networking_action', 'created_at')
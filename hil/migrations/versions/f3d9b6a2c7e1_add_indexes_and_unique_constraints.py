@@ -0,0 +1,53 @@
+"""add indexes and unique constraints for hot lookups
+
+Revision ID: f3d9b6a2c7e1
+Revises: e8a1c6b2d4f0
+Create Date: 2026-10-19 09:41:17.553902
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f3d9b6a2c7e1'
+down_revision = 'e8a1c6b2d4f0'
+branch_labels = None
+
+# pylint: disable=missing-docstring
+
+
+def upgrade():
+    # The API already refuses to create duplicates of any of these, so
+    # existing databases should satisfy them:
+    op.create_unique_constraint(None, 'nic', ['owner_id', 'label'])
+    op.create_unique_constraint(None, 'port', ['owner_id', 'label'])
+    op.create_unique_constraint(None, 'metadata', ['owner_id', 'label'])
+    op.create_unique_constraint(None, 'network_attachment',
+                                ['nic_id', 'network_id'])
+    op.create_unique_constraint(None, 'network_attachment',
+                                ['nic_id', 'channel'])
+
+    op.create_index(op.f('ix_nic_port_id'), 'nic', ['port_id'], unique=False)
+    op.create_index('ix_networking_action_pending', 'networking_action',
+                    ['nic_id', 'id'], unique=False,
+                    postgresql_where=sa.text("status = 'PENDING'"))
+    op.create_index('ix_networking_action_nic_id_status',
+                    'networking_action', ['nic_id', 'status'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_networking_action_nic_id_status',
+                  table_name='networking_action')
+    op.drop_index('ix_networking_action_pending',
+                  table_name='networking_action')
+    op.drop_index(op.f('ix_nic_port_id'), table_name='nic')
+
+    op.drop_constraint('network_attachment_nic_id_channel_key',
+                       'network_attachment', type_='unique')
+    op.drop_constraint('network_attachment_nic_id_network_id_key',
+                       'network_attachment', type_='unique')
+    op.drop_constraint('metadata_owner_id_label_key', 'metadata',
+                       type_='unique')
+    op.drop_constraint('port_owner_id_label_key', 'port', type_='unique')
+    op.drop_constraint('nic_owner_id_label_key', 'nic', type_='unique')
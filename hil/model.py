@@ -16,11 +16,12 @@ from subprocess import call, check_call, Popen, PIPE
 from hil.flaskapp import app
 from hil.config import cfg
 from hil.dev_support import no_dry_run
-from hil import errors
+from hil import errors, obmd
 import requests
 import uuid
 import xml.etree.ElementTree
-from sqlalchemy import BigInteger
+from datetime import datetime
+from sqlalchemy import BigInteger, literal_column
 from sqlalchemy.dialects import sqlite
 
 # without setting this explicitly, we get a warning that this option
@@ -48,6 +49,22 @@ def init_db(uri=None):
     app.config.update(SQLALCHEMY_DATABASE_URI=uri)
 
 
+# The maximum number of values to pass to a single ``IN`` clause; sqlite
+# limits the number of parameters to a query.
+_IN_CHUNK_SIZE = 500
+
+
+def query_in(query, column, values):
+    """Yield the results of ``query``, filtered to ``column IN values``.
+
+    ``values`` is split into chunks, so that it may be arbitrarily long.
+    """
+    values = list(values)
+    for i in range(0, len(values), _IN_CHUNK_SIZE):
+        for row in query.filter(column.in_(values[i:i+_IN_CHUNK_SIZE])):
+            yield row
+
+
 # A joining table for project's access to networks, which have a many to many
 # relationship:
 network_projects = db.Table(
@@ -58,6 +75,7 @@ network_projects = db.Table(
 
 class Nic(db.Model):
     """a nic belonging to a Node"""
+    __table_args__ = (db.UniqueConstraint('owner_id', 'label'),)
 
     id = db.Column(BigIntegerType, primary_key=True)
     label = db.Column(db.String, nullable=False)
@@ -69,8 +87,9 @@ class Nic(db.Model):
     # The mac address of the nic:
     mac_addr = db.Column(db.String)
 
-    # The switch port to which the nic is attached:
-    port_id = db.Column(db.ForeignKey('port.id'))
+    # The switch port to which the nic is attached. The network daemon joins
+    # on this to find the actions for each switch:
+    port_id = db.Column(db.ForeignKey('port.id'), index=True)
     port = db.relationship("Port",
                            backref=db.backref('nic', uselist=False))
 
@@ -79,6 +98,10 @@ class Nic(db.Model):
         self.label = label
         self.mac_addr = mac_addr
 
+    def has_pending_action(self):
+        """Return whether any of the nic's networking actions are pending."""
+        return any(action.is_pending() for action in self.actions)
+
 
 class Node(db.Model):
     """a (physical) machine"""
@@ -118,15 +141,18 @@ class Node(db.Model):
         """Make an "admin" request to the OBMd api.
 
         Makes an API call to the OBMd api, to <node's obmd uri>/<path>, with
-        the given HTTP method, using the node's stored admin token.
+        the given HTTP method, using the node's stored admin token. The
+        request goes through `hil.obmd`, so it is subject to the timeout and
+        retries configured there.
 
-        Returns a response object from the requests library.
+        Returns a response object from the requests library. Raises
+        `OBMError` if OBMd could not be contacted.
         """
-        return requests.request(
-            method,
-            self.obmd_uri + '/' + path,
-            auth=('admin', self.obmd_admin_token),
-        )
+        try:
+            return obmd.request(obmd.NodeTarget.for_node(self),
+                                method, '/' + path, admin=True)
+        except requests.exceptions.RequestException as e:
+            raise errors.OBMError("Could not contact OBMd: %s" % e)
 
 
 class Project(db.Model):
@@ -147,6 +173,8 @@ class Metadata(db.Model):
 
     Metadata may a key, a hash, or otherwise
     """
+    __table_args__ = (db.UniqueConstraint('owner_id', 'label'),)
+
     id = db.Column(BigIntegerType, primary_key=True)
     label = db.Column(db.String, nullable=False)
     value = db.Column(db.String)
@@ -208,10 +236,15 @@ class Port(db.Model):
     The port's label is an identifier that is meaningful only to the
     corresponding switch's driver.
     """
+    __table_args__ = (db.UniqueConstraint('owner_id', 'label'),)
+
     id = db.Column(BigIntegerType, primary_key=True)
     label = db.Column(db.String, nullable=False)
     owner_id = db.Column(db.ForeignKey('switch.id'), nullable=False)
-    owner = db.relationship('Switch', backref=db.backref('ports'))
+    # Ports are listed in the order they were registered; without the
+    # order_by, the database may return them in index order instead:
+    owner = db.relationship('Switch',
+                            backref=db.backref('ports', order_by='Port.id'))
 
     def __init__(self, label, switch):
         """Register a port on a switch."""
@@ -309,6 +342,22 @@ class SwitchSession(object):
         """
         assert False, "Subclasses MUST override revert_port"
 
+    def apply_port_batch(self, port, changes):
+        """Apply several changes to a single port.
+
+        `port` is the name of a port (`Port.label`) on the switch.
+
+        `changes` is a list of (channel, new_network) pairs, each of which has
+        the same meaning as the corresponding arguments to `modify_port`. The
+        changes must be applied in order.
+
+        Drivers may override this to push all of the changes to the switch
+        at once. The default implementation calls `modify_port` for each
+        change.
+        """
+        for channel, new_network in changes:
+            self.modify_port(port, channel, new_network)
+
     def disconnect(self):
         """Disconnect from the switch.
 
@@ -316,6 +365,33 @@ class SwitchSession(object):
         """
         assert False, "Subclasses MUST override disconnect"
 
+    def has_unsaved_changes(self):
+        """Return whether the session has changes which have yet to be saved.
+
+        Drivers which defer saving the running config (see `save_if_due`)
+        should override this; the network daemon keeps such sessions open
+        until their changes are saved. The default returns False.
+        """
+        return False
+
+    def save_if_due(self, force=False):
+        """Save the running config, if the driver's save policy says to.
+
+        The network daemon calls this periodically on idle sessions. If
+        `force` is True, any unsaved changes should be saved regardless of
+        the policy. The default implementation does nothing.
+        """
+
+    def is_alive(self):
+        """Return whether the session is still usable.
+
+        The network daemon may keep a session open between bursts of
+        activity; it calls this before reusing an idle session, and opens a
+        new one if it returns False. The default implementation always
+        returns True, which is appropriate for connectionless drivers.
+        """
+        return True
+
     def get_port_networks(self, ports):
         """Return a mapping from port objects to (channel, network ID)
             pairs.
@@ -338,6 +414,33 @@ class SwitchSession(object):
         """
         assert False, "Subclasses MUST override get_port_networks"
 
+    def snapshot(self, ports):
+        """Return the networks currently attached to each of ``ports``.
+
+        ``ports`` is a list of port objects. The return value is a dictionary
+        from port labels to dictionaries from channels to network IDs, e.g.:
+
+            {
+                "gi1/0/3": {"vlan/native": "23", "vlan/52": "52"},
+                "gi1/0/7": {"vlan/23": "23"},
+                "gi1/0/8": {},
+                ...
+            }
+
+        Ports which the switch doesn't have may be left out of the result
+        (drivers should log them), rather than reported as having no networks.
+
+        Unlike `get_port_networks`, this is meant for use in production, to
+        audit a switch against HIL's database. Drivers should read the state
+        of the whole switch in as few requests as they can; the default
+        implementation just calls `get_port_networks`.
+        """
+        result = {}
+        for port, networks in self.get_port_networks(ports).iteritems():
+            result[port.label] = dict((channel, str(network_id))
+                                      for channel, network_id in networks)
+        return result
+
     def save_running_config(self):
         """saves the running config to startup config"""
         assert False, "Subclasses MUST override save_running_config"
@@ -527,15 +630,33 @@ class NetworkingAction(db.Model):
     # Legal values for `type`
     legal_types = ('modify_port', 'revert_port')
 
+    # Values of `status` for actions which have not been completed yet.
+    # 'IN_PROGRESS' means the network daemon has claimed the action, and is
+    # in the process of applying it.
+    pending_statuses = ('PENDING', 'IN_PROGRESS')
+
     id = db.Column(BigIntegerType, primary_key=True)
 
     # UUID of a networking action. Useful for querying the status of a
     # networking action.
     uuid = db.Column(db.String, nullable=False, index=True)
 
-    # status of the operation; it can either be 'PENDING', 'DONE' or 'ERROR'
+    # UUID of the batch the action was queued in (see
+    # `api.networking_action_batch`), or None if it was queued on its own.
+    batch_id = db.Column(db.String, nullable=True, index=True)
+
+    # status of the operation; it can either be 'PENDING', 'IN_PROGRESS',
+    # 'DONE' or 'ERROR'
     status = db.Column(db.String, nullable=False)
 
+    # When the action was queued, when the network daemon started on it, and
+    # when it finished (i.e. became 'DONE' or 'ERROR'), in UTC. Actions
+    # queued before these were added have no timestamps, and the latter two
+    # are None until the daemon gets to the action.
+    created_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
     # The type of action.
     #
     # * 'modify_port' attaches the (nic, channel) pair to a specified network,
@@ -552,9 +673,13 @@ class NetworkingAction(db.Model):
     channel = db.Column(db.String, nullable=False)
 
     # The nic affected by the action. for 'revert_port', this is the nic
-    # attached to the specified port.
+    # attached to the specified port. A nic normally has at most one action
+    # (finished ones are deleted when a new one is queued), but a batch of
+    # actions (see `api.networking_action_batch`) may queue several, which
+    # are applied in order of id.
     nic = db.relationship("Nic",
-                          backref=db.backref('current_action', uselist=False))
+                          backref=db.backref('actions',
+                                             order_by='NetworkingAction.id'))
 
     # For 'modify_port', this is the new network that the (nic, channel) pair
     # should be moved to, or None if the (nic, channel) should just be detached
@@ -563,16 +688,74 @@ class NetworkingAction(db.Model):
                                   backref=db.backref('scheduled_nics',
                                                      uselist=True))
 
+    def is_pending(self):
+        """Return whether the action has yet to be completed."""
+        return self.status in self.pending_statuses
+
+    @classmethod
+    def unclaimed(cls):
+        """Return a filter for the actions which are 'PENDING'.
+
+        The status is compared with a literal rather than a bound parameter,
+        so that sqlite can tell that ``ix_networking_action_pending`` covers
+        the query.
+        """
+        return cls.status == literal_column("'PENDING'")
+
+
+# The network daemon looks for 'PENDING' actions, in order, on every pass;
+# finished actions pile up in the journal, so this index only covers the
+# pending ones. The API looks up the actions on a nic by status:
+db.Index('ix_networking_action_pending',
+         NetworkingAction.nic_id, NetworkingAction.id,
+         postgresql_where=NetworkingAction.unclaimed(),
+         sqlite_where=NetworkingAction.unclaimed())
+db.Index('ix_networking_action_nic_id_status',
+         NetworkingAction.nic_id, NetworkingAction.status)
+
+
+class ArchivedNetworkingAction(db.Model):
+    """A finished networking action, moved out of the journal.
+
+    See `hil.journal`. The nic, node and network are recorded by label, as
+    they were when the action was archived, so that archived actions needn't
+    hold on to (or be deleted along with) the objects they refer to.
+    """
+    __tablename__ = 'networking_action_archive'
+
+    # The same as the id of the original action:
+    id = db.Column(BigIntegerType, primary_key=True)
+    uuid = db.Column(db.String, nullable=False, index=True)
+    batch_id = db.Column(db.String, nullable=True, index=True)
+
+    # 'DONE' or 'ERROR':
+    status = db.Column(db.String, nullable=False)
+    type = db.Column(db.String, nullable=False)
+    channel = db.Column(db.String, nullable=False)
+
+    node = db.Column(db.String, nullable=False)
+    nic = db.Column(db.String, nullable=False)
+    new_network = db.Column(db.String, nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def is_pending(self):
+        """Return False: archived actions have always been completed."""
+        return False
+
 
 class NetworkAttachment(db.Model):
     """An attachment of a network to a particular nic on a channel"""
+    # A network is attached to a nic at most once, and each of the nic's
+    # channels carries at most one network:
+    __table_args__ = (db.UniqueConstraint('nic_id', 'network_id'),
+                      db.UniqueConstraint('nic_id', 'channel'))
+
     id = db.Column(BigIntegerType, primary_key=True)
 
-    # TODO: it would be nice to place explicit unique constraints on some
-    # things:
-    #
-    # * (nic_id, network_id)
-    # * (nic_id, channel)
     nic_id = db.Column(db.ForeignKey('nic.id'), nullable=False)
     network_id = db.Column(db.ForeignKey('network.id'), nullable=False)
     channel = db.Column(db.String, nullable=False)
@@ -0,0 +1,153 @@
+"""Wake up the network daemon when networking actions are queued.
+
+Without this, ``hil-admin serve-networks`` only notices new entries in the
+journal when it polls the database, every ``sleep_time`` seconds. This module
+lets the API server tell the daemon that there is work to do:
+
+* On PostgreSQL, inserting a `NetworkingAction` runs ``NOTIFY`` on the
+  `CHANNEL`; the daemon ``LISTEN``s for it. Notifications are transactional,
+  so they are only delivered once the action is committed.
+* On SQLite, if the ``notify_socket`` option in the ``[network-daemon]``
+  section is set to a path, the API server sends an (empty) datagram to a
+  unix socket at that path after committing a new action, and the daemon
+  listens on the socket.
+
+In either case, the daemon still falls back to polling, so a lost
+notification only delays an action; it never loses it.
+"""
+
+import errno
+import logging
+import os
+import select
+import socket
+from time import sleep
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from hil import model
+from hil.config import cfg
+from hil.model import db
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'hil_networking_actions'
+
+# Key in `Session.info` marking a session as having inserted an action:
+_PENDING_KEY = 'hil.notify.pending'
+
+
+def _socket_path():
+    """Return the path of the SQLite stand-in socket, or None."""
+    if cfg.has_option('network-daemon', 'notify_socket'):
+        return cfg.get('network-daemon', 'notify_socket')
+    return None
+
+
+@event.listens_for(model.NetworkingAction, 'after_insert')
+def _after_insert(mapper, connection, target):
+    """Notify the daemon of a new action (once its transaction commits)."""
+    # pylint: disable=unused-argument
+    if connection.dialect.name == 'postgresql':
+        connection.execute('NOTIFY ' + CHANNEL)
+    else:
+        object_session(target).info[_PENDING_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    """Send the SQLite stand-in notification, if one is due."""
+    if not session.info.pop(_PENDING_KEY, False):
+        return
+    path = _socket_path()
+    if path is None:
+        return
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.sendto('', path)
+    except socket.error as e:
+        # The daemon isn't running, or is too busy to read its socket; either
+        # way it will find the action when it next looks at the journal.
+        logger.debug('Could not notify the network daemon: %s', e)
+    finally:
+        sock.close()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    """Forget about any actions inserted by a rolled back transaction."""
+    session.info.pop(_PENDING_KEY, None)
+
+
+class Listener(object):
+    """Waits for notifications that networking actions have been queued.
+
+    The listener should be created before the daemon first checks the
+    journal, so that no notifications are missed in between.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._sock = None
+
+        if db.engine.dialect.name == 'postgresql':
+            self._conn = db.engine.raw_connection()
+            dbapi_conn = self._conn.connection
+            dbapi_conn.autocommit = True
+            dbapi_conn.cursor().execute('LISTEN ' + CHANNEL)
+            logger.info('Listening for notifications on channel %s',
+                        CHANNEL)
+        elif _socket_path() is not None:
+            path = _socket_path()
+            try:
+                os.unlink(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.bind(path)
+            self._sock.setblocking(False)
+            logger.info('Listening for notifications on socket %s', path)
+
+    def wait(self, timeout):
+        """Wait until an action is queued, or ``timeout`` seconds pass.
+
+        Returns True if a notification was received, False otherwise. If no
+        notification mechanism is available, this just sleeps.
+        """
+        if self._conn is not None:
+            dbapi_conn = self._conn.connection
+            if not dbapi_conn.notifies:
+                select.select([dbapi_conn], [], [], timeout)
+                dbapi_conn.poll()
+            notified = bool(dbapi_conn.notifies)
+            del dbapi_conn.notifies[:]
+            return notified
+        elif self._sock is not None:
+            readable, _, _ = select.select([self._sock], [], [], timeout)
+            notified = False
+            while readable:
+                try:
+                    self._sock.recv(1)
+                    notified = True
+                except socket.error as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    break
+            return notified
+        else:
+            sleep(timeout)
+            return False
+
+    def close(self):
+        """Stop listening."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._sock is not None:
+            path = self._sock.getsockname()
+            self._sock.close()
+            self._sock = None
+            os.unlink(path)
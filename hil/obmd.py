@@ -0,0 +1,178 @@
+"""A client for OBMd, for the calls HIL makes to it itself.
+
+Most OBM operations are handled by redirecting the API client to OBMd (see
+``_obmd_redirect`` in `hil.api`), but some are made by HIL itself: getting
+and invalidating node tokens (see `Node.enable_obm`), and the bulk power
+operations, which are made on the client's behalf. These share a single
+`requests.Session` (see `session`), so that connections to OBMd are reused
+rather than re-established for every request.
+
+The ``[obmd]`` section of ``hil.cfg`` may set:
+
+* ``request_timeout``: how long to wait for OBMd to connect and to answer
+  each request, in seconds (default 10).
+* ``bulk_workers``: how many requests `fan_out` makes at once (default 16).
+  This is also the number of connections kept open to each OBMd server.
+* ``request_retries``: how many times to retry a request which fails to
+  connect, or (for idempotent requests) fails with a 502, 503 or 504
+  response (default 2). Requests which time out waiting for OBMd to answer
+  are not retried, so that a hung OBMd costs only one timeout.
+* ``retry_backoff``: the backoff factor between retries; see urllib3's
+  ``Retry`` (default 0.5).
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from hil.config import cfg
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_WORKERS = 16
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+
+_lock = threading.Lock()
+_session = None
+
+
+def request_timeout():
+    """Return the configured timeout for requests to OBMd, in seconds."""
+    if cfg.has_option('obmd', 'request_timeout'):
+        return cfg.getfloat('obmd', 'request_timeout')
+    return DEFAULT_TIMEOUT
+
+
+def bulk_workers():
+    """Return the configured number of concurrent requests to OBMd."""
+    if cfg.has_option('obmd', 'bulk_workers'):
+        return cfg.getint('obmd', 'bulk_workers')
+    return DEFAULT_WORKERS
+
+
+def _retries():
+    """Return the `Retry` policy for requests to OBMd."""
+    total = DEFAULT_RETRIES
+    if cfg.has_option('obmd', 'request_retries'):
+        total = cfg.getint('obmd', 'request_retries')
+    backoff = DEFAULT_BACKOFF
+    if cfg.has_option('obmd', 'retry_backoff'):
+        backoff = cfg.getfloat('obmd', 'retry_backoff')
+    return Retry(total=total,
+                 read=False,
+                 backoff_factor=backoff,
+                 status_forcelist=(502, 503, 504),
+                 raise_on_status=False)
+
+
+def session():
+    """Return the shared session for requests to OBMd.
+
+    The session is created on first use. It keeps a separate connection
+    pool for each OBMd server, big enough for `bulk_workers` concurrent
+    requests, and retries failed requests as configured.
+    """
+    global _session
+    with _lock:
+        if _session is None:
+            adapter = HTTPAdapter(pool_maxsize=bulk_workers(),
+                                  max_retries=_retries())
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+class NodeTarget(namedtuple('NodeTarget',
+                            ['label', 'uri', 'token', 'admin_token'])):
+    """The details needed to make a request of OBMd about a node.
+
+    ``uri`` is the node's OBMd uri, ``token`` its node token (or None if its
+    OBM is not enabled), and ``admin_token`` its admin token. These are
+    copied out of the `Node`, so that they can be used from other threads.
+    """
+
+    @classmethod
+    def for_node(cls, node):
+        """Return the target for ``node``, a `Node`."""
+        return cls(node.label, node.obmd_uri, node.obmd_node_token,
+                   node.obmd_admin_token)
+
+
+def request(target, method, path, body=None, admin=False):
+    """Make a request of OBMd about a node, and return the response.
+
+    The request is ``method`` on ``path`` (e.g. '/power_off'), relative to
+    the `NodeTarget` ``target``'s uri, with ``body`` (if not None) as its
+    JSON body. If ``admin`` is True, the request is authenticated with the
+    node's admin token; otherwise it is made with the node token.
+
+    Any exception from `requests` is passed on to the caller.
+    """
+    kwargs = {'json': body, 'timeout': request_timeout()}
+    if admin:
+        kwargs['auth'] = ('admin', target.admin_token)
+    else:
+        kwargs['params'] = {'token': target.token}
+    return session().request(method, target.uri + path, **kwargs)
+
+
+def _node_request(args):
+    """Make a single request for `fan_out`, and return its result."""
+    target, method, path, body, admin = args
+    if not admin and target.token is None:
+        return {'ok': False, 'status_code': None, 'body': None,
+                'error': 'OBM is not enabled'}
+    try:
+        resp = request(target, method, path, body, admin)
+    except requests.exceptions.Timeout:
+        return {'ok': False, 'status_code': None, 'body': None,
+                'error': 'OBMd timed out'}
+    except requests.exceptions.RequestException as e:
+        logger.warn('Error contacting OBMd for node %s: %s', target.label, e)
+        return {'ok': False, 'status_code': None, 'body': None,
+                'error': 'could not contact OBMd'}
+    try:
+        resp_body = resp.json()
+    except ValueError:
+        resp_body = None
+    result = {'ok': resp.ok, 'status_code': resp.status_code,
+              'body': resp_body, 'error': None}
+    if not resp.ok:
+        result['error'] = 'OBMd returned status %d' % resp.status_code
+    return result
+
+
+def fan_out(targets, method, path, body=None, admin=False):
+    """Make the same request of OBMd for each of several nodes, concurrently.
+
+    ``targets`` is a list of `NodeTarget`s, and the other arguments are as
+    for `request`. At most `bulk_workers` requests are made at once, and
+    each is given `request_timeout` seconds.
+
+    Returns a dict mapping each node's label to its result: a dict with
+    ``ok`` (whether OBMd reported success), ``status_code`` (OBMd's status
+    code, or None if there was no response), ``body`` (the decoded JSON
+    response body, if any) and ``error`` (a description of what went wrong,
+    or None). Unless ``admin`` is True, nodes whose OBM is not enabled are
+    not sent a request.
+    """
+    if not targets:
+        return {}
+    pool = ThreadPool(min(bulk_workers(), len(targets)))
+    try:
+        results = pool.map(_node_request,
+                           [(target, method, path, body, admin)
+                            for target in targets])
+    finally:
+        pool.close()
+        pool.join()
+    return dict((target.label, result)
+                for target, result in zip(targets, results))
@@ -0,0 +1,296 @@
+"""Check the networks attached to ports against what the switches report.
+
+HIL's database (the `NetworkAttachment` table) is the source of truth for
+which networks are attached to which nics, but nothing stops a switch from
+drifting away from it: someone may change a port by hand, or a switch may
+lose its running config. This module reads the state of each switch with
+`SwitchSession.snapshot`, compares it with the database, and can queue
+networking actions to bring the switches back in line.
+
+The switches are read in parallel, and the database is read with a handful
+of queries, no matter how many ports there are.
+"""
+
+import logging
+import uuid
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+from hil import model, deferred
+from hil.model import db
+
+logger = logging.getLogger(__name__)
+
+
+class PortDrift(namedtuple('PortDrift', [
+        'switch', 'port', 'nic_id', 'missing', 'extra'])):
+    """The differences between the database and a switch for one port.
+
+    * ``switch`` and ``port`` are the labels of the switch and port.
+    * ``nic_id`` is the id of the nic attached to the port, or None.
+    * ``missing`` is a set of (channel, network_id) pairs which are attached
+      according to the database, but not according to the switch.
+    * ``extra`` is a set of (channel, network_id) pairs which are attached
+      according to the switch, but not according to the database.
+
+    ``network_id`` is the switch-level id of a network (i.e.
+    `Network.network_id`), as a string.
+    """
+
+    def __str__(self):
+        return '%s %s: missing %s; extra %s' % (
+            self.switch, self.port,
+            _format_networks(self.missing), _format_networks(self.extra))
+
+
+def _format_networks(networks):
+    """Format a set of (channel, network_id) pairs for a report."""
+    if not networks:
+        return 'nothing'
+    return ', '.join('%s=%s' % pair for pair in sorted(networks))
+
+
+def _snapshot_switch(switch_id, pool):
+    """Read the state of every port on a switch.
+
+    Returns the switch's `SwitchSession.snapshot`, or None if the switch
+    couldn't be read.
+    """
+    switch = model.Switch.query.get(switch_id)
+    ports = list(switch.ports)
+    entry = pool.checkout(switch)
+    try:
+        snapshot = entry.session.snapshot(ports)
+    except Exception:
+        logger.exception('Could not read the state of switch %s',
+                         switch.label)
+        pool.discard(entry)
+        return None
+    pool.checkin(switch_id, entry)
+    return snapshot
+
+
+def _snapshot_switch_in_thread(args):
+    """Like _snapshot_switch, but for use in a worker thread.
+
+    ``args`` is a tuple of the arguments to _snapshot_switch. Returns a
+    tuple (switch_id, snapshot). See `deferred._drain_switch_in_thread`.
+    """
+    try:
+        return args[0], _snapshot_switch(*args)
+    except Exception:
+        logger.exception('Could not read the state of switch with id %d',
+                         args[0])
+        return args[0], None
+    finally:
+        db.session.remove()
+
+
+def _snapshot_switches(switch_ids, pool, workers):
+    """Snapshot each of the switches, ``workers`` at a time.
+
+    Returns a dict from switch ids to snapshots (or None, for switches which
+    couldn't be read).
+    """
+    if workers > 1 and len(switch_ids) > 1:
+        threads = ThreadPool(min(workers, len(switch_ids)))
+        try:
+            return dict(threads.map(_snapshot_switch_in_thread,
+                                    [(switch_id, pool)
+                                     for switch_id in switch_ids]))
+        finally:
+            threads.close()
+            threads.join()
+    return dict((switch_id, _snapshot_switch(switch_id, pool))
+                for switch_id in switch_ids)
+
+
+def _expected_state(switch_ids):
+    """Return what the database says should be on each port.
+
+    Returns a dict from (switch_id, port_label) pairs to tuples of the form
+    (nic_id, attachments), where attachments is a set of (channel,
+    network_id) pairs. Every port on the switches is included.
+    """
+    expected = {}
+    ports = db.session.query(model.Port.owner_id, model.Port.label,
+                             model.Nic.id) \
+        .outerjoin(model.Nic, model.Nic.port_id == model.Port.id)
+    for switch_id, label, nic_id in model.query_in(
+            ports, model.Port.owner_id, switch_ids):
+        expected[(switch_id, label)] = (nic_id, set())
+
+    attachments = db.session.query(model.Port.owner_id, model.Port.label,
+                                   model.NetworkAttachment.channel,
+                                   model.Network.network_id) \
+        .join(model.Nic, model.Nic.port_id == model.Port.id) \
+        .join(model.NetworkAttachment,
+              model.NetworkAttachment.nic_id == model.Nic.id) \
+        .join(model.Network,
+              model.NetworkAttachment.network_id == model.Network.id)
+    for switch_id, label, channel, network_id in model.query_in(
+            attachments, model.Port.owner_id, switch_ids):
+        expected[(switch_id, label)][1].add((channel, str(network_id)))
+    return expected
+
+
+def find_drift(workers=1, pool=None):
+    """Compare every switch with the database.
+
+    ``workers`` is the number of switches to read at once. ``pool`` is the
+    `deferred.SessionPool` to get switch sessions from; if it is None, a new
+    pool is used, and all of its sessions are closed before returning.
+
+    Returns a tuple (drift, failed): drift is a list of `PortDrift`s, one for
+    each port which differs, and failed is a list of the labels of the
+    switches which couldn't be read. Ports on those switches are left out of
+    drift, rather than being reported as empty, as are ports which a switch's
+    snapshot leaves out because the switch doesn't have them.
+
+    The database is read after the switches, so that an action which the
+    network daemon completes in between shows up as pending, or as done,
+    rather than as drift in the database's favour.
+    """
+    switches = dict(db.session.query(model.Switch.id, model.Switch.label))
+    # Don't hold a transaction open while we talk to the switches:
+    db.session.commit()
+
+    own_pool = pool is None
+    if own_pool:
+        pool = deferred.SessionPool()
+    try:
+        snapshots = _snapshot_switches(sorted(switches), pool, workers)
+    finally:
+        # As in deferred.apply_networking, sessions with unsaved changes
+        # would otherwise be left open:
+        if own_pool:
+            pool.close()
+    failed = sorted(switches[switch_id]
+                    for switch_id, snapshot in snapshots.iteritems()
+                    if snapshot is None)
+    read = [switch_id for switch_id, snapshot in snapshots.iteritems()
+            if snapshot is not None]
+    if not read:
+        return [], failed
+
+    drift = []
+    expected = _expected_state(read)
+    for (switch_id, label), (nic_id, attached) in expected.iteritems():
+        if label not in snapshots[switch_id]:
+            # The switch doesn't have the port; its driver logs that.
+            continue
+        actual = set(snapshots[switch_id][label].iteritems())
+        missing = attached - actual
+        extra = actual - attached
+        if missing or extra:
+            drift.append(PortDrift(switch=switches[switch_id],
+                                   port=label,
+                                   nic_id=nic_id,
+                                   missing=missing,
+                                   extra=extra))
+    drift.sort(key=lambda d: (d.switch, d.port))
+    return drift, failed
+
+
+def _corrective_action(drift, attachments):
+    """Return the next action to bring a port in line, or None.
+
+    ``attachments`` maps the channels which should be attached to the port's
+    nic, according to the database, to their `Network` objects.
+
+    Only one action is returned per port, since the API only allows one
+    pending action per nic; any remaining drift is dealt with on the next
+    run. Networks which shouldn't be there are dealt with first:
+
+    * If nothing should be attached, the port is reverted.
+    * A channel with the wrong network on it is moved to the right one, or
+      detached if nothing should be on it. The native channel goes first.
+    * Finally, missing networks are attached.
+    """
+    def modify_port(channel):
+        """Move ``channel`` to the network the database says it's on."""
+        return model.NetworkingAction(type='modify_port',
+                                      nic_id=drift.nic_id,
+                                      channel=channel,
+                                      new_network=attachments.get(channel),
+                                      uuid=str(uuid.uuid4()),
+                                      status='PENDING')
+
+    if drift.nic_id is None:
+        return None
+    if drift.extra and not attachments:
+        return model.NetworkingAction(type='revert_port',
+                                      nic_id=drift.nic_id,
+                                      channel='',
+                                      uuid=str(uuid.uuid4()),
+                                      status='PENDING',
+                                      new_network=None)
+    extra = sorted(channel for channel, _ in drift.extra)
+    if 'vlan/native' in extra:
+        return modify_port('vlan/native')
+    if extra:
+        return modify_port(extra[0])
+    if drift.missing:
+        return modify_port(min(drift.missing)[0])
+    return None
+
+
+def fix_drift(drift):
+    """Queue networking actions to correct ``drift``.
+
+    ``drift`` is a list of `PortDrift`s, as returned by `find_drift`. Ports
+    with no nic can't be fixed (HIL only acts on ports via their nics), and
+    nics which already have a pending action are left alone. At most one
+    action is queued per nic; see `_corrective_action`.
+
+    Returns the list of queued actions. The caller is responsible for
+    committing them.
+    """
+    nic_ids = set(d.nic_id for d in drift if d.nic_id is not None)
+    if not nic_ids:
+        return []
+
+    busy = set(row[0] for row in db.session.query(
+        model.NetworkingAction.nic_id).filter(
+            model.NetworkingAction.nic_id.in_(nic_ids),
+            model.NetworkingAction.status.in_(
+                model.NetworkingAction.pending_statuses)))
+
+    attachments = dict((nic_id, {}) for nic_id in nic_ids)
+    for attachment in model.NetworkAttachment.query \
+            .options(db.joinedload('network')) \
+            .filter(model.NetworkAttachment.nic_id.in_(nic_ids)):
+        attachments[attachment.nic_id][attachment.channel] = \
+            attachment.network
+
+    actions = []
+    for d in drift:
+        if d.nic_id is None or d.nic_id in busy:
+            continue
+        action = _corrective_action(d, attachments[d.nic_id])
+        if action is not None:
+            db.session.add(action)
+            actions.append(action)
+            busy.add(d.nic_id)
+    return actions
+
+
+def reconcile(fix=False, workers=1, pool=None):
+    """Look for drift between the database and the switches, and log it.
+
+    If ``fix`` is True, also queue (and commit) actions to correct it.
+    ``workers`` and ``pool`` are as for `find_drift`.
+
+    Returns the return value of `find_drift`.
+    """
+    drift, failed = find_drift(workers=workers, pool=pool)
+    for switch in failed:
+        logger.error('Could not check switch %s for drift', switch)
+    for d in drift:
+        logger.warn('Drift on %s', d)
+    if fix:
+        actions = fix_drift(drift)
+        db.session.commit()
+        if actions:
+            logger.info('Queued %d actions to correct drift', len(actions))
+    return drift, failed
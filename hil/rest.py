@@ -11,6 +11,7 @@ import json
 
 import flask
 from flask import _app_ctx_stack as ctx_stack
+from werkzeug.exceptions import HTTPException
 
 from hil.flaskapp import app
 from hil.errors import APIError, AuthorizationError
@@ -19,7 +20,7 @@ from hil.config import cfg
 from schema import SchemaError
 from uuid import uuid4
 
-from hil import auth
+from hil import auth, metrics
 
 local = flask.g
 
@@ -163,6 +164,8 @@ def rest_call(methods, path, schema, dont_log=()):
           the status code will be 200.
         * A tuple, whose first element is a string (the response body), and
           whose second is an integer (the status code).
+        * A ``flask.Response``, which will be returned as-is. This is useful
+          for streaming responses (see ``hil.api.list_response``).
     """
     def register(f):
         """Return value from rest call; this decorates the function itself."""
@@ -258,27 +261,51 @@ def _rest_wrapper(f, schema, dont_log):
       `rest_call`.
     * Log arguments, except those in `dont_log`.
     * Convert `None` return values to empty bodies.
+    * Record metrics about the request (see `hil.metrics`).
 
     The result of this is suitable to hand directly to flask.
     """
 
     def wrapper(**kwargs):
         """The wrapper described above."""
-        kwargs = _do_validation(schema, kwargs)
+        timer = metrics.RequestTimer(f.__name__)
+        local.request_timer = timer
+        status = 500
+        try:
+            kwargs = _do_validation(schema, kwargs)
+
+            censored_kwargs = kwargs.copy()
+            for argname in dont_log:
+                censored_kwargs[argname] = '<<CENSORED>>'
+
+            timer.time_auth(init_auth)
+            logger.info('API call: %s(%s)',
+                        f.__name__, _format_arglist(**censored_kwargs))
+
+            ret = f(**kwargs)
+            if ret is None:
+                ret = ''
+            status = _status_code(ret)
+            return ret
+        except HTTPException as e:
+            status = getattr(e, 'status_code', e.code)
+            raise
+        finally:
+            local.request_timer = None
+            timer.finish(flask.request.method, status)
+    return wrapper
 
-        censored_kwargs = kwargs.copy()
-        for argname in dont_log:
-            censored_kwargs[argname] = '<<CENSORED>>'
 
-        init_auth()
-        logger.info('API call: %s(%s)',
-                    f.__name__, _format_arglist(**censored_kwargs))
+def _status_code(ret):
+    """Return the status code of the response for return value ``ret``.
 
-        ret = f(**kwargs)
-        if ret is None:
-            ret = ''
-        return ret
-    return wrapper
+    ``ret`` is the return value of an API call; see `rest_call`.
+    """
+    if isinstance(ret, tuple):
+        return ret[1]
+    if isinstance(ret, flask.Response):
+        return ret.status_code
+    return 200
 
 
 def _format_arglist(*args, **kwargs):
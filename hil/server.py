@@ -1,14 +1,19 @@
 """Manage server-side startup"""
+import logging
 import sys
 
 # api must be loaded to register the api callbacks, even though we don't
 # use it directly from this module.
 from hil import api  # pylint: disable=unused-import
 
-from hil import model, auth
+from hil import model, auth, obmd
 from hil.class_resolver import build_class_map_for
+from hil.dev_support import no_dry_run
+from hil.model import db
 from hil.network_allocator import get_network_allocator
 
+logger = logging.getLogger(__name__)
+
 
 def register_drivers():
     """Put all of the loaded drivers somewhere where the server can find them.
@@ -39,15 +44,28 @@ def validate_state():
                  "the auth backend.")
 
 
+@no_dry_run
 def stop_orphan_consoles():
     """Stop any orphaned console logging processes.
 
     These may exist if HIL was shut down uncleanly.
+
+    This invalidates every node's OBMd token, as `Node.disable_obm` does,
+    but makes the requests concurrently (see `hil.obmd.fan_out`), so that
+    startup doesn't wait on each node in turn. Nodes whose token could not
+    be invalidated are logged, and keep their token.
     """
-    # Stop all orphan console logging processes on startup
     nodes = model.Node.query.all()
+    results = obmd.fan_out([obmd.NodeTarget.for_node(node) for node in nodes],
+                           'DELETE', '/token', admin=True)
     for node in nodes:
-        node.disable_obm()
+        result = results[node.label]
+        if result['ok']:
+            node.obmd_node_token = None
+        else:
+            logger.error('Failed to invalidate the OBMd token for node %s: %s',
+                         node.label, result['error'])
+    db.session.commit()
 
 
 def init():
@@ -10,8 +10,9 @@ from hil.config import cfg
 from hil.rest import app, init_auth
 from hil.model import db, init_db, Node, Nic, Network, Project, Headnode, \
     Hnic, Switch, Port, Metadata
-from hil import api, config, server
+from hil import api, config, layout, server
 from abc import ABCMeta, abstractmethod
+from sqlalchemy import event
 import json
 import subprocess
 import sys
@@ -300,6 +301,34 @@ class LoggedWarningError(Exception):
         return 'LoggedWarningError(%r)' % self.record
 
 
+class QueryCounter(object):
+    """Context manager which counts the SQL statements run inside it.
+
+    Example:
+
+        with QueryCounter() as counter:
+            api.show_node('node-99')
+        assert counter.count == 4
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def _before_cursor_execute(self, *args):
+        """Event listener; counts one statement."""
+        # pylint: disable=unused-argument
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(db.engine, 'before_cursor_execute',
+                     self._before_cursor_execute)
+
+
 class ModelTest:
     """Superclass with tests common to all models.
 
@@ -415,24 +444,9 @@ def site_layout():
     Full documentation for the site-layout.json file format is located in
     ``docs/testing.md``.
     """
-    layout_json_data = open('site-layout.json')
-    layout = json.load(layout_json_data)
-    layout_json_data.close()
-
-    for switch in layout['switches']:
-        api.switch_register(**switch)
-
-    for node in layout['nodes']:
-        api.node_register(
-            node=node['name'],
-            obm=node['obm'],
-            obmd=node['obmd'],
-        )
-        for nic in node['nics']:
-            api.node_register_nic(node['name'], nic['name'], nic['mac'])
-            api.switch_register_port(nic['switch'], nic['port'])
-            api.port_connect_nic(nic['switch'], nic['port'],
-                                 node['name'], nic['name'])
+    with open('site-layout.json') as layout_json_data:
+        layout.import_layout(json.load(layout_json_data))
+    db.session.commit()
 
 
 def obmd_cfg():
@@ -540,14 +554,15 @@ def additional_db():
     runway = db.session.query(Project).filter_by(label="runway").one()
 
     with app.app_context():
-        for node_label in ['runway_node_0', 'runway_node_1',
-                           'manhattan_node_0', 'manhattan_node_1']:
+        for i, node_label in enumerate(['runway_node_0', 'runway_node_1',
+                                        'manhattan_node_0',
+                                        'manhattan_node_1']):
 
             node = db.session.query(Node).filter_by(label=node_label).one()
             nic = db.session.query(Nic).filter_by(owner=node,
                                                   label='boot-nic').one()
 
-            port = Port('connected_port_0', switch)
+            port = Port('connected_port_%d' % i, switch)
             port.nic = nic
             nic.port = port
 
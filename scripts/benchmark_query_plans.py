@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""Show the query plans (and timings) of HIL's hot lookups on a big database.
+
+This fills a fresh database with a synthetic site -- by default 100,000
+networking actions (almost all of them finished, as in a long-running
+deployment), 10,000 nodes with two nics each, their ports, attachments and
+metadata -- and then, for each of the queries the network daemon and the
+API run most often, prints the database's plan for it and how long it took.
+
+Usage:
+
+    python scripts/benchmark_query_plans.py [--uri URI] [--actions N]
+                                            [--without-indexes]
+
+``--uri`` is the database to use; by default a temporary sqlite file is
+created. On PostgreSQL, the database must exist and be empty, and the
+plans are those of ``EXPLAIN ANALYZE``. ``--without-indexes`` leaves out
+the indexes and unique constraints added for these lookups, so that the
+plans can be compared.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import UniqueConstraint
+
+from hil import model
+from hil.flaskapp import app
+from hil.model import db
+
+# The indexes which --without-indexes leaves out (along with the unique
+# constraints on the tables listed):
+_INDEXES = ['ix_nic_port_id',
+            'ix_networking_action_pending',
+            'ix_networking_action_nic_id_status']
+_CONSTRAINED_TABLES = ['nic', 'port', 'metadata', 'network_attachment']
+
+_SWITCHES = 20
+_PENDING = 100
+
+
+def drop_new_indexes():
+    """Remove the hot-path indexes and constraints from the metadata."""
+    for table in db.metadata.tables.values():
+        table.indexes = set(index for index in table.indexes
+                            if index.name not in _INDEXES)
+        if table.name in _CONSTRAINED_TABLES:
+            table.constraints = set(
+                constraint for constraint in table.constraints
+                if not isinstance(constraint, UniqueConstraint))
+    db.metadata.tables['nic'].c.port_id.index = False
+
+
+def populate(num_actions):
+    """Fill the database with a synthetic site.
+
+    Returns a dict of ids to use in the queries.
+    """
+    num_nodes = max(num_actions // 10, 1)
+    insert = db.session.execute
+
+    insert(model.Switch.__table__.insert(),
+           [{'id': i + 1, 'label': 'sw%d' % i, 'type': 'mock'}
+            for i in range(_SWITCHES)])
+    insert(model.Network.__table__.insert(),
+           [{'id': i + 1, 'label': 'net%d' % i, 'network_id': str(i),
+             'allocated': True}
+            for i in range(100)])
+    insert(model.Node.__table__.insert(),
+           [{'id': i + 1, 'label': 'node%d' % i,
+             'obmd_uri': 'http://obmd.example.com/nodes/node%d' % i,
+             'obmd_admin_token': 'secret'}
+            for i in range(num_nodes)])
+    ports = []
+    nics = []
+    attachments = []
+    metadata = []
+    for i in range(num_nodes):
+        for j in range(2):
+            nic_id = 2 * i + j + 1
+            ports.append({'id': nic_id, 'owner_id': nic_id % _SWITCHES + 1,
+                          'label': 'gi1/0/%d' % nic_id})
+            nics.append({'id': nic_id, 'owner_id': i + 1,
+                         'label': 'eth%d' % j, 'port_id': nic_id,
+                         'mac_addr': '%012x' % nic_id})
+            attachments.append({'nic_id': nic_id,
+                                'network_id': nic_id % 100 + 1,
+                                'channel': 'vlan/native'})
+        metadata.append({'owner_id': i + 1, 'label': 'rack',
+                         'value': '"r%d"' % (i % 40)})
+    for table, rows in [(model.Port, ports),
+                        (model.Nic, nics),
+                        (model.NetworkAttachment, attachments),
+                        (model.Metadata, metadata)]:
+        insert(table.__table__.insert(), rows)
+
+    actions = []
+    for i in range(num_actions):
+        actions.append({
+            'id': i + 1,
+            'uuid': '%032x' % i,
+            'nic_id': i % len(nics) + 1,
+            'new_network_id': i % 100 + 1,
+            'channel': 'vlan/native',
+            'type': 'modify_port',
+            # The most recent actions are still pending:
+            'status': 'PENDING' if i >= num_actions - _PENDING else 'DONE',
+        })
+    for i in range(0, len(actions), 10000):
+        insert(model.NetworkingAction.__table__.insert(),
+               actions[i:i+10000])
+    db.session.commit()
+    return {
+        'switch_id': 1,
+        'nic_id': len(nics) // 2,
+        'node_id': num_nodes // 2,
+        'network_id': (len(nics) // 2) % 100 + 1,
+    }
+
+
+def hot_queries(ids):
+    """Return (description, query) pairs for the lookups to benchmark."""
+    action = model.NetworkingAction
+    nic = model.Nic
+    port = model.Port
+    attachment = model.NetworkAttachment
+    return [
+        ('daemon: switches with pending actions',
+         db.session.query(port.owner_id)
+         .join(nic, nic.port_id == port.id)
+         .join(action, action.nic_id == nic.id)
+         .filter(action.unclaimed())
+         .distinct()),
+        ('daemon: next pending action on a switch',
+         db.session.query(action.id)
+         .join(nic, action.nic_id == nic.id)
+         .join(port, nic.port_id == port.id)
+         .filter(port.owner_id == ids['switch_id'],
+                 action.unclaimed())
+         .order_by(action.id).limit(1)),
+        ('api: pending actions on a nic',
+         db.session.query(action.id)
+         .filter(action.nic_id == ids['nic_id'],
+                 action.status.in_(action.pending_statuses))),
+        ('api: attachment on a nic channel',
+         db.session.query(attachment.id)
+         .filter_by(nic_id=ids['nic_id'], channel='vlan/native')),
+        ('api: attachment of a network to a nic',
+         db.session.query(attachment.id)
+         .filter_by(nic_id=ids['nic_id'], network_id=ids['network_id'])),
+        ('api: nic by node and label',
+         db.session.query(nic.id)
+         .filter_by(owner_id=ids['node_id'], label='eth1')),
+        ('api: port by switch and label',
+         db.session.query(port.id)
+         .filter_by(owner_id=ids['switch_id'],
+                    label='gi1/0/%d' % (ids['nic_id'] - 1))),
+        ('api: metadata by node and label',
+         db.session.query(model.Metadata.id)
+         .filter_by(owner_id=ids['node_id'], label='rack')),
+    ]
+
+
+def explain(query):
+    """Return the database's plan for ``query``, as a list of lines.
+
+    The query's parameters are passed separately, as they are when the query
+    is run; inlining them could change the plan.
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    conn = db.session.connection()
+    if db.engine.dialect.name == 'postgresql':
+        rows = conn.execute('EXPLAIN ANALYZE ' + str(compiled), params)
+        return [row[0] for row in rows]
+    rows = conn.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return [row[-1] for row in rows]
+
+
+def timed(query, runs=20):
+    """Return the median time taken to run ``query``, in milliseconds."""
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        query.all()
+        times.append((time.time() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def main():
+    """Build the database, and print the plans."""
+    parser = argparse.ArgumentParser(
+        description="Show the query plans of HIL's hot lookups.")
+    parser.add_argument('--uri', help='database to use (default: a '
+                        'temporary sqlite file)')
+    parser.add_argument('--actions', type=int, default=100000,
+                        help='number of networking actions (default: '
+                        '%(default)s)')
+    parser.add_argument('--without-indexes', action='store_true',
+                        help='leave out the indexes and unique constraints '
+                        'for the hot lookups')
+    args = parser.parse_args()
+
+    tmp_path = None
+    uri = args.uri
+    if uri is None:
+        fd, tmp_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        uri = 'sqlite:///' + tmp_path
+    model.init_db(uri)
+    if args.without_indexes:
+        drop_new_indexes()
+
+    try:
+        with app.app_context():
+            db.create_all()
+            start = time.time()
+            ids = populate(args.actions)
+            print('Populated the database in %.1fs' % (time.time() - start))
+            db.session.execute('ANALYZE')
+            for description, query in hot_queries(ids):
+                print('\n%s (median %.3f ms):' % (description, timed(query)))
+                for line in explain(query):
+                    print('    ' + line)
+            db.session.commit()
+    finally:
+        if tmp_path is not None:
+            os.remove(tmp_path)
+
+
+if __name__ == '__main__':
+    main()
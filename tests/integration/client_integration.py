@@ -209,6 +209,19 @@ class Test_node:
                 u'name': u'free_node_0'
                 }
 
+    def test_list_node_details(self):
+        """(successful) to list_details"""
+        nodes = C.node.list_details('free')
+        assert [node['name'] for node in nodes] == [
+            u'free_node_0', u'free_node_1', u'no_nic_node'
+            ]
+        assert nodes[0] == C.node.show('free_node_0')
+        assert C.node.list_details('all', project='manhattan',
+                                   fields=['name', 'project']) == [
+            {u'name': u'manhattan_node_0', u'project': u'manhattan'},
+            {u'name': u'manhattan_node_1', u'project': u'manhattan'},
+            ]
+
     def test_show_node_reserved_chars(self):
         """ test for catching illegal argument characters"""
         with pytest.raises(BadArgumentError):
@@ -425,6 +438,11 @@ class Test_project:
         """ test for getting list of project """
         assert C.project.list() == [u'empty-project', u'manhattan', u'runway']
 
+    def test_iter_projects(self):
+        """ test for iterating over the projects a page at a time """
+        assert list(C.project.iter(page_size=2)) == [
+            u'empty-project', u'manhattan', u'runway']
+
     def test_list_nodes_inproject(self):
         """ test for getting list of nodes connected to a project. """
         assert C.project.nodes_in('manhattan') == [
@@ -522,6 +540,12 @@ class Test_switch:
         """(successful) call to list_switches"""
         assert C.switch.list() == [u'empty-switch', u'stock_switch_0']
 
+    def test_iter_switches(self):
+        """(successful) call to iter, following pages"""
+        assert list(C.switch.iter(page_size=1)) == [
+            u'empty-switch', u'stock_switch_0']
+        assert list(C.switch.iter(prefix='stock')) == [u'stock_switch_0']
+
     def test_show_switch(self):
         """(successful) call to show_switch"""
         assert C.switch.show('empty-switch') == {
@@ -989,3 +1013,50 @@ class TestShowNetworkingAction:
         """(unsuccessful) call to show_networking_action"""
         with pytest.raises(FailedAPICallException):
             C.node.show_networking_action('non-existent-entry')
+
+    def test_networking_action_batch(self):
+        """Queue a batch, and follow its status"""
+        response = C.node.networking_action_batch([
+            {'node': node, 'nic': 'nic-with-port',
+             'network': 'manhattan_provider'}
+            for node in 'manhattan_node_0', 'manhattan_node_1'
+        ])
+        assert len(response['status_ids']) == 2
+
+        batch = C.node.show_networking_action_batch(response['batch_id'])
+        assert batch['status'] == 'PENDING'
+        assert [action['node'] for action in batch['actions']] == \
+            ['manhattan_node_0', 'manhattan_node_1']
+
+        deferred.apply_networking()
+        batch = C.node.show_networking_action_batch(response['batch_id'])
+        assert batch['status'] == 'DONE'
+
+    def test_wait_for_actions(self):
+        """wait_for_actions returns the status of the actions"""
+        status_ids = [
+            C.node.connect_network(node, 'nic-with-port',
+                                   'manhattan_provider',
+                                   'vlan/native')['status_id']
+            for node in 'manhattan_node_0', 'manhattan_node_1'
+        ]
+        result = C.node.wait_for_actions(status_ids, timeout=0)
+        assert result['status'] == 'PENDING'
+        assert [action['status_id'] for action in result['actions']] == \
+            status_ids
+
+        deferred.apply_networking()
+        result = C.node.wait_for_actions(status_ids, timeout=10)
+        assert result['status'] == 'DONE'
+        assert result['counts']['DONE'] == 2
+
+        with pytest.raises(ValueError):
+            C.node.wait_for_actions()
+
+    def test_networking_action_batch_fail(self):
+        """(unsuccessful) call to networking_action_batch"""
+        with pytest.raises(FailedAPICallException):
+            C.node.networking_action_batch([
+                {'node': 'manhattan_node_0', 'nic': 'nic-with-port',
+                 'network': 'no-such-network'},
+            ])
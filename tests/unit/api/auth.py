@@ -579,6 +579,28 @@ auth_call_params += [
          project='runway',
          args=['manhattan_node_0']),
 
+    #
+    # list_node_details
+    #
+
+    # Legal Cases:
+    # Project lists the details of its own nodes.
+    dict(fn=api.list_node_details,
+         error=None,
+         admin=False,
+         project='runway',
+         args=['all'],
+         kwargs={'project': 'runway'}),
+
+    # Illegal Cases:
+    # Project lists the details of another project's nodes.
+    dict(fn=api.list_node_details,
+         error=AuthorizationError,
+         admin=False,
+         project='runway',
+         args=['all'],
+         kwargs={'project': 'manhattan'}),
+
     #
     # project_connect_node:
     #
@@ -603,6 +625,24 @@ def test_auth_call(kwargs):
     return auth_call_test(**kwargs)
 
 
+def test_list_node_details_filters_projects():
+    """list_node_details leaves out nodes the caller can't see, and the
+    port and switch of each nic if the caller isn't an admin."""
+    auth_backend = get_auth_backend()
+    auth_backend.set_admin(False)
+    auth_backend.set_project(model.Project.query
+                             .filter_by(label='runway').one())
+    nodes = json.loads(api.list_node_details('all'))
+    assert [node['name'] for node in nodes] == [
+        'free_node_0', 'free_node_1', 'no_nic_node',
+        'runway_node_0', 'runway_node_1',
+    ]
+    for node in nodes:
+        for nic in node['nics']:
+            assert 'port' not in nic
+            assert 'switch' not in nic
+
+
 def _with_enabled_obm(api_call, node):
     """Return a wrapper around an API call that spoofs enabling a node's obm.
 
@@ -645,6 +685,7 @@ admin_calls = [
      ['free_node_0'], {}),
     (_with_enabled_obm(api.node_set_bootdev, 'free_node_0'),
      ['free_node_0'], {'bootdev': {'none'}}),
+    (api.node_power_batch, [], {'op': 'status', 'nodes': ['free_node_0']}),
 
     (api.project_delete, ['empty-project'], {}),
 
@@ -664,6 +705,16 @@ admin_calls = [
     (api.node_delete_metadata, ['runway_node_0', 'EK'], {}),
     (api.port_revert, ['stock_switch_0', 'free_node_0_port'], {}),
     (api.list_active_extensions, [], {}),
+    (api.show_metrics, [], {}),
+    (api.layout_import, [], {
+        'nodes': [{
+            'name': 'new_node',
+            'obmd': {
+                'uri': 'http://obmd.example.com/node/new_node',
+                'admin_token': 'secret',
+            },
+        }],
+    }),
 ]
 
 
@@ -679,6 +730,8 @@ project_calls = [
      ['runway_node_0'], {}),
     (_with_enabled_obm(api.node_set_bootdev, 'runway_node_0'),
      ['runway_node_0'], {'bootdev': {'none'}}),
+    (api.node_power_batch, [], {'op': 'status', 'nodes': ['runway_node_0']}),
+    (api.node_power_batch, [], {'op': 'status', 'project': 'runway'}),
 
     (api.project_connect_node, ['runway', 'free_node_0'], {}),
     (api.project_detach_node, ['runway', 'runway_node_0'], {}),
@@ -838,3 +891,52 @@ class Test_show_networking_action(unittest.TestCase):
                             'type': 'modify_port',
                             'channel': 'null',
                             'new_network': 'stock_int_pub'}
+
+
+class Test_networking_action_batch(unittest.TestCase):
+    """Test authorization properties of networking_action_batch and
+    show_networking_action_batch."""
+
+    def setUp(self):
+        """Common setup for the tests."""
+        self.auth_backend = get_auth_backend()
+        self.runway = model.Project.query.filter_by(label='runway').one()
+        self.manhattan = model.Project.query.filter_by(label='manhattan').one()
+
+    @staticmethod
+    def _batch(*nodes):
+        """Queue a batch connecting each of ``nodes`` to stock_int_pub."""
+        return api.networking_action_batch([
+            {'node': node, 'nic': 'nic-with-port', 'network': 'stock_int_pub'}
+            for node in nodes
+        ])
+
+    def test_success(self):
+        """Project 'manhattan' can queue actions on its own nodes, and see
+        their status."""
+        self.auth_backend.set_project(self.manhattan)
+        response = self._batch('manhattan_node_0', 'manhattan_node_1')
+        batch_id = json.loads(response[0])['batch_id']
+        status = json.loads(api.show_networking_action_batch(batch_id))
+        assert status['counts']['PENDING'] == 2
+
+        status_ids = ','.join(json.loads(response[0])['status_ids'])
+
+        self.auth_backend.set_project(self.runway)
+        with pytest.raises(AuthorizationError):
+            api.show_networking_action_batch(batch_id)
+        with pytest.raises(AuthorizationError):
+            api.show_networking_actions(status_ids)
+
+    def test_wrong_project(self):
+        """A batch including another project's node is rejected."""
+        self.auth_backend.set_project(self.manhattan)
+        with pytest.raises(AuthorizationError):
+            self._batch('manhattan_node_0', 'runway_node_0')
+        assert model.NetworkingAction.query.count() == 0
+
+    def test_node_not_in_project(self):
+        """Free nodes can't be connected, even by an admin."""
+        self.auth_backend.set_admin(True)
+        with pytest.raises(BadArgumentError):
+            self._batch('free_node_0')
@@ -44,7 +44,8 @@ General advice on working with this module:
 from hil import model, deferred, errors, config, api
 from hil.test_common import config_testsuite, config_merge, fresh_database, \
     fail_on_log_warnings, additional_db, with_request_context, \
-    network_create_simple, server_init, uuid_pattern, spoof_enable_obm
+    network_create_simple, server_init, uuid_pattern, spoof_enable_obm, \
+    QueryCounter
 from hil.network_allocator import get_network_allocator
 from hil.auth import get_auth_backend
 import pytest
@@ -1615,6 +1616,109 @@ class Test_list_show_switch:
         }
 
 
+def test_show_switch_snapshot(switchinit, monkeypatch):
+    """show_switch_snapshot reports what the switch says, not the db."""
+    from hil.ext.switches.mock import LOCAL_STATE
+    api.switch_register_port('sw0', PORTS[1])
+    monkeypatch.setitem(LOCAL_STATE, 'sw0', {
+        PORTS[1]: {},
+        PORTS[2]: {'vlan/native': 102, 'vlan/103': 103},
+    })
+    assert json.loads(api.show_switch_snapshot('sw0')) == {
+        PORTS[1]: {},
+        PORTS[2]: {'vlan/native': '102', 'vlan/103': '103'},
+    }
+    with pytest.raises(errors.NotFoundError):
+        api.show_switch_snapshot('nosuchswitch')
+
+
+class TestQueryCounts:
+    """The read-only calls should use a fixed number of queries, no matter
+    how many nics/attachments are involved."""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, configure, fresh_database, server_init,
+              with_request_context, set_admin_auth):
+        """Create a switch and a project, for the nodes to use."""
+        # pylint: disable=unused-argument,redefined-outer-name
+        api.switch_register('sw0',
+                            type=MOCK_SWITCH_TYPE,
+                            username="switch_user",
+                            password="switch_pass",
+                            hostname="switchname")
+        api.project_create('anvil-nextgen')
+        self.ports = 0
+
+    def _node(self, name, networks):
+        """Create a node with one nic (on its own port) per network, and
+        attach each nic to its network.
+
+        Each item of ``networks`` may be a single network, or a list of them
+        to attach to the nic on different channels.
+        """
+        new_node(name)
+        api.project_connect_node('anvil-nextgen', name)
+        for i, nets in enumerate(networks):
+            if not isinstance(nets, list):
+                nets = [nets]
+            nic = 'eth%d' % i
+            port = 'gi1/0/%d' % self.ports
+            self.ports += 1
+            api.switch_register_port('sw0', port)
+            api.node_register_nic(name, nic, 'DE:AD:BE:EF:20:%02d' % i)
+            api.port_connect_nic('sw0', port, name, nic)
+            for j, net in enumerate(nets):
+                if net not in json.loads(api.list_networks()):
+                    network_create_simple(net, 'anvil-nextgen')
+                if j == 0:
+                    channel = get_network_allocator().get_default_channel()
+                else:
+                    channel = json.loads(api.show_network(net))['channels'][1]
+                api.node_connect_network(name, nic, net, channel)
+                deferred.apply_networking()
+
+    @staticmethod
+    def _count(call, *args):
+        """Return the number of queries ``call(*args)`` runs, starting from
+        an empty session."""
+        model.db.session.expunge_all()
+        with QueryCounter() as counter:
+            call(*args)
+        return counter.count
+
+    def test_show_node(self):
+        """show_node doesn't depend on the number of nics or networks."""
+        self._node('small', ['net-0'])
+        self._node('big', ['net-1', 'net-2', ['net-3', 'net-4'], 'net-5'])
+        api.node_set_metadata('big', 'EK', 'pk')
+        assert self._count(api.show_node, 'small') == \
+            self._count(api.show_node, 'big')
+
+    def test_network_attachments(self):
+        """show_network and list_network_attachments don't depend on the
+        number of attachments."""
+        self._node('node-0', ['small'])
+        for i in range(1, 5):
+            self._node('node-%d' % i, ['big'])
+        for call in api.show_network, api.list_network_attachments:
+            assert self._count(call, 'small') == self._count(call, 'big')
+
+    def test_list_node_details(self):
+        """list_node_details doesn't depend on the number of nodes."""
+        self._node('node-0', ['net-0'])
+        small = self._count(api.list_node_details, 'all')
+        for i in range(1, 5):
+            self._node('node-%d' % i, ['net-%d' % i, 'net-0'])
+        assert self._count(api.list_node_details, 'all') == small
+
+    def test_show_port(self):
+        """show_port doesn't depend on the number of networks."""
+        self._node('small', ['net-0'])
+        self._node('big', [['net-1', 'net-2', 'net-3']])
+        assert self._count(api.show_port, 'sw0', 'gi1/0/0') == \
+            self._count(api.show_port, 'sw0', 'gi1/0/1')
+
+
 class Test_show_port:
     """Test show_port"""
 
@@ -2073,6 +2177,44 @@ class TestQuery_unpopulated_db:
         with pytest.raises(errors.NotFoundError):
             api.show_node('master-control-program')
 
+    def test_list_node_details(self):
+        """list_node_details returns the same thing as show_node, for each
+        of the nodes."""
+        new_node('robocop')
+        new_node('data')
+        new_node('master-control-program')
+        api.node_register_nic('robocop', 'eth0', 'DE:AD:BE:EF:20:14')
+        api.node_set_metadata('robocop', 'EK', 'pk')
+        api.project_create('anvil-nextgen')
+        api.project_connect_node('anvil-nextgen', 'robocop')
+        api.project_connect_node('anvil-nextgen', 'data')
+
+        nodes = json.loads(api.list_node_details('all'))
+        assert [node['name'] for node in nodes] == [
+            'data', 'master-control-program', 'robocop',
+        ]
+        for node in nodes:
+            assert node == json.loads(api.show_node(node['name']))
+
+        assert json.loads(api.list_node_details('free')) == \
+            [json.loads(api.show_node('master-control-program'))]
+        assert json.loads(api.list_node_details('all',
+                                                project='anvil-nextgen',
+                                                fields='name,metadata')) == [
+            {'name': 'data', 'metadata': {}},
+            {'name': 'robocop', 'metadata': {'EK': json.dumps('pk')}},
+        ]
+
+    def test_list_node_details_bad_field(self):
+        """Asking list_node_details for an unknown field is an error."""
+        with pytest.raises(errors.BadArgumentError):
+            api.list_node_details('all', fields='name,obmd')
+
+    def test_list_node_details_nonexistent_project(self):
+        """Filtering by a project that does not exist raises not found."""
+        with pytest.raises(errors.NotFoundError):
+            api.list_node_details('all', project='anvil-nextgen')
+
     def test_project_nodes_exist(self):
         """Test list_project_nodes given a project that has nodes."""
         new_node('master-control-program')
@@ -2194,6 +2336,93 @@ class TestQuery_unpopulated_db:
         assert result == ['base-headnode', 'img1', 'img2', 'img3', 'img4']
 
 
+class TestListPagination:
+    """Test the pagination, filtering and streaming of the list calls."""
+
+    def test_pages(self):
+        """Following ``after`` through the pages gets every node once."""
+        names = ['node-%02d' % i for i in range(7)]
+        for name in reversed(names):
+            new_node(name)
+        pages = []
+        after = None
+        while True:
+            page = json.loads(api.list_nodes('all', limit=3, after=after))
+            pages.append(page)
+            if len(page) < 3:
+                break
+            after = page[-1]
+        assert pages == [names[:3], names[3:6], names[6:]]
+
+    def test_prefix(self):
+        """``prefix`` selects labels by prefix, treating wildcards
+        literally."""
+        for name in 'sw-a', 'sw-b', 'sw_c', 'swdd', 'other':
+            api.switch_register(name,
+                                type=MOCK_SWITCH_TYPE,
+                                username="switch_user",
+                                password="switch_pass",
+                                hostname="switchname")
+        assert json.loads(api.list_switches(prefix='sw-')) == ['sw-a', 'sw-b']
+        assert json.loads(api.list_switches(prefix='sw_')) == ['sw_c']
+        assert json.loads(api.list_switches(prefix='sw', after='sw-b',
+                                            limit=1)) == ['sw_c']
+
+    def test_keyed_pages(self):
+        """Calls which return objects are paginated by key."""
+        api.project_create('anvil-nextgen')
+        for i in range(5):
+            network_create_simple('net-%d' % i, 'anvil-nextgen')
+        page = json.loads(api.list_networks(limit=2, after='net-1'))
+        assert sorted(page.keys()) == ['net-2', 'net-3']
+        assert page['net-2']['projects'] == ['anvil-nextgen']
+
+    def test_stream(self):
+        """The streamed responses are the same as the regular ones."""
+        api.project_create('anvil-nextgen')
+        for i in range(5):
+            api.project_create('project-%d' % i)
+            network_create_simple('net-%d' % i, 'anvil-nextgen')
+        for call, kwargs in [(api.list_projects, {}),
+                             (api.list_projects, {'limit': 3}),
+                             (api.list_networks, {}),
+                             (api.list_networks, {'after': 'net-2'})]:
+            response = call(stream=True, **kwargs)
+            assert response.mimetype == 'application/json'
+            assert json.loads(response.get_data()) == \
+                json.loads(call(**kwargs))
+
+    def test_stream_chunks(self, monkeypatch):
+        """Streamed responses are fetched in chunks."""
+        monkeypatch.setattr(api, '_STREAM_CHUNK_SIZE', 2)
+        names = ['node-%d' % i for i in range(5)]
+        for name in names:
+            new_node(name)
+        response = api.list_nodes('all', stream=True)
+        assert json.loads(response.get_data()) == names
+        response = api.list_nodes('all', stream=True, limit=3)
+        assert json.loads(response.get_data()) == names[:3]
+
+    @pytest.mark.parametrize('query,status,expected', [
+        ('', 200, ['node-0', 'node-1', 'node-2', 'node-3']),
+        ('?limit=2&after=node-0&prefix=node-&stream=true', 200,
+         ['node-1', 'node-2']),
+        ('?limit=0', 400, None),
+        ('?limit=ten', 400, None),
+        ('?stream=yes', 400, None),
+    ])
+    def test_query_params(self, query, status, expected):
+        """The query parameters are validated by the schema."""
+        from hil.rest import app
+        for name in 'node-0', 'node-1', 'node-2', 'node-3':
+            new_node(name)
+        model.db.session.commit()
+        response = app.test_client().get('/v0/nodes/all' + query)
+        assert response.status_code == status
+        if expected is not None:
+            assert json.loads(response.get_data()) == expected
+
+
 class TestShowNetwork:
     """Test the show_network api cal."""
 
@@ -2504,3 +2733,326 @@ class TestShowNetworkingAction(unittest.TestCase):
         status_id = '96c888a9-3257-491b-bca9-06be26b15525'
         with pytest.raises(errors.NotFoundError):
             api.show_networking_action(status_id)
+
+
+class NetworkingActionBatchTest:
+    """Superclass for the tests of batches of networking actions.
+
+    pytest ignores this class itself, since its name doesn't start with
+    ``Test``.
+    """
+
+    @pytest.fixture(autouse=True)
+    def setup(self, configure, fresh_database, server_init,
+              with_request_context, set_admin_auth):
+        """Create four nodes in a project, each with a nic on its own port,
+        and two networks for them."""
+        # pylint: disable=unused-argument,redefined-outer-name
+        api.switch_register('sw0',
+                            type=MOCK_SWITCH_TYPE,
+                            username="switch_user",
+                            password="switch_pass",
+                            hostname="switchname")
+        api.project_create('anvil-nextgen')
+        network_create_simple('hammernet', 'anvil-nextgen')
+        network_create_simple('pineapple', 'anvil-nextgen')
+        for i in range(4):
+            node = 'node-%d' % i
+            new_node(node)
+            api.project_connect_node('anvil-nextgen', node)
+            api.node_register_nic(node, 'eth0', 'DE:AD:BE:EF:20:%02d' % i)
+            api.switch_register_port('sw0', PORTS[i])
+            api.port_connect_nic('sw0', PORTS[i], node, 'eth0')
+
+    @staticmethod
+    def _connect_all(network, nodes=4):
+        """Connect the first ``nodes`` nodes to ``network`` in one batch."""
+        return api.networking_action_batch([
+            {'node': 'node-%d' % i, 'nic': 'eth0', 'network': network}
+            for i in range(nodes)
+        ])
+
+
+class TestNetworkingActionBatch(NetworkingActionBatchTest):
+    """Test networking_action_batch and show_networking_action_batch."""
+
+    def test_batch(self):
+        """The actions are queued, and the batch's status follows them."""
+        response, status = self._connect_all('hammernet')
+        assert status == 202
+        response = json.loads(response)
+        assert uuid_pattern.match(response['batch_id'])
+        assert len(response['status_ids']) == 4
+        batch = json.loads(
+            api.show_networking_action_batch(response['batch_id']))
+        assert batch['status'] == 'PENDING'
+        assert batch['counts'] == {'PENDING': 4, 'DONE': 0, 'ERROR': 0}
+        assert [action['status_id'] for action in batch['actions']] == \
+            response['status_ids']
+        assert batch['actions'][0] == {
+            'status_id': response['status_ids'][0],
+            'status': 'PENDING',
+            'node': 'node-0',
+            'nic': 'eth0',
+            'type': 'modify_port',
+            'channel': 'vlan/native',
+            'new_network': 'hammernet',
+        }
+
+        deferred.apply_networking(batch_size=10)
+        batch = json.loads(
+            api.show_networking_action_batch(response['batch_id']))
+        assert batch['status'] == 'DONE'
+        assert batch['counts'] == {'PENDING': 0, 'DONE': 4, 'ERROR': 0}
+        assert model.NetworkAttachment.query.count() == 4
+
+        # Detach some, and move others to another channel:
+        response = json.loads(api.networking_action_batch([
+            {'op': 'detach', 'node': 'node-0', 'nic': 'eth0',
+             'network': 'hammernet'},
+            {'node': 'node-1', 'nic': 'eth0', 'network': 'pineapple',
+             'channel': json.loads(api.show_network('pineapple'))
+             ['channels'][1]},
+        ])[0])
+        deferred.apply_networking()
+        batch = json.loads(
+            api.show_networking_action_batch(response['batch_id']))
+        assert batch['status'] == 'DONE'
+        assert model.NetworkAttachment.query.count() == 4
+        node_0 = json.loads(api.show_node('node-0'))
+        assert node_0['nics'][0]['networks'] == {}
+
+    def test_batch_error_status(self):
+        """A batch with a failed action is reported as failed."""
+        batch_id = json.loads(self._connect_all('hammernet')[0])['batch_id']
+        deferred.apply_networking()
+        action = model.NetworkingAction.query.filter_by(batch_id=batch_id) \
+            .first()
+        action.status = 'ERROR'
+        model.db.session.commit()
+        batch = json.loads(api.show_networking_action_batch(batch_id))
+        assert batch['status'] == 'ERROR'
+        assert batch['counts'] == {'PENDING': 0, 'DONE': 3, 'ERROR': 1}
+
+    def test_batch_problems(self):
+        """Every problem is reported, and nothing is queued."""
+        self._connect_all('hammernet', nodes=1)
+        deferred.apply_networking()
+        api.node_connect_network('node-1', 'eth0', 'hammernet')
+        before = model.NetworkingAction.query.count()
+
+        with pytest.raises(errors.NetworkingBatchError) as excinfo:
+            api.networking_action_batch([
+                {'node': 'node-0', 'nic': 'eth0', 'network': 'hammernet'},
+                {'node': 'node-1', 'nic': 'eth0', 'network': 'pineapple'},
+                {'node': 'node-2', 'nic': 'eth0', 'network': 'pineapple'},
+                {'node': 'node-2', 'nic': 'eth0', 'network': 'hammernet'},
+                {'node': 'node-3', 'nic': 'eth1', 'network': 'hammernet'},
+                {'node': 'node-9', 'nic': 'eth0', 'network': 'hammernet'},
+                {'node': 'node-3', 'nic': 'eth0', 'network': 'nonet'},
+                {'op': 'detach', 'node': 'node-3', 'nic': 'eth0',
+                 'network': 'hammernet'},
+            ])
+        assert excinfo.value.problems == [
+            'actions[0] (node-0 eth0): The network is already attached to '
+            'the nic.',
+            'actions[1] (node-1 eth0): A networking operation is already '
+            'active on the nic.',
+            'actions[3] (node-2 eth0): The channel is already in use on the '
+            'nic.',
+            'actions[4] (node-3 eth1): nic does not exist',
+            'actions[5] (node-9 eth0): node does not exist',
+            'actions[6] (node-3 eth0): network nonet does not exist',
+            'actions[7] (node-3 eth0): The network is not attached to the '
+            'nic.',
+        ]
+        assert model.NetworkingAction.query.count() == before
+
+    def test_batch_empty(self):
+        """An empty batch is rejected, rather than given a batch id."""
+        with pytest.raises(errors.BadArgumentError):
+            api.networking_action_batch([])
+        assert model.NetworkingAction.query.count() == 0
+
+    def test_batch_several_per_nic(self, monkeypatch):
+        """Several actions on one nic are checked and applied in order."""
+        from hil.ext.switches.common import check_native_networks
+        from hil.ext.switches.mock import MockSwitch
+        monkeypatch.setattr(
+            MockSwitch, 'ensure_legal_operation',
+            lambda self, nic, op_type, channel:
+            check_native_networks(nic, op_type, channel))
+        pineapple_trunk = \
+            json.loads(api.show_network('pineapple'))['channels'][1]
+        response = json.loads(api.networking_action_batch([
+            {'node': 'node-0', 'nic': 'eth0', 'network': 'hammernet'},
+            {'node': 'node-0', 'nic': 'eth0', 'network': 'pineapple',
+             'channel': pineapple_trunk},
+            {'node': 'node-1', 'nic': 'eth0', 'network': 'hammernet'},
+        ])[0])
+        actions = model.NetworkingAction.query \
+            .order_by(model.NetworkingAction.id).all()
+        assert [action.uuid for action in actions] == response['status_ids']
+
+        # Another batch can't queue more actions on the nic until these have
+        # been applied:
+        with pytest.raises(errors.NetworkingBatchError) as excinfo:
+            api.networking_action_batch([
+                {'op': 'detach', 'node': 'node-0', 'nic': 'eth0',
+                 'network': 'pineapple'},
+            ])
+        assert excinfo.value.problems == [
+            'actions[0] (node-0 eth0): A networking operation is already '
+            'active on the nic.',
+        ]
+
+        deferred.apply_networking(batch_size=10)
+        node_0 = json.loads(api.show_node('node-0'))
+        assert node_0['nics'][0]['networks'] == {
+            'vlan/native': 'hammernet',
+            pineapple_trunk: 'pineapple',
+        }
+
+        # Within a batch, each action sees the effect of the ones before it:
+        api.networking_action_batch([
+            {'op': 'detach', 'node': 'node-0', 'nic': 'eth0',
+             'network': 'pineapple'},
+            {'op': 'detach', 'node': 'node-0', 'nic': 'eth0',
+             'network': 'hammernet'},
+            {'node': 'node-0', 'nic': 'eth0', 'network': 'pineapple'},
+        ])
+        deferred.apply_networking(batch_size=10)
+        node_0 = json.loads(api.show_node('node-0'))
+        assert node_0['nics'][0]['networks'] == {'vlan/native': 'pineapple'}
+
+        # ...including the switch's checks, which are made against the
+        # nic's attachments:
+        with pytest.raises(errors.NetworkingBatchError) as excinfo:
+            api.networking_action_batch([
+                {'op': 'detach', 'node': 'node-0', 'nic': 'eth0',
+                 'network': 'pineapple'},
+                {'node': 'node-0', 'nic': 'eth0', 'network': 'hammernet',
+                 'channel': json.loads(api.show_network('hammernet'))
+                 ['channels'][1]},
+            ])
+        assert excinfo.value.problems == [
+            'actions[1] (node-0 eth0): Please attach a native network first',
+        ]
+
+    def test_batch_coalesced(self, monkeypatch):
+        """The network daemon hands a nic's actions to the switch at once."""
+        from hil.ext.switches.mock import MockSwitch
+        batches = []
+
+        def apply_port_batch(self, port, changes):
+            """Record the batch, then apply it as usual."""
+            batches.append((port, changes))
+            for channel, new_network in changes:
+                self.modify_port(port, channel, new_network)
+
+        monkeypatch.setattr(MockSwitch, 'apply_port_batch', apply_port_batch)
+
+        pineapple_trunk = \
+            json.loads(api.show_network('pineapple'))['channels'][1]
+        api.networking_action_batch([
+            {'node': 'node-0', 'nic': 'eth0', 'network': 'hammernet'},
+            {'node': 'node-0', 'nic': 'eth0', 'network': 'pineapple',
+             'channel': pineapple_trunk},
+            {'node': 'node-1', 'nic': 'eth0', 'network': 'hammernet'},
+        ])
+        deferred.apply_networking(batch_size=10)
+
+        hammernet = model.Network.query.filter_by(label='hammernet').one()
+        pineapple = model.Network.query.filter_by(label='pineapple').one()
+        assert batches == [(PORTS[0], [
+            ('vlan/native', hammernet.network_id),
+            (pineapple_trunk, pineapple.network_id),
+        ])]
+        assert model.NetworkAttachment.query.count() == 3
+
+    def test_show_batch_nonexistent(self):
+        """Asking about a batch that doesn't exist fails."""
+        with pytest.raises(errors.NotFoundError):
+            api.show_networking_action_batch(str(uuid.uuid4()))
+
+    def test_query_count(self):
+        """Checking the batch doesn't take queries per action."""
+        model.db.session.expunge_all()
+        with QueryCounter() as small:
+            self._connect_all('hammernet', nodes=2)
+        model.NetworkingAction.query.delete()
+        model.db.session.commit()
+        model.db.session.expunge_all()
+        with QueryCounter() as big:
+            self._connect_all('hammernet', nodes=4)
+        # At most, one INSERT per extra action:
+        assert big.count - small.count <= 2
+
+
+class TestShowNetworkingActions(NetworkingActionBatchTest):
+    """Test show_networking_actions, and waiting for actions to finish."""
+
+    def test_show_networking_actions(self):
+        """Actions are reported in the order asked for; unknown ids are
+        left out."""
+        response = json.loads(self._connect_all('hammernet')[0])
+        status_ids = list(reversed(response['status_ids']))
+        response = json.loads(api.show_networking_actions(
+            ','.join(status_ids[:3] + ['no-such-action'])))
+        assert response['status'] == 'PENDING'
+        assert response['counts'] == {'PENDING': 3, 'DONE': 0, 'ERROR': 0}
+        assert [action['node'] for action in response['actions']] == \
+            ['node-3', 'node-2', 'node-1']
+
+        with pytest.raises(errors.NotFoundError):
+            api.show_networking_actions('no-such-action')
+
+    def test_wait(self, monkeypatch):
+        """With ``wait``, the call returns once the actions are done."""
+        response = json.loads(self._connect_all('hammernet')[0])
+        sleeps = []
+
+        def sleep(seconds):
+            """Let the network daemon run, instead of sleeping."""
+            sleeps.append(seconds)
+            deferred.apply_networking()
+        monkeypatch.setattr(api.time, 'sleep', sleep)
+
+        batch = json.loads(api.show_networking_action_batch(
+            response['batch_id'], wait=10))
+        assert batch['status'] == 'DONE'
+        assert sleeps == [0.5]
+
+        # Nothing is pending, so this doesn't wait at all:
+        status = json.loads(api.show_networking_actions(
+            ','.join(response['status_ids']), wait=10))
+        assert status['counts']['DONE'] == 4
+        assert sleeps == [0.5]
+
+    def test_wait_timeout(self, monkeypatch):
+        """The call gives up after ``wait`` seconds, capped by the
+        networking_action_max_wait option."""
+        config_merge({
+            'general': {
+                'networking_action_max_wait': '2',
+                'networking_action_poll_interval': '0.75',
+            },
+        })
+        response = json.loads(self._connect_all('hammernet')[0])
+        clock = [1000.0]
+
+        def sleep(seconds):
+            """Advance a fake clock."""
+            clock[0] += seconds
+        monkeypatch.setattr(api.time, 'sleep', sleep)
+        monkeypatch.setattr(api.time, 'time', lambda: clock[0])
+
+        batch = json.loads(api.show_networking_action_batch(
+            response['batch_id'], wait=1))
+        assert batch['status'] == 'PENDING'
+        assert clock[0] == 1001.0
+
+        batch = json.loads(api.show_networking_action_batch(
+            response['batch_id'], wait=3600))
+        assert batch['status'] == 'PENDING'
+        assert clock[0] == 1003.0
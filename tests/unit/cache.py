@@ -0,0 +1,108 @@
+"""Unit tests for hil/cache.py"""
+
+from hil.cache import TTLCache, MemcacheStore
+
+
+class FakeClock(object):
+    """A clock which only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_expiry():
+    """Entries can be read until their time is up."""
+    clock = FakeClock()
+    cache = TTLCache(ttl=10, max_size=5, clock=clock)
+    cache.put('a', 1)
+    clock.now += 9
+    assert cache.get('a') == 1
+    clock.now += 1
+    assert cache.get('a') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(cache) == 0
+
+
+def test_eviction():
+    """The least recently used entries are evicted first."""
+    cache = TTLCache(ttl=10, max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+
+
+def test_invalidate_and_clear():
+    """Entries can be removed individually or all at once."""
+    cache = TTLCache(ttl=10, max_size=5)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.invalidate('a')
+    cache.invalidate('nothing')
+    assert cache.get('a', 'missing') == 'missing'
+    assert cache.get('b') == 2
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_disabled():
+    """A cache with no ttl stores nothing."""
+    cache = TTLCache(ttl=0, max_size=5)
+    assert not cache.enabled
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+
+class FakeMemcache(object):
+    """A stand-in for a memcached client.
+
+    Like memcached, it only accepts short keys without spaces.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.entries = {}
+
+    def get(self, key):
+        """Return the value for ``key``, or None if it's missing/expired."""
+        assert len(key) <= 250 and ' ' not in key
+        value, expiry = self.entries.get(key, (None, 0))
+        if expiry <= self.clock():
+            return None
+        return value
+
+    def set(self, key, value, time=0):
+        """Store ``value`` under ``key`` for ``time`` seconds."""
+        assert time > 0
+        self.entries[key] = (value, self.clock() + time)
+
+    def delete(self, key):
+        """Remove ``key``."""
+        self.entries.pop(key, None)
+
+
+def test_memcache_store():
+    """MemcacheStore behaves like TTLCache, on top of memcached."""
+    clock = FakeClock()
+    client = FakeMemcache(clock)
+    cache = MemcacheStore(client, ttl=0.5, prefix='test:')
+    other = MemcacheStore(client, ttl=10, prefix='other:')
+    key = ('a key with spaces', 'x' * 300)
+    cache.put(key, {'some': 'value'})
+    assert cache.get(key) == {'some': 'value'}
+    assert other.get(key) is None
+    clock.now += 1
+    assert cache.get(key, 'missing') == 'missing'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    cache.put(key, 1)
+    cache.invalidate(key)
+    assert cache.get(key) is None
+    assert not MemcacheStore(client, ttl=0, prefix='test:').enabled
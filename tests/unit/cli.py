@@ -91,9 +91,18 @@ def test_serve_networks():
     assert runs_for_seconds(['hil-admin', 'serve-networks'], seconds=1)
 
 
+def test_journal_compact():
+    """Check that hil-admin journal compact reports what it did."""
+    check_call(['hil-admin', 'db', 'create'])
+    output = check_output(['hil-admin', 'journal', 'compact',
+                           '--max-age', '60'])
+    assert output == 'Archived 0 networking actions\n'
+
+
 @pytest.mark.parametrize('command', [
     ['hil-admin', 'run-dev-server', '--port', '5000'],
     ['hil-admin', 'serve-networks'],
+    ['hil-admin', 'journal', 'compact'],
 ])
 def test_db_init_error(command):
     """Test that a command fails if the database has not been created."""
@@ -35,6 +35,8 @@ def test_validate_config():
     config_merge({
         'general': {
             'log_level': 'debug',
+            'networking_action_max_wait': '30',
+            'networking_action_poll_interval': '0.25',
         },
         'auth': {
             'require_authentication': 'True',
@@ -88,6 +90,8 @@ def test_validate_config():
             'project_name': 'project',
             'admin_user': 'admin',
             'admin_password': 's3cr3t',
+            'identity_cache_ttl': '30',
+            'project_cache_ttl': '0',
         }
     })
     config.load_extensions()
@@ -185,3 +189,73 @@ def test_bad_vlans():
     "Test strings for invalid VLAN ranges."""
     opts = ['12-', 'p13,q14,15,16,17,18,1234x', '1-900, 902-904, 905, 5000']
     assert all(not config.string_has_vlans(s) for s in opts)
+
+
+def test_good_positive_numbers():
+    """Test strings for valid positive numbers."""
+    opts = ['1', '0.25', '30', '1e-3']
+    assert all(config.string_is_positive_number(s) for s in opts)
+
+
+def test_bad_positive_numbers():
+    """Test strings for invalid positive numbers."""
+    opts = ['0', '0.0', '-1', 'nan', '', 'fast']
+    assert all(not config.string_is_positive_number(s) for s in opts)
+
+
+def _check_validation(config_dict, valid):
+    """Check whether the test suite's config, with the sections needed to
+    pass validation and ``config_dict`` merged in, is ``valid``.
+    """
+    config_testsuite()
+    config_merge({
+        'headnode': {
+            'trunk_nic': 'eth0',
+            'libvirt_endpoint': 'qemu:///system',
+        },
+        'client': {
+            'endpoint': 'http://127.0.0.1:5000',
+        },
+    })
+    config_merge(config_dict)
+    config.load_extensions()
+    if valid:
+        config.validate_config()
+    else:
+        with pytest.raises(SchemaError):
+            config.validate_config()
+
+
+@pytest.mark.parametrize('interval, valid', [
+    ('0.25', True),
+    ('0', False),
+    ('-0.5', False),
+])
+def test_validate_poll_interval(interval, valid):
+    """The networking action poll interval must be positive."""
+    _check_validation({
+        'general': {
+            'log_level': 'debug',
+            'networking_action_poll_interval': interval,
+        },
+    }, valid)
+
+
+@pytest.mark.parametrize('driver', ['brocade', 'dellnos9'])
+@pytest.mark.parametrize('option, value, valid', [
+    ('http_retries', '3', True),
+    ('http_retries', '2.7', False),
+    ('http_timeout', '2.5', True),
+    ('http_timeout', '0', False),
+])
+def test_validate_http_options(driver, option, value, valid):
+    """The REST switch drivers' retries are whole, and timeouts positive."""
+    module = 'hil.ext.switches.' + driver
+    _check_validation({
+        'extensions': {
+            module: '',
+        },
+        module: {
+            option: value,
+        },
+    }, valid)
@@ -1,12 +1,16 @@
 '''Functional test for deferred.py'''
 
+from datetime import datetime, timedelta
+import importlib
+import json
 import pytest
 import tempfile
+import threading
 import uuid
 
 from hil import config, deferred, model, api
 from hil.model import db, Switch
-from hil.errors import SwitchError
+from hil.errors import SwitchError, BlockedError
 from hil.test_common import config_testsuite, config_merge, \
                              fresh_database
 from flask import Flask
@@ -223,7 +227,7 @@ def test_apply_networking(switch, network, fresh_database):
     # is of type revert port.
     unique_id = str(uuid.uuid4())
     nic.append(new_nic('2'))
-    nic[2].port = model.Port(label=interface, switch=switch)
+    nic[2].port = model.Port(label='gi1/0/2', switch=switch)
     actions.append(model.NetworkingAction(nic=nic[2],
                                           new_network=None,
                                           uuid=unique_id,
@@ -298,3 +302,577 @@ def test_apply_networking(switch, network, fresh_database):
 
     local_db.session.commit()
     local_db.session.close()
+
+
+@pytest.fixture()
+def mock_switch_ext():
+    """Load the mock switch driver.
+
+    This must run before ``fresh_database``, so that the driver's tables are
+    created.
+    """
+    importlib.import_module('hil.ext.switches.mock')
+
+
+def test_apply_networking_parallel(mock_switch_ext, network, fresh_database,
+                                   monkeypatch):
+    """Check that apply_networking works on separate switches concurrently.
+
+    Each switch's first modify_port call blocks until the other switch has
+    also started; this would time out if the switches were serviced one after
+    the other. We also check that the actions on each switch are applied in
+    the order they were queued.
+    """
+    from hil.ext.switches.mock import MockSwitch, LOCAL_STATE
+
+    labels = ['sw0-' + str(uuid.uuid4()), 'sw1-' + str(uuid.uuid4())]
+    started = dict((label, threading.Event()) for label in labels)
+    applied = dict((label, []) for label in labels)
+    overlapped = []
+
+    def modify_port(self, port, channel, new_network):
+        """Record the call, and wait for the other switch to start."""
+        if not applied[self.label]:
+            started[self.label].set()
+            other = [label for label in labels if label != self.label][0]
+            overlapped.append(started[other].wait(10))
+        applied[self.label].append(port)
+        LOCAL_STATE[self.label][port][channel] = new_network
+
+    monkeypatch.setattr(MockSwitch, 'modify_port', modify_port)
+
+    expected = dict((label, []) for label in labels)
+    for label in labels:
+        switch = MockSwitch(label=label,
+                            hostname='http://example.com',
+                            username='admin',
+                            password='admin')
+        for i in range(3):
+            interface = 'gi1/0/%d' % i
+            nic = new_nic(str(i))
+            nic.port = model.Port(label=interface, switch=switch)
+            db.session.add(model.NetworkingAction(nic=nic,
+                                                  new_network=network,
+                                                  channel='vlan/native',
+                                                  type='modify_port',
+                                                  uuid=str(uuid.uuid4()),
+                                                  status='PENDING'))
+            expected[label].append(interface)
+    db.session.commit()
+
+    assert deferred.apply_networking(workers=2)
+    db.session.close()
+
+    assert overlapped == [True, True]
+    assert applied == expected
+    assert model.NetworkingAction.query \
+        .filter_by(status='DONE').count() == 6
+    assert not deferred.apply_networking(workers=2)
+
+
+def _queue_mock_actions(label, network, count):
+    """Queue ``count`` modify_port actions on a new mock switch.
+
+    Returns the switch.
+    """
+    from hil.ext.switches.mock import MockSwitch
+    switch = MockSwitch(label=label,
+                        hostname='http://example.com',
+                        username='admin',
+                        password='admin')
+    for i in range(count):
+        nic = new_nic(str(i))
+        nic.port = model.Port(label='gi1/0/%d' % i, switch=switch)
+        db.session.add(model.NetworkingAction(nic=nic,
+                                              new_network=network,
+                                              channel='vlan/native',
+                                              type='modify_port',
+                                              uuid=str(uuid.uuid4()),
+                                              status='PENDING'))
+    db.session.commit()
+    return switch
+
+
+def test_apply_networking_batched(mock_switch_ext, network, fresh_database,
+                                  monkeypatch):
+    """Check that apply_networking claims actions in batches."""
+    from hil.ext.switches.mock import MockSwitch
+
+    seen = []
+
+    def modify_port(self, port, channel, new_network):
+        """Record the statuses visible to other database sessions."""
+        local_db = new_db()
+        statuses = [action.status for action in local_db.session
+                    .query(model.NetworkingAction)
+                    .order_by(model.NetworkingAction.id)]
+        local_db.session.commit()
+        local_db.session.close()
+        seen.append(statuses)
+
+    monkeypatch.setattr(MockSwitch, 'modify_port', modify_port)
+
+    _queue_mock_actions('sw-' + str(uuid.uuid4()), network, 5)
+
+    assert deferred.apply_networking(batch_size=2)
+    db.session.close()
+
+    # Each batch is claimed (and committed) before any of its actions are
+    # applied, and the results are committed when the next batch is claimed:
+    claimed = ['IN_PROGRESS'] * 2
+    assert seen == [
+        claimed + ['PENDING'] * 3,
+        claimed + ['PENDING'] * 3,
+        ['DONE'] * 2 + claimed + ['PENDING'],
+        ['DONE'] * 2 + claimed + ['PENDING'],
+        ['DONE'] * 4 + ['IN_PROGRESS'],
+    ]
+    assert model.NetworkingAction.query \
+        .filter_by(status='DONE').count() == 5
+
+
+def test_release_claims(mock_switch_ext, network, fresh_database):
+    """Check that release_claims returns stale unfinished actions to the
+    journal, leaving recent claims (which another daemon may still be
+    applying) alone.
+
+    Also check that the API treats claimed actions as pending.
+    """
+    _queue_mock_actions('sw-' + str(uuid.uuid4()), network, 3)
+    actions = model.NetworkingAction.query \
+        .order_by(model.NetworkingAction.id).all()
+    now = datetime.utcnow()
+    for action, age in zip(actions, [7200, 60]):
+        action.status = 'IN_PROGRESS'
+        action.started_at = now - timedelta(seconds=age)
+    db.session.commit()
+
+    action = actions[0]
+    assert action.is_pending()
+    assert json.loads(api.show_networking_action(action.uuid))['status'] \
+        == 'PENDING'
+    with pytest.raises(BlockedError):
+        api.check_pending_action(action.nic)
+
+    def statuses():
+        """Return the statuses of the actions, in order."""
+        db.session.expire_all()
+        return [action.status for action in actions]
+
+    deferred.release_claims(3600)
+    assert statuses() == ['PENDING', 'IN_PROGRESS', 'PENDING']
+    deferred.release_claims(0)
+    assert statuses() == ['PENDING', 'PENDING', 'PENDING']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_unexpected_error_releases_claims(mock_switch_ext, network,
+                                          fresh_database, monkeypatch,
+                                          workers):
+    """A switch raising something other than SwitchError doesn't leave its
+    claimed actions IN_PROGRESS.
+    """
+    from hil.ext.switches.mock import MockSwitch
+
+    def modify_port(self, port, channel, new_network):
+        """Fail unexpectedly on the first switch."""
+        if self.label == 'sw-bad':
+            raise RuntimeError('oops')
+        original(self, port, channel, new_network)
+    original = MockSwitch.modify_port
+    monkeypatch.setattr(MockSwitch, 'modify_port', modify_port)
+
+    _queue_mock_actions('sw-bad', network, 2)
+    _queue_mock_actions('sw-good', network, 2)
+    if workers == 1:
+        with pytest.raises(RuntimeError):
+            deferred.apply_networking(workers=workers, batch_size=2)
+    else:
+        assert deferred.apply_networking(workers=workers, batch_size=2)
+        db.session.expire_all()
+        statuses = [action.status for action in model.NetworkingAction.query
+                    .order_by(model.NetworkingAction.id)]
+        assert statuses == ['PENDING', 'PENDING', 'DONE', 'DONE']
+
+    # Once the switch is fixed, the actions are applied as usual:
+    monkeypatch.setattr(MockSwitch, 'modify_port', original)
+    assert deferred.apply_networking(workers=workers, batch_size=2)
+    db.session.expire_all()
+    assert model.NetworkingAction.query \
+        .filter_by(status='DONE').count() == 4
+    assert not deferred.apply_networking(workers=workers, batch_size=2)
+
+
+@pytest.mark.parametrize('error', [RuntimeError, SwitchError])
+def test_unexpected_error_discards_session(mock_switch_ext, network,
+                                           fresh_database, monkeypatch,
+                                           error):
+    """After an error which escapes the switch driver, the session is only
+    reused if the error is a SwitchError.
+    """
+    from hil.ext.switches.mock import MockSwitch
+
+    calls = []
+
+    def session(self):
+        """Record that we connected."""
+        calls.append('connect')
+        return self
+
+    def disconnect(self):
+        """Record that we disconnected."""
+        calls.append('disconnect')
+
+    def handle_action(self, action):
+        """Use the session, then fail."""
+        self.get_session(action.nic.port.owner)
+        raise error('oops')
+
+    monkeypatch.setattr(MockSwitch, 'session', session)
+    monkeypatch.setattr(MockSwitch, 'disconnect', disconnect)
+    monkeypatch.setattr(deferred.DaemonSession, 'handle_action',
+                        handle_action)
+
+    _queue_mock_actions('sw-' + str(uuid.uuid4()), network, 1)
+    pool = deferred.SessionPool(idle_timeout=3600)
+    with pytest.raises(error):
+        deferred.apply_networking(pool=pool)
+    if error is SwitchError:
+        assert calls == ['connect']
+    else:
+        assert calls == ['connect', 'disconnect']
+
+
+def _queue_port_batch(network):
+    """Queue several modify_port actions on the same nic of a mock switch.
+
+    These are the actions `api.networking_action_batch` would queue to attach
+    two networks and detach one of them (see `TestNetworkingActionBatch` in
+    ``tests/unit/api/main.py`` for the same thing through the API); they are
+    added to the journal directly, so that these tests don't depend on the
+    API's checks. Returns the label of the switch.
+    """
+    from hil.ext.switches.mock import MockSwitch
+    label = 'sw-' + str(uuid.uuid4())
+    switch = MockSwitch(label=label,
+                        hostname='http://example.com',
+                        username='admin',
+                        password='admin')
+    nic = new_nic('0')
+    nic.port = model.Port(label='gi1/0/0', switch=switch)
+    # A network may only be attached to a nic once:
+    other_network = model.Network(network.owner, [], True, '103', 'othernet')
+    for channel, new_network in [('vlan/native', network),
+                                 ('vlan/102', other_network),
+                                 ('vlan/102', None)]:
+        db.session.add(model.NetworkingAction(nic=nic,
+                                              new_network=new_network,
+                                              channel=channel,
+                                              type='modify_port',
+                                              uuid=str(uuid.uuid4()),
+                                              status='PENDING'))
+    db.session.commit()
+    return label
+
+
+def test_apply_networking_coalesces(mock_switch_ext, network, fresh_database,
+                                    monkeypatch):
+    """Check that actions on the same port are handed to the switch at once."""
+    from hil.ext.switches.mock import MockSwitch, LOCAL_STATE
+
+    batches = []
+
+    def apply_port_batch(self, port, changes):
+        """Record the batch, then apply it as usual."""
+        batches.append((port, changes))
+        for channel, new_network in changes:
+            self.modify_port(port, channel, new_network)
+
+    monkeypatch.setattr(MockSwitch, 'apply_port_batch', apply_port_batch)
+
+    label = _queue_port_batch(network)
+    assert deferred.apply_networking(batch_size=10)
+
+    assert batches == [('gi1/0/0', [('vlan/native', '102'),
+                                    ('vlan/102', '103'),
+                                    ('vlan/102', None)])]
+    assert dict(LOCAL_STATE[label]['gi1/0/0']) == {'vlan/native': '102'}
+    assert model.NetworkingAction.query \
+        .filter_by(status='DONE').count() == 3
+    attachments = model.NetworkAttachment.query.all()
+    assert [a.channel for a in attachments] == ['vlan/native']
+
+
+def test_apply_networking_batch_fallback(mock_switch_ext, network,
+                                         fresh_database, monkeypatch):
+    """If a batch fails, its actions should be retried one at a time."""
+    from hil.ext.switches.mock import MockSwitch
+
+    def apply_port_batch(self, port, changes):
+        """Always fail."""
+        raise SwitchError('batch failed')
+
+    def modify_port(self, port, channel, new_network):
+        """Fail for trunked vlans only."""
+        if channel != 'vlan/native':
+            raise SwitchError('modify_port failed')
+
+    monkeypatch.setattr(MockSwitch, 'apply_port_batch', apply_port_batch)
+    monkeypatch.setattr(MockSwitch, 'modify_port', modify_port)
+
+    _queue_port_batch(network)
+    assert deferred.apply_networking(batch_size=10)
+
+    statuses = [action.status for action in model.NetworkingAction.query
+                .order_by(model.NetworkingAction.id)]
+    assert statuses == ['DONE', 'ERROR', 'ERROR']
+
+
+def test_session_pool(mock_switch_ext, network, fresh_database, monkeypatch):
+    """Check that the session pool reuses, checks and expires sessions."""
+    from hil.ext.switches.mock import MockSwitch
+
+    calls = []
+    alive = [True]
+
+    def session(self):
+        """Record that we connected."""
+        calls.append('connect')
+        return self
+
+    def disconnect(self):
+        """Record that we disconnected."""
+        calls.append('disconnect')
+
+    def is_alive(self):
+        """Report whether the session is alive, according to the test."""
+        return alive[0]
+
+    def modify_port(self, port, channel, new_network):
+        """Fail if asked to modify a trunked vlan."""
+        if channel != 'vlan/native':
+            raise SwitchError('modify_port failed')
+
+    for name, method in [('session', session),
+                         ('disconnect', disconnect),
+                         ('is_alive', is_alive),
+                         ('modify_port', modify_port)]:
+        monkeypatch.setattr(MockSwitch, name, method)
+
+    def queue_action(channel='vlan/native'):
+        """Queue an action on a new nic, on the switch."""
+        nic = new_nic(str(uuid.uuid4()))
+        nic.port = model.Port(label='gi1/0/%d' % model.Port.query.count(),
+                              switch=MockSwitch.query.one())
+        db.session.add(model.NetworkingAction(nic=nic,
+                                              new_network=network,
+                                              channel=channel,
+                                              type='modify_port',
+                                              uuid=str(uuid.uuid4()),
+                                              status='PENDING'))
+        db.session.commit()
+
+    _queue_mock_actions('sw-' + str(uuid.uuid4()), network, 1)
+    pool = deferred.SessionPool(idle_timeout=3600)
+
+    # The session is kept open across calls to apply_networking:
+    assert deferred.apply_networking(pool=pool)
+    queue_action()
+    assert deferred.apply_networking(pool=pool)
+    assert calls == ['connect']
+
+    # ...unless it is no longer alive:
+    alive[0] = False
+    queue_action()
+    assert deferred.apply_networking(pool=pool)
+    assert calls == ['connect', 'disconnect', 'connect']
+    alive[0] = True
+
+    # ...or the switch reports an error:
+    queue_action('vlan/102')
+    assert deferred.apply_networking(pool=pool)
+    assert calls == ['connect', 'disconnect', 'connect', 'disconnect']
+    queue_action()
+    assert deferred.apply_networking(pool=pool)
+    assert calls == ['connect', 'disconnect', 'connect', 'disconnect',
+                     'connect']
+
+    # Idle sessions are closed once they time out:
+    pool.expire()
+    assert calls[-1] == 'connect'
+    pool.idle_timeout = 0
+    pool.expire()
+    assert calls[-1] == 'disconnect'
+
+
+def test_session_pool_deferred_save():
+    """Sessions with unsaved changes should be kept open until they save."""
+
+    class FakeSession(object):
+        """A session which saves only when told that a save is due."""
+
+        def __init__(self):
+            self.unsaved = True
+            self.due = False
+            self.connected = True
+
+        def has_unsaved_changes(self):
+            """Implement has_unsaved_changes."""
+            return self.unsaved
+
+        def save_if_due(self, force=False):
+            """Implement save_if_due."""
+            if self.due or force:
+                self.unsaved = False
+
+        def disconnect(self):
+            """Save any changes, and disconnect."""
+            self.save_if_due(force=True)
+            self.connected = False
+
+    class FakeSwitch(object):
+        """Just enough of a switch for the pool."""
+        id = 1
+        label = 'fake'
+
+    pool = deferred.SessionPool()
+    session = FakeSession()
+    pool.checkin(1, deferred._PooledSession(FakeSwitch(), session))
+
+    # Not due yet, so the session stays open, despite the idle timeout:
+    pool.expire()
+    assert session.connected and session.unsaved
+
+    session.due = True
+    pool.expire()
+    assert not session.connected and not session.unsaved
+
+    # Closing the pool forces a save:
+    session = FakeSession()
+    pool.checkin(1, deferred._PooledSession(FakeSwitch(), session))
+    assert session.connected
+    pool.close()
+    assert not session.connected and not session.unsaved
+
+
+def test_apply_networking_closes_pool(mock_switch_ext, network,
+                                      fresh_database, monkeypatch):
+    """Without a pool, sessions with unsaved changes are closed anyway."""
+    from hil.ext.switches.mock import MockSwitch
+
+    calls = []
+
+    def session(self):
+        """Record that we connected."""
+        calls.append('connect')
+        return self
+
+    def disconnect(self):
+        """Record that we disconnected."""
+        calls.append('disconnect')
+
+    def has_unsaved_changes(self):
+        """Report unsaved changes until we disconnect."""
+        return calls[-1] != 'disconnect'
+
+    for name, method in [('session', session),
+                         ('disconnect', disconnect),
+                         ('has_unsaved_changes', has_unsaved_changes)]:
+        monkeypatch.setattr(MockSwitch, name, method)
+
+    _queue_mock_actions('sw-' + str(uuid.uuid4()), network, 1)
+    assert deferred.apply_networking()
+    assert calls == ['connect', 'disconnect']
+
+
+def test_session_pool_unsaved_lost(mock_switch_ext, network, fresh_database,
+                                   monkeypatch):
+    """Changes which a dead session couldn't save are saved on reconnect."""
+    from hil.ext.switches.mock import MockSwitch
+
+    calls = []
+    state = {'alive': True, 'unsaved': False}
+
+    def session(self):
+        """Record that we connected."""
+        calls.append('connect')
+        state['alive'] = True
+        return self
+
+    def disconnect(self):
+        """Save any changes and disconnect, unless the session is dead."""
+        calls.append('disconnect')
+        if not state['alive']:
+            raise SwitchError('connection lost')
+        state['unsaved'] = False
+
+    def save_running_config(self):
+        """Record that we saved."""
+        calls.append('save')
+        state['unsaved'] = False
+
+    def modify_port(self, port, channel, new_network):
+        """Leave the change unsaved."""
+        state['unsaved'] = True
+
+    for name, method in [
+            ('session', session),
+            ('disconnect', disconnect),
+            ('save_running_config', save_running_config),
+            ('modify_port', modify_port),
+            ('is_alive', lambda self: state['alive']),
+            ('has_unsaved_changes', lambda self: state['unsaved'])]:
+        monkeypatch.setattr(MockSwitch, name, method)
+
+    label = 'sw-' + str(uuid.uuid4())
+    _queue_mock_actions(label, network, 1)
+    pool = deferred.SessionPool(idle_timeout=3600)
+    assert deferred.apply_networking(pool=pool)
+    assert calls == ['connect']
+
+    # The session dies before it can save:
+    state['alive'] = False
+    db.session.add(model.NetworkingAction(nic=model.Nic.query.one(),
+                                          new_network=None,
+                                          channel='vlan/native',
+                                          type='modify_port',
+                                          uuid=str(uuid.uuid4()),
+                                          status='PENDING'))
+    db.session.commit()
+    assert deferred.apply_networking(pool=pool)
+    assert calls == ['connect', 'disconnect', 'connect', 'save']
+    assert deferred.unsaved_changes_lost.value((label,)) == 1
+
+    # The new session saves as usual when it's closed:
+    pool.close()
+    assert calls[-1] == 'disconnect'
+    assert not state['unsaved']
+    assert deferred.unsaved_changes_lost.value((label,)) == 1
+
+
+@pytest.mark.parametrize('batch_size', [1, 2])
+def test_apply_networking_metrics(mock_switch_ext, network, fresh_database,
+                                  batch_size):
+    """Check that actions are timestamped, and that metrics are recorded."""
+    label = 'sw-' + str(uuid.uuid4())
+    _queue_mock_actions(label, network, 3)
+
+    assert deferred.apply_networking(batch_size=batch_size)
+    db.session.close()
+
+    actions = model.NetworkingAction.query.all()
+    assert len(actions) == 3
+    for action in actions:
+        assert action.created_at <= action.started_at <= action.finished_at
+    assert deferred.actions_total.value((label, 'modify_port', 'DONE')) == 3
+    assert deferred.action_latency.count((label,)) == 3
+    assert deferred.action_wait.count((label,)) == 3
+    assert deferred.switch_operation_duration.count((label, 'connect')) == 1
+    assert deferred.switch_operation_duration.count(
+        (label, 'modify_port')) == 3
+    assert deferred.switch_errors.value((label, 'connect')) == 0
+
+    # The depth is measured before the actions are applied:
+    assert deferred.journal_depth.value(('PENDING',)) == 3
+    assert not deferred.apply_networking(batch_size=batch_size)
+    assert deferred.journal_depth.value(('PENDING',)) == 0
@@ -1,18 +1,23 @@
 """Test the database auth backend."""
-from hil import api, model, config, errors
+from hil import api, auth, model, config, errors
 from hil.test_common import config_testsuite, config_merge, fresh_database, \
-    ModelTest, fail_on_log_warnings, server_init
+    ModelTest, fail_on_log_warnings, server_init, QueryCounter
 from hil.flaskapp import app
 from hil.model import db
 from hil.rest import init_auth, local
+from itsdangerous import TimestampSigner
 import flask
 import pytest
+import time
 import unittest
 import json
 
 fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
 server_init = pytest.fixture(server_init)
 
+# The tests replace flask.request with fakes; this is the real thing:
+REAL_REQUEST = flask.request
+
 
 @pytest.fixture
 def dbauth():
@@ -116,6 +121,15 @@ class FakeNoAuthRequest(object):
     unauthenticated.
     """
     authorization = None
+    headers = {}
+
+
+class FakeTokenRequest(object):
+    """Fake request object, authenticated with a session token."""
+    authorization = None
+
+    def __init__(self, token):
+        self.headers = {'X-Auth-Token': token}
 
 
 @pytest.fixture
@@ -170,6 +184,13 @@ class TestListUsers(DBAuthTestCase):
             u'bob': {u'is_admin': False, u'projects': []},
             }
 
+    def test_list_users_page(self):
+        """list_users can be paginated"""
+        result = json.loads(self.dbauth.list_users(limit=1, after='alice'))
+        assert result == {
+            u'bob': {u'is_admin': False, u'projects': []},
+            }
+
 
 @use_fixtures('admin_auth')
 class TestUserCreateDelete(DBAuthTestCase):
@@ -401,3 +422,242 @@ def test_admin_noauth_fail(fn, args):
     fn = getattr(dbauth, fn)
     with pytest.raises(errors.AuthorizationError):
         fn(*args)
+
+
+@pytest.fixture
+def token_config(configure):
+    """Enable session tokens."""
+    config_merge({
+        'hil.ext.auth.database': {
+            'token_secret': 'not very secret',
+        },
+    })
+
+
+@use_fixtures('admin_auth')
+class TestCredentialCache(DBAuthTestCase):
+    """Tests for the cache of verified passwords."""
+
+    def authenticate(self, username, password):
+        """Authenticate a fake request as ``username``."""
+        flask.request = FakeAuthRequest(username, password)
+        return auth.get_auth_backend().authenticate()
+
+    def count_verifications(self, monkeypatch):
+        """Count the calls to User.verify_password.
+
+        Returns a list, which each call appends to.
+        """
+        calls = []
+        original = self.dbauth.User.verify_password
+
+        def verify_password(user, password):
+            """Count, then verify."""
+            calls.append(user.label)
+            return original(user, password)
+        monkeypatch.setattr(self.dbauth.User, 'verify_password',
+                            verify_password)
+        return calls
+
+    def test_cached(self):
+        """A verified password isn't checked again; a wrong one is."""
+        calls = self.count_verifications(self.monkeypatch)
+        for _ in range(3):
+            assert self.authenticate('bob', 'password')
+        assert calls == ['bob']
+        assert not self.authenticate('bob', 'wrong')
+        assert not self.authenticate('bob', 'wrong')
+        assert calls == ['bob'] * 3
+        assert local.auth is None
+
+    def test_password_change(self):
+        """Changing a password (in any process) stops the old one working."""
+        assert self.authenticate('bob', 'password')
+        bob = self.dbauth.User.query.filter_by(label='bob').one()
+        bob.set_password('hunter2')
+        db.session.commit()
+        assert not self.authenticate('bob', 'password')
+        assert self.authenticate('bob', 'hunter2')
+
+        # Even if this process's cache doesn't hear about it:
+        self.dbauth.credential_cache.put(
+            'bob', (self.dbauth._password_digest('hunter2'),
+                    bob.hashed_password))
+        db.session.execute(
+            self.dbauth.User.__table__.update().values(
+                hashed_password=self.dbauth.sha512_crypt.encrypt('other')))
+        db.session.commit()
+        db.session.expire_all()
+        assert not self.authenticate('bob', 'hunter2')
+
+    def test_invalidation(self):
+        """Deleting users and changing their admin status forgets them."""
+        cache = self.dbauth.credential_cache
+        assert self.authenticate('bob', 'password')
+        assert cache.get('bob') is not None
+        assert self.authenticate('alice', 'secret')
+        self.dbauth.user_set_admin('bob', True)
+        assert cache.get('bob') is None
+
+        assert self.authenticate('bob', 'password')
+        assert self.authenticate('alice', 'secret')
+        self.dbauth.user_delete('bob')
+        assert cache.get('bob') is None
+        assert cache.get('alice') is not None
+
+    def test_disabled(self):
+        """With a ttl of 0, every request is verified."""
+        config_merge({
+            'hil.ext.auth.database': {
+                'credential_cache_ttl': '0',
+            },
+        })
+        self.monkeypatch.setattr(self.dbauth, 'credential_cache',
+                                 self.dbauth._make_credential_cache())
+        calls = self.count_verifications(self.monkeypatch)
+        for _ in range(3):
+            assert self.authenticate('bob', 'password')
+        assert calls == ['bob'] * 3
+
+    @pytest.fixture(autouse=True)
+    def _monkeypatch(self, monkeypatch):
+        """Make the monkeypatch fixture available to the tests."""
+        self.monkeypatch = monkeypatch
+
+
+@use_fixtures('runway_auth')
+class TestSessionTokens(DBAuthTestCase):
+    """Tests for session tokens."""
+
+    def token_auth(self, token):
+        """Authenticate a fake request with ``token``."""
+        flask.request = FakeTokenRequest(token)
+        return auth.get_auth_backend().authenticate()
+
+    @pytest.mark.usefixtures('token_config')
+    def test_token(self):
+        """A token authenticates its user until the password changes."""
+        result = json.loads(self.dbauth.token_create())
+        assert result['expires_in'] == 3600
+        assert self.token_auth(result['token'])
+        assert local.auth.label == 'bob'
+
+        assert not self.token_auth(result['token'] + 'x')
+        assert local.auth is None
+        assert not self.token_auth('garbage')
+
+        bob = self.dbauth.User.query.filter_by(label='bob').one()
+        bob.set_password('hunter2')
+        db.session.commit()
+        assert not self.token_auth(result['token'])
+
+    @pytest.mark.usefixtures('token_config')
+    def test_expired_token(self):
+        """Tokens expire after token_ttl seconds."""
+        config_merge({
+            'hil.ext.auth.database': {
+                'token_ttl': '1',
+            },
+        })
+        token = json.loads(self.dbauth.token_create())['token']
+        assert self.token_auth(token)
+        # Skip ahead a few seconds:
+        now = int(time.time())
+        self.monkeypatch.setattr(TimestampSigner, 'get_timestamp',
+                                 lambda signer: now + 5)
+        assert not self.token_auth(token)
+
+    def test_disabled(self):
+        """Without a token_secret, tokens can't be issued or used."""
+        with pytest.raises(errors.NotFoundError):
+            self.dbauth.token_create()
+        assert not self.token_auth('anything')
+
+    @pytest.mark.usefixtures('token_config')
+    def test_token_api(self):
+        """Tokens can be obtained and used over HTTP."""
+        self.monkeypatch.setattr(flask, 'request', REAL_REQUEST)
+        client = app.test_client()
+        basic = 'Basic ' + 'bob:password'.encode('base64').strip()
+        response = client.post('/v0/auth/basic/token',
+                               headers={'Authorization': basic})
+        assert response.status_code == 200
+        token = json.loads(response.get_data())['token']
+        response = client.post('/v0/auth/basic/token',
+                               headers={'X-Auth-Token': token})
+        assert response.status_code == 200
+        response = client.post('/v0/auth/basic/token',
+                               headers={'X-Auth-Token': token + 'x'})
+        assert response.status_code == 401
+
+    @pytest.fixture(autouse=True)
+    def _monkeypatch(self, monkeypatch):
+        """Make the monkeypatch fixture available to the tests."""
+        self.monkeypatch = monkeypatch
+
+
+@use_fixtures('runway_auth')
+class TestProjectAccess(DBAuthTestCase):
+    """Tests for project access checks."""
+
+    def _attach_nodes(self, network, projects, count):
+        """Attach ``count`` new nodes to ``network``.
+
+        The nodes are spread across ``projects``.
+        """
+        start = model.Node.query.count()
+        for i in range(start, start + count):
+            node = model.Node(label='node-%d' % i,
+                              obmd_uri='http://obmd.example.com/node-%d' % i,
+                              obmd_admin_token='secret')
+            node.project = projects[i % len(projects)]
+            nic = model.Nic(node, 'eth0', '00:11:22:33:44:%02x' % i)
+            db.session.add(model.NetworkAttachment(
+                nic=nic, network=network, channel='null'))
+        db.session.commit()
+
+    def test_show_network_query_count(self):
+        """show_network doesn't reload the user's projects per attachment."""
+        bob = self.dbauth.User.query.filter_by(label='bob').one()
+        runway = model.Project.query.filter_by(label='runway').one()
+        manhattan = model.Project('manhattan')
+        bob.projects.append(manhattan)
+        others = [model.Project('other-%d' % i) for i in range(3)]
+        network = model.Network(owner=runway,
+                                access=[runway, manhattan],
+                                allocated=True,
+                                network_id='100',
+                                label='stock_int')
+        db.session.add(network)
+        self._attach_nodes(network, [manhattan] + others, 4)
+
+        # Start a fresh request, so nothing is cached in the session:
+        db.session.expire_all()
+        local.pop('auth_project_ids', None)
+        with QueryCounter() as small:
+            result = json.loads(api.show_network('stock_int'))
+        assert result['connected-nodes'].keys() == ['node-0']
+
+        self._attach_nodes(network, [manhattan] + others, 40)
+        db.session.expire_all()
+        local.pop('auth_project_ids', None)
+        with QueryCounter() as big:
+            result = json.loads(api.show_network('stock_int'))
+        assert len(result['connected-nodes']) == 11
+        assert big.count == small.count
+
+    def test_membership_changes(self):
+        """Changes to the user's projects are seen in the same request."""
+        runway = model.Project.query.filter_by(label='runway').one()
+        bob = self.dbauth.User.query.filter_by(label='bob').one()
+        local.auth = bob
+        backend = auth.get_auth_backend()
+        assert not backend.have_project_access(runway)
+        local.auth = self.dbauth.User.query.filter_by(label='alice').one()
+        self.dbauth.user_add_project('bob', 'runway')
+        local.auth = bob
+        assert backend.have_project_access(runway)
+        local.auth = self.dbauth.User.query.filter_by(label='alice').one()
+        self.dbauth.user_remove_project('bob', 'runway')
+        local.auth = bob
+        assert not backend.have_project_access(runway)
@@ -0,0 +1,160 @@
+"""Unit tests for the caches in the keystone auth backend.
+
+These don't talk to keystone; see tests/integration/keystone.py for that.
+"""
+import pytest
+
+from hil import config
+from hil.cache import TTLCache
+from hil.flaskapp import app
+from hil.model import db, Project
+from hil.test_common import config_testsuite, fresh_database, \
+    fail_on_log_warnings, QueryCounter
+
+pytest.importorskip('keystonemiddleware')
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL, without loading the keystone extension.
+
+    Loading it would wrap the app in the real keystonemiddleware.
+    """
+    config_testsuite()
+    config.load_extensions()
+
+
+pytestmark = pytest.mark.usefixtures('configure', 'fresh_database')
+
+
+@pytest.fixture
+def keystone():
+    """Fixture returning hil.ext.auth.keystone."""
+    from hil.ext.auth import keystone
+    return keystone
+
+
+class FakeKeystone(object):
+    """A stand-in for keystonemiddleware.
+
+    ``tokens`` maps valid tokens to the identities they carry. ``calls``
+    counts the requests which go through the middleware.
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.calls = 0
+
+    def factory(self, app):
+        """The middleware's filter factory."""
+        def middleware(environ, start_response):
+            """Validate the token, like keystonemiddleware does."""
+            self.calls += 1
+            identity = self.tokens.get(environ.get('HTTP_X_AUTH_TOKEN'))
+            if identity is None:
+                start_response('401 Unauthorized', [])
+                return ['']
+            environ.update(identity)
+            return app(environ, start_response)
+        return middleware
+
+
+def _app(environ, start_response):
+    """A wsgi app which reports the identity it sees."""
+    start_response('200 OK', [])
+    return ['%s %s %s' % (environ.get('HTTP_X_IDENTITY_STATUS'),
+                          environ.get('HTTP_X_PROJECT_ID'),
+                          environ.get('HTTP_X_ROLES'))]
+
+
+def _call(wsgi_app, token, **headers):
+    """Make a request to ``wsgi_app``, with ``token``.
+
+    Returns the response body, or None if the request was refused.
+    """
+    environ = {'HTTP_X_AUTH_TOKEN': token}
+    environ.update(headers)
+    status = []
+    body = wsgi_app(environ, lambda s, h: status.append(s))
+    if status != ['200 OK']:
+        return None
+    return ''.join(body)
+
+
+def test_identity_cache(keystone):
+    """Valid tokens are only validated once."""
+    fake = FakeKeystone({
+        'good': {'HTTP_X_IDENTITY_STATUS': 'Confirmed',
+                 'HTTP_X_PROJECT_ID': 'runway',
+                 'HTTP_X_ROLES': 'member'},
+        'admin': {'HTTP_X_IDENTITY_STATUS': 'Confirmed',
+                  'HTTP_X_ROLES': 'admin'},
+    })
+    cache = TTLCache(ttl=60, max_size=10)
+    wsgi_app = keystone.IdentityCache(fake.factory, _app, cache)
+
+    for _ in range(3):
+        assert _call(wsgi_app, 'good') == 'Confirmed runway member'
+    assert fake.calls == 1
+
+    # Headers sent by the client are replaced by the cached identity:
+    assert _call(wsgi_app, 'admin') == 'Confirmed None admin'
+    assert _call(wsgi_app, 'admin', HTTP_X_PROJECT_ID='runway',
+                 HTTP_X_ROLES='admin,member') == 'Confirmed None admin'
+    assert fake.calls == 2
+
+    # Bad tokens are checked every time:
+    assert _call(wsgi_app, 'bad') is None
+    assert _call(wsgi_app, 'bad') is None
+    assert fake.calls == 4
+    assert (cache.hits, cache.misses) == (3, 4)
+
+
+def test_unconfirmed_not_cached(keystone):
+    """Only confirmed identities are cached."""
+    fake = FakeKeystone({
+        'meh': {'HTTP_X_IDENTITY_STATUS': 'Invalid'},
+    })
+    wsgi_app = keystone.IdentityCache(fake.factory, _app,
+                                      TTLCache(ttl=60, max_size=10))
+    assert _call(wsgi_app, 'meh') == 'Invalid None None'
+    assert _call(wsgi_app, 'meh') == 'Invalid None None'
+    assert fake.calls == 2
+
+
+def test_project_cache(keystone, monkeypatch):
+    """Registered projects are only looked up once."""
+    monkeypatch.setattr(keystone, 'project_cache',
+                        TTLCache(ttl=60, max_size=10))
+    db.session.add(Project('runway'))
+    db.session.commit()
+    backend = keystone.KeystoneAuthBackend()
+
+    def authenticate(project):
+        """Authenticate a request from a member of ``project``."""
+        with app.test_request_context(environ_overrides={
+                'HTTP_X_IDENTITY_STATUS': 'Confirmed',
+                'HTTP_X_PROJECT_ID': project,
+                'HTTP_X_ROLES': 'member'}):
+            return backend.authenticate()
+
+    with QueryCounter() as counter:
+        assert authenticate('runway')
+        assert authenticate('runway')
+        assert not authenticate('manhattan')
+        assert not authenticate('manhattan')
+    assert counter.count == 3
+    assert (keystone.project_cache.hits, keystone.project_cache.misses) \
+        == (1, 3)
+
+
+def test_make_caches(keystone):
+    """The caches are configured from hil.cfg."""
+    options = dict(keystone._CACHE_OPTIONS)
+    options['project_cache_ttl'] = '0'
+    identity, project = keystone._make_caches(options)
+    assert identity.enabled and identity.ttl == 60
+    assert not project.enabled
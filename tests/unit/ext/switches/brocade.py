@@ -1,9 +1,11 @@
 """Tests for the brocade switch driver"""
 
 import pytest
+import requests
 import requests_mock
 
 from hil import model, config
+from hil.errors import SwitchError
 from hil.test_common import fail_on_log_warnings, config_testsuite, \
  config_merge
 
@@ -201,6 +203,8 @@ class TestBrocade(object):
                         ('vlan/4025', '4025'),
                         ('vlan/4050', '4050')]
             }
+            # The native vlan and the trunked vlans are read in one request:
+            assert mock.call_count == 3
 
     def test_get_mode(self, switch):
         """Test the _get_mode helper method"""
@@ -215,6 +219,44 @@ class TestBrocade(object):
             response = switch._get_mode(INTERFACE1)
             assert response == 'trunk'
 
+    def test_http_session(self, switch):
+        """Requests to the switch should share one configured http session."""
+        config_merge({
+            'hil.ext.switches.brocade': {
+                'http_timeout': '7.5',
+                'http_retries': '3',
+            },
+        })
+        with requests_mock.mock() as mock:
+            mock.get(switch._construct_url(INTERFACE1, suffix='mode'),
+                     text=MODE_RESPONSE_TRUNK)
+            switch._get_mode(INTERFACE1)
+            http = switch._http
+            switch._get_mode(INTERFACE1)
+            assert switch._http is http
+            assert mock.call_count == 2
+            assert mock.request_history[0].timeout == 7.5
+
+        adapter = http.get_adapter('http://example.com')
+        assert adapter.max_retries.total == 3
+
+        # Disconnecting closes the http session; the next request opens a
+        # new one:
+        switch.disconnect()
+        assert switch._http is not http
+
+    def test_http_timeout(self, switch):
+        """Requests which time out should raise SwitchError, and forget what
+        we knew about the switch's ports."""
+        switch._port_state(INTERFACE1)['mode'] = 'trunk'
+        with requests_mock.mock() as mock:
+            mock.get(switch._construct_url(INTERFACE1, suffix='mode'),
+                     exc=requests.exceptions.ReadTimeout)
+            with pytest.raises(SwitchError):
+                switch._request('GET', switch._construct_url(INTERFACE1,
+                                                             suffix='mode'))
+        assert switch._port_state(INTERFACE1) == {}
+
     def test_modify_port(self, switch, nic, network):
         """Test the modify_port method"""
         # Create a port on the switch and connect it to the nic
@@ -0,0 +1,162 @@
+"""Unit tests for hil/ext/switches/_console.py"""
+
+import pytest
+
+from hil import config
+from hil.test_common import config_testsuite, config_merge, \
+    fail_on_log_warnings
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+
+@pytest.fixture
+def fake_session():
+    """Return a console session class which counts how often it saves.
+
+    This is defined in a fixture, since importing the driver at module
+    scope would load it for every test.
+    """
+    from hil.ext.switches import _console
+
+    class FakeSession(_console.Session):
+        """A console session which just counts how often it saves."""
+
+        def __init__(self):
+            self.saves = 0
+
+        def save_running_config(self):
+            self.saves += 1
+
+        def enter_if_prompt(self, interface):
+            pass
+
+        def exit_if_prompt(self):
+            pass
+
+        def enable_vlan(self, vlan_id):
+            pass
+
+        def disable_vlan(self, vlan_id):
+            pass
+
+        def set_native(self, old, new):
+            pass
+
+        def disable_native(self, vlan_id):
+            pass
+
+        def disable_port(self):
+            pass
+
+    return FakeSession
+
+
+@pytest.fixture
+def configure(fake_session):
+    """Configure HIL, with a save policy for the fake session."""
+    config_testsuite()
+    config_merge({
+        fake_session.__module__: {
+            'save_min_interval': '100',
+            'save_quiet_period': '10',
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replace the clock used by _console with one the test controls."""
+    from hil.ext.switches import _console
+    now = [1000.0]
+    monkeypatch.setattr(_console, 'time', lambda: now[0])
+    return now
+
+
+pytestmark = pytest.mark.usefixtures('configure')
+
+
+def test_save_if_due(fake_session, clock):
+    """Check that save_if_due follows the save policy."""
+    session = fake_session()
+
+    # Nothing to save yet:
+    assert not session.has_unsaved_changes()
+    session.save_if_due()
+    assert session.saves == 0
+
+    # The first save happens once the session has been quiet for a while:
+    session._changed()
+    assert session.has_unsaved_changes()
+    clock[0] += 5
+    session.save_if_due()
+    assert session.saves == 0
+    clock[0] += 5
+    session.save_if_due()
+    assert session.saves == 1
+    assert not session.has_unsaved_changes()
+
+    # After that, saves are at least save_min_interval apart, even if the
+    # session is quiet:
+    session._changed()
+    clock[0] += 50
+    session.save_if_due()
+    assert session.saves == 1
+    clock[0] += 50
+    session.save_if_due()
+    assert session.saves == 2
+
+    # ...and a busy session still saves once it has had unsaved changes for
+    # save_min_interval:
+    for _ in range(20):
+        clock[0] += 5
+        session._changed()
+        session.save_if_due()
+    assert session.saves == 2
+    clock[0] += 5
+    session._changed()
+    session.save_if_due()
+    assert session.saves == 3
+
+    # Forcing a save ignores the policy:
+    session._changed()
+    session.save_if_due(force=True)
+    assert session.saves == 4
+    session.save_if_due(force=True)
+    assert session.saves == 4
+
+
+def test_save_disabled(fake_session, clock):
+    """If saving is disabled, there are never any unsaved changes."""
+    config_merge({fake_session.__module__: {'save': 'False'}})
+    session = fake_session()
+    session._changed()
+    assert not session.has_unsaved_changes()
+    session.save_if_due(force=True)
+    assert session.saves == 0
+
+
+@pytest.mark.parametrize('responds', [True, False])
+def test_is_alive(fake_session, responds):
+    """A prompt left over from earlier isn't mistaken for a response."""
+    import pexpect
+    import time
+
+    # A "switch" which prints its prompt, and then either answers each line
+    # with another prompt, or hangs:
+    script = 'printf "switch# "; '
+    if responds:
+        script += 'while read line; do printf "switch# "; done'
+    else:
+        script += 'exec sleep 30'
+    session = fake_session()
+    session.switch = 'fake'
+    session.main_prompt = 'switch# '
+    session._alive_timeout = 1
+    session.console = pexpect.spawn('sh', ['-c', script])
+    try:
+        # Let the first prompt arrive, unread:
+        time.sleep(0.5)
+        assert session.is_alive() == responds
+    finally:
+        session.console.terminate(force=True)
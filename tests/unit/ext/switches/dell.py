@@ -0,0 +1,85 @@
+"""Unit tests for hil/ext/switches/_dell_base.py"""
+
+import pytest
+
+from hil import config, model
+from hil.test_common import config_testsuite, fail_on_log_warnings
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+RUNNING_CONFIG = """
+vlan database
+vlan 23,52-53,2000
+exit
+hostname console
+interface gi1/0/3
+switchport mode trunk
+switchport trunk native vlan 23
+switchport trunk allowed vlan add 23,52-53
+exit
+interface gi1/0/7
+switchport mode trunk
+switchport trunk allowed vlan add 52-53
+switchport trunk allowed vlan remove 53
+exit
+interface Gi1/0/8
+switchport mode trunk
+switchport trunk native vlan 2000
+switchport trunk allowed vlan add 2000
+exit
+interface gi1/0/9
+description "not managed by HIL"
+exit
+"""
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config.load_extensions()
+
+
+pytestmark = pytest.mark.usefixtures('configure')
+
+
+def test_parse_running_config():
+    """Check that the interface sections of a running config are parsed."""
+    from hil.ext.switches._dell_base import _parse_running_config
+    assert _parse_running_config(RUNNING_CONFIG) == {
+        'gi1/0/3': ('23', set(['23', '52', '53'])),
+        'gi1/0/7': (None, set(['52'])),
+        'gi1/0/8': ('2000', set(['2000'])),
+    }
+
+
+def test_snapshot():
+    """Check that snapshot reads the running config only once."""
+    from hil.ext.switches.n3000 import DellN3000, _DellN3000Session
+
+    class FakeSession(_DellN3000Session):
+        """A session which returns a canned running config."""
+
+        def __init__(self, switch):
+            # pylint: disable=super-init-not-called
+            self.switch = switch
+            self.dummy_vlan = switch.dummy_vlan
+            self.configs_read = 0
+
+        def get_config(self, config_type):
+            assert config_type == 'running'
+            self.configs_read += 1
+            return RUNNING_CONFIG
+
+    switch = DellN3000(label='sw0', dummy_vlan='2000')
+    session = FakeSession(switch)
+    ports = [model.Port(label=label, switch=switch)
+             for label in ('gi1/0/3', 'gi1/0/7', 'gi1/0/8', 'gi1/0/9')]
+    assert session.snapshot(ports) == {
+        'gi1/0/3': {'vlan/native': '23', 'vlan/52': '52', 'vlan/53': '53'},
+        'gi1/0/7': {'vlan/52': '52'},
+        # The dummy vlan doesn't count:
+        'gi1/0/8': {},
+        'gi1/0/9': {},
+    }
+    assert session.configs_read == 1
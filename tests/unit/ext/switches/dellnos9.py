@@ -173,3 +173,170 @@ def test_get_vlans():
         ('vlan/12', '12'), ('vlan/13', '13')]
     # just in case if the switch returns a 2 vlan range.
     assert switch._get_vlans('10-11') == [('vlan/10', '10'), ('vlan/11', '11')]
+
+
+def test_apply_port_batch():
+    """Check that trunk changes in a batch are sent in a single request."""
+    from hil.ext.switches.dellnos9 import DellNOS9, CONFIG
+
+    class MockDellNOS9(DellNOS9):
+        """Records the commands that would be sent to the switch."""
+
+        commands = []
+
+        def _execute(self, command_type, command):
+            self.commands.append((command_type, command))
+
+        def _is_port_on(self, port):
+            return True
+
+    switch = MockDellNOS9(interface_type='GigabitEthernet')
+    switch.apply_port_batch('1/3', [('vlan/41', '41'),
+                                    ('vlan/42', '42'),
+                                    ('vlan/43', '43'),
+                                    ('vlan/42', None)])
+    assert switch.commands == [
+        (CONFIG, 'interface vlan 42\r\n no tagged GigabitEthernet 1/3\r\n '
+                 'interface vlan 41\r\n tagged GigabitEthernet 1/3\r\n '
+                 'interface vlan 43\r\n tagged GigabitEthernet 1/3'),
+    ]
+
+
+def test_port_state_cache():
+    """Check that the switchport state is only read from the switch once."""
+    from hil.ext.switches.dellnos9 import DellNOS9
+    from hil.errors import SwitchError
+
+    class MockDellNOS9(DellNOS9):
+        """Counts the reads, and records the writes, that would be made."""
+
+        reads = []
+        writes = []
+
+        def _read_is_port_on(self, port):
+            self.reads.append('on')
+            return True
+
+        def _get_port_info(self, interface):
+            self.reads.append('info')
+            return 'Vlanmembership:\r\nQVlans\r\nU1512\r\nT1511,1612-1613' \
+                '\r\n\r\nNativeVlanId:1512.'
+
+        def _execute(self, command_type, command):
+            self.writes.append(command)
+
+        def _make_request(self, method, url, data=None,
+                          acceptable_error_codes=()):
+            self.writes.append(method)
+
+    switch = MockDellNOS9(hostname='http://example.com',
+                          interface_type='GigabitEthernet')
+    switch.revert_port('1/3')
+    assert switch.reads == ['on', 'info']
+    assert switch.writes == [
+        'interface vlan 1511\r\n no tagged GigabitEthernet 1/3\r\n '
+        'interface vlan 1612\r\n no tagged GigabitEthernet 1/3\r\n '
+        'interface vlan 1613\r\n no tagged GigabitEthernet 1/3\r\n ',
+        'interface vlan 1512\r\n no untagged GigabitEthernet 1/3',
+        'PUT',
+    ]
+
+    # Writes update the cache, rather than invalidating it:
+    assert switch._get_vlans('1/3') == []
+    assert switch._get_native_vlan('1/3') is None
+    # Turning the port back on means we have to look at it again:
+    switch._set_native_vlan('1/3', '1512')
+    switch._add_vlan_to_trunk('1/3', '1511')
+    assert switch.reads == ['on', 'info']
+    assert switch._get_native_vlan('1/3') == ('vlan/native', '1512')
+    assert switch._get_vlans('1/3') == [('vlan/1511', '1511'),
+                                        ('vlan/1612', '1612'),
+                                        ('vlan/1613', '1613')]
+    assert switch.reads == ['on', 'info', 'info']
+
+    # ...but a failed request does:
+    def _fail(*args, **kwargs):
+        raise SwitchError('oops')
+    switch._http.request = _fail
+    with pytest.raises(SwitchError):
+        switch._request('GET', 'http://example.com')
+    assert switch._get_vlans('1/3')
+    assert switch.reads == ['on', 'info', 'info', 'on', 'info']
+
+
+def test_snapshot(monkeypatch):
+    """Check that snapshot reads every port with one command, and one
+    request for the ports' shutdown state.
+
+    Ports which the switch doesn't have are logged and left out.
+    """
+    from hil.ext.switches import dellnos9
+    from hil.ext.switches.dellnos9 import DellNOS9, SHOW
+
+    class Response(object):
+        """Stands in for a `requests` response."""
+
+        def __init__(self, text):
+            self.text = text
+
+    class MockDellNOS9(DellNOS9):
+        """Returns canned output for ``show interfaces switchport``, and
+        for the list of interfaces.
+        """
+
+        commands = []
+        requests = []
+
+        def _execute(self, command_type, command):
+            self.commands.append((command_type, command))
+            return Response(
+                u"<output><command>show interfaces switchport\r\n\r\n"
+                u"Codes: U-Untagged T-Tagged\r\n\r\n"
+                u"Name: GigabitEthernet 1/3\r\n"
+                u"802.1QTagged: Hybrid\r\nVlan membership:\r\nQ Vlans\r\n"
+                u"U 1512\r\nT 1511,1612-1613\r\n\r\n"
+                u"Native Vlan Id: 1512.\r\n\r\n"
+                u"Name: GigabitEthernet 1/4\r\n"
+                u"802.1QTagged: Hybrid\r\nVlan membership:\r\nQ Vlans\r\n"
+                u"U 1\r\n\r\nNative Vlan Id: 1.\r\n\r\n"
+                u"MOC-Dell-S3048-ON#</command>\n</output>\n")
+
+        def _make_request(self, method, url, data=None,
+                          acceptable_error_codes=()):
+            self.requests.append((method, url))
+            return Response(
+                "<interfaces xmlns='http://www.dell.com/ns/dell:0.1/root'>"
+                "<interface><name>gige-1-3</name>"
+                "<shutdown>false</shutdown></interface>"
+                "<interface><name>gige-1-4</name>"
+                "<shutdown>true</shutdown></interface>"
+                "<interface><name>gige-1-5</name>"
+                "<shutdown>false</shutdown></interface>"
+                "<interface><name>vlan-1512</name>"
+                "<shutdown>false</shutdown></interface>"
+                "</interfaces>")
+
+    logged = []
+    monkeypatch.setattr(dellnos9.logger, 'warn',
+                        lambda *args: logged.append(args[1:]))
+    switch = MockDellNOS9(label='s3048',
+                          hostname='http://example.com',
+                          interface_type='GigabitEthernet')
+    ports = [model.Port(label=label, switch=switch)
+             for label in ('1/3', '1/4', '1/5', '1/6')]
+    assert switch.snapshot(ports) == {
+        '1/3': {'vlan/native': '1512',
+                'vlan/1511': '1511',
+                'vlan/1612': '1612',
+                'vlan/1613': '1613'},
+        # shut down:
+        '1/4': {},
+        # not a switchport:
+        '1/5': {},
+    }
+    assert switch.commands == [(SHOW, 'interfaces switchport')]
+    assert switch.requests == [
+        ('GET', 'http://example.com/api/running/dell/interfaces'
+                r'\?with-defaults'),
+    ]
+    assert logged == [('s3048', '1/6')]
@@ -0,0 +1,102 @@
+"""Unit tests for hil/ext/switches/nexus.py"""
+
+import pytest
+
+from hil import config, model
+from hil.test_common import config_testsuite, fail_on_log_warnings
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+
+RUNNING_CONFIG = """show running-config interface
+
+!Command: show running-config interface
+!Time: Tue Mar 13 14:21:05 2018
+
+version 7.0(3)I4(1)
+
+interface mgmt0
+  vrf member management
+  ip address 192.168.3.20/24
+
+interface Ethernet1/3
+  switchport mode trunk
+  switchport trunk native vlan 23
+  switchport trunk allowed vlan 23,52-53
+
+interface Ethernet1/7
+  switchport mode trunk
+  switchport trunk native vlan 2000
+  switchport trunk allowed vlan 52-53,2000
+  switchport trunk allowed vlan remove 53
+
+interface Ethernet1/8
+  switchport mode trunk
+  switchport trunk native vlan 2000
+  switchport trunk allowed vlan 2000
+
+interface Ethernet1/9
+  description not managed by HIL
+"""
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config.load_extensions()
+
+
+pytestmark = pytest.mark.usefixtures('configure')
+
+
+def test_parse_running_config():
+    """Check that every interface section of a running config is parsed."""
+    from hil.ext.switches.nexus import _parse_running_config
+    assert _parse_running_config(RUNNING_CONFIG) == {
+        'mgmt0': (None, set()),
+        'ethernet1/3': ('23', set(['23', '52', '53'])),
+        'ethernet1/7': ('2000', set(['52', '2000'])),
+        'ethernet1/8': ('2000', set(['2000'])),
+        'ethernet1/9': (None, set()),
+    }
+
+
+def test_snapshot(monkeypatch):
+    """Check that snapshot reads the running config only once.
+
+    Port names are matched regardless of case, and ports which the switch
+    doesn't have are logged and left out.
+    """
+    from hil.ext.switches import nexus
+
+    class FakeSession(nexus._Session):
+        """A session which returns a canned running config."""
+
+        def __init__(self, switch):
+            # pylint: disable=super-init-not-called
+            self.switch = switch
+            self.dummy_vlan = switch.dummy_vlan
+            self.configs_read = 0
+
+        def _interface_config(self):
+            self.configs_read += 1
+            return RUNNING_CONFIG
+
+    logged = []
+    monkeypatch.setattr(nexus.logger, 'warn',
+                        lambda *args: logged.append(args[1:]))
+    switch = nexus.Nexus(label='sw0', dummy_vlan='2000')
+    session = FakeSession(switch)
+    ports = [model.Port(label=label, switch=switch)
+             for label in ('Ethernet1/3', 'ethernet1/7', 'Ethernet1/8',
+                           'Ethernet1/9', 'Ethernet1/10')]
+    assert session.snapshot(ports) == {
+        'Ethernet1/3': {'vlan/native': '23', 'vlan/52': '52',
+                        'vlan/53': '53'},
+        # The dummy vlan doesn't count:
+        'ethernet1/7': {'vlan/52': '52'},
+        'Ethernet1/8': {},
+        'Ethernet1/9': {},
+    }
+    assert session.configs_read == 1
+    assert logged == [('sw0', 'Ethernet1/10')]
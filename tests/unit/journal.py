@@ -0,0 +1,161 @@
+"""Unit tests for hil/journal.py"""
+
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from hil import api, config, errors, journal, model
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, with_request_context, server_init
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.mock': '',
+        },
+    })
+    config.load_extensions()
+
+
+pytestmark = pytest.mark.usefixtures('configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'with_request_context')
+
+DAY = 24 * 60 * 60
+
+
+def _queue_actions(statuses, batch_id=None):
+    """Add an action with each of the (status, age) pairs in ``statuses``.
+
+    Each action is on a nic of its own. ``age`` is how many seconds ago the
+    action finished, or None if it hasn't (or finished before HIL recorded
+    when actions finish). The actions are in the batch ``batch_id``, if it
+    is not None. Returns the actions' uuids.
+    """
+    node = model.Node(label='node-99',
+                      obmd_uri='http://obmd.example.com/nodes/node-99',
+                      obmd_admin_token='secret')
+    network = model.Network(None, [], True, '102', 'hammernet')
+    now = datetime.utcnow()
+    uuids = []
+    for i, (status, age) in enumerate(statuses):
+        nic = model.Nic(node, 'eth%d' % i, '00:11:22:33:44:%02d' % i)
+        action = model.NetworkingAction(nic=nic,
+                                        new_network=network,
+                                        channel='vlan/native',
+                                        type='modify_port',
+                                        uuid=str(uuid.uuid4()),
+                                        batch_id=batch_id,
+                                        status=status)
+        if age is not None:
+            action.finished_at = now - timedelta(seconds=age)
+        db.session.add(action)
+        uuids.append(action.uuid)
+    db.session.commit()
+    return uuids
+
+
+def test_compact():
+    """Only finished actions older than max_age are archived."""
+    uuids = _queue_actions([('DONE', 2 * DAY),
+                            ('ERROR', 2 * DAY),
+                            ('DONE', None),
+                            ('DONE', 60),
+                            ('PENDING', None),
+                            ('IN_PROGRESS', None)])
+    before = [json.loads(api.show_networking_action(status_id))
+              for status_id in uuids]
+
+    assert journal.compact(DAY, chunk_size=2) == (3, 0)
+    remaining = set(action.uuid for action in model.NetworkingAction.query)
+    assert remaining == set(uuids[3:])
+    archived = model.ArchivedNetworkingAction.query \
+        .order_by(model.ArchivedNetworkingAction.id).all()
+    assert [action.uuid for action in archived] == uuids[:3]
+
+    # The archived actions are still reported, just as before:
+    after = [json.loads(api.show_networking_action(status_id))
+             for status_id in uuids]
+    assert after == before
+
+    # Nothing more to do:
+    assert journal.compact(DAY) == (0, 0)
+
+
+@pytest.mark.parametrize('statuses,counts,archived', [
+    # Entirely archived:
+    ([('DONE', 2 * DAY), ('ERROR', 2 * DAY)],
+     {'PENDING': 0, 'DONE': 1, 'ERROR': 1}, 2),
+    # Partly archived:
+    ([('DONE', 2 * DAY), ('PENDING', None), ('DONE', 60)],
+     {'PENDING': 1, 'DONE': 2, 'ERROR': 0}, 1),
+])
+def test_compacted_batches(statuses, counts, archived):
+    """The multi-action status calls include archived actions."""
+    batch_id = str(uuid.uuid4())
+    uuids = _queue_actions(statuses, batch_id=batch_id)
+    before_batch = json.loads(api.show_networking_action_batch(batch_id))
+    before_actions = json.loads(api.show_networking_actions(','.join(uuids)))
+    assert before_batch['counts'] == counts
+
+    assert journal.compact(DAY) == (archived, 0)
+    assert json.loads(api.show_networking_action_batch(batch_id)) == \
+        before_batch
+    assert json.loads(api.show_networking_actions(','.join(uuids))) == \
+        before_actions
+
+
+def test_archived_actions_outlive_nodes():
+    """Archived actions don't refer to the objects they were on."""
+    status_id = _queue_actions([('DONE', 2 * DAY)])[0]
+    journal.compact(DAY)
+    nic = model.Nic.query.one()
+    db.session.delete(nic)
+    db.session.delete(nic.owner)
+    db.session.commit()
+    assert json.loads(api.show_networking_action(status_id)) == {
+        'status': 'DONE',
+        'node': 'node-99',
+        'nic': 'eth0',
+        'type': 'modify_port',
+        'channel': 'vlan/native',
+        'new_network': 'hammernet',
+    }
+
+
+def test_archive_max_age():
+    """Archived actions are deleted once they are old enough."""
+    status_id = _queue_actions([('DONE', 2 * DAY)])[0]
+    assert journal.compact(DAY, archive_max_age=DAY) == (1, 0)
+    archived = model.ArchivedNetworkingAction.query.one()
+    archived.archived_at -= timedelta(seconds=2 * DAY)
+    db.session.commit()
+
+    assert journal.compact(DAY, archive_max_age=DAY) == (0, 1)
+    with pytest.raises(errors.NotFoundError):
+        api.show_networking_action(status_id)
+
+
+def test_configured_max_ages():
+    """The ages are read from the [network-daemon] section."""
+    assert journal.configured_max_ages() == (journal.DEFAULT_MAX_AGE, 0)
+    config_merge({
+        'network-daemon': {
+            'journal_max_age': '60',
+            'journal_archive_max_age': '3600',
+        },
+    })
+    assert journal.configured_max_ages() == (60, 3600)
@@ -0,0 +1,218 @@
+"""Unit tests for hil/layout.py"""
+
+import copy
+import json
+import pytest
+
+from hil import api, config, errors, layout, model
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, with_request_context, server_init
+
+MOCK_SWITCH_TYPE = 'http://schema.massopencloud.org/haas/v0/switches/mock'
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.mock': '',
+        },
+    })
+    config.load_extensions()
+
+
+pytestmark = pytest.mark.usefixtures('configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'with_request_context')
+
+LAYOUT = {
+    'switches': [
+        {
+            'switch': 'sw0',
+            'type': MOCK_SWITCH_TYPE,
+            'hostname': 'sw0.example.com',
+            'username': 'alice',
+            'password': 'secret',
+            'ports': ['gi1/0/10'],
+        },
+    ],
+    'nodes': [
+        {
+            'name': 'node-%d' % i,
+            'obmd': {
+                'uri': 'http://obmd.example.com/nodes/node-%d' % i,
+                'admin_token': 'secret',
+            },
+            'nics': [
+                {
+                    'name': 'eth0',
+                    'mac': 'de:ad:be:ef:20:%02d' % i,
+                    'switch': 'sw0',
+                    'port': 'gi1/0/%d' % i,
+                },
+                {
+                    'name': 'eth1',
+                    'mac': 'de:ad:be:ef:21:%02d' % i,
+                },
+            ],
+            'metadata': {'rack': 'r1'},
+        } for i in range(3)
+    ],
+}
+
+
+def _layout():
+    """Return a copy of LAYOUT, which the test may modify."""
+    return copy.deepcopy(LAYOUT)
+
+
+def _counts():
+    """Return the numbers of switches, ports, nodes and nics."""
+    return {
+        'switches': model.Switch.query.count(),
+        'ports': model.Port.query.count(),
+        'nodes': model.Node.query.count(),
+        'nics': model.Nic.query.count(),
+    }
+
+
+def test_import_layout():
+    """Everything in the layout is registered and wired up."""
+    assert layout.import_layout(_layout()) == {
+        'switches': 1, 'ports': 4, 'nodes': 3, 'nics': 6,
+    }
+    db.session.commit()
+    assert _counts() == {'switches': 1, 'ports': 4, 'nodes': 3, 'nics': 6}
+    node = json.loads(api.show_node('node-1'))
+    assert node['metadata'] == {'rack': json.dumps('r1')}
+    assert sorted((nic['label'], nic['port'], nic['switch'])
+                  for nic in node['nics']) == [
+        ('eth0', 'gi1/0/1', 'sw0'),
+        ('eth1', None, None),
+    ]
+    port = json.loads(api.show_port('sw0', 'gi1/0/10'))
+    assert port == {}
+
+
+def test_existing_switch_and_port():
+    """Nics may be wired to registered switches and unconnected ports."""
+    api.switch_register('sw0',
+                        type=MOCK_SWITCH_TYPE,
+                        hostname='sw0.example.com',
+                        username='alice',
+                        password='secret')
+    api.switch_register_port('sw0', 'gi1/0/0')
+    doc = _layout()
+    del doc['switches']
+    assert layout.import_layout(doc)['ports'] == 2
+    db.session.commit()
+    assert json.loads(api.show_port('sw0', 'gi1/0/0')) == {
+        'node': 'node-0', 'nic': 'eth0', 'networks': {},
+    }
+
+
+def test_problems_are_all_reported():
+    """Every problem is reported, and nothing is registered."""
+    api.switch_register('sw1',
+                        type=MOCK_SWITCH_TYPE,
+                        hostname='sw1.example.com',
+                        username='alice',
+                        password='secret')
+    api.switch_register_port('sw1', 'gi1/0/0')
+    api.node_register('node-9', obmd={
+        'uri': 'http://obmd.example.com/nodes/node-9',
+        'admin_token': 'secret',
+    })
+    api.node_register_nic('node-9', 'eth0', 'de:ad:be:ef:20:99')
+    api.port_connect_nic('sw1', 'gi1/0/0', 'node-9', 'eth0')
+    before = _counts()
+
+    doc = _layout()
+    doc['switches'].append(dict(doc['switches'][0], switch='sw1'))
+    doc['switches'].append({'switch': 'sw2', 'type': 'no-such-type'})
+    doc['nodes'][0]['name'] = 'node-9'
+    doc['nodes'][1]['nics'][0]['switch'] = 'sw3'
+    doc['nodes'][2]['nics'][0]['port'] = 'gi1/0/1'
+    doc['nodes'][2]['nics'][1]['switch'] = 'sw1'
+    doc['nodes'].append({'name': 'node-3'})
+    doc['nodes'].append(dict(doc['nodes'][2],
+                             nics=[{'name': 'eth0', 'mac': 'x',
+                                    'switch': 'sw1', 'port': 'gi1/0/0'}]))
+    with pytest.raises(errors.LayoutError) as excinfo:
+        layout.import_layout(doc)
+    problems = excinfo.value.problems
+    # The exact wording of this one comes from the schema library:
+    assert problems.pop(5).startswith('nodes[3]: not a valid node: ')
+    assert problems == [
+        'switches[1] (sw1): switch already exists',
+        "switches[2] (sw2): 'no-such-type' is not a valid switch type",
+        'nodes[0] (node-9): node already exists',
+        'nodes[1] (node-1) nic eth0: switch sw3 does not exist',
+        'nodes[2] (node-2) nic eth1: either both or neither of "switch" '
+        'and "port" must be given',
+        'nodes[4] (node-2): node is listed twice',
+    ]
+    assert _counts() == before
+
+
+def test_port_conflicts():
+    """Ports can only be connected to one nic."""
+    api.switch_register('sw0',
+                        type=MOCK_SWITCH_TYPE,
+                        hostname='sw0.example.com',
+                        username='alice',
+                        password='secret')
+    api.switch_register_port('sw0', 'gi1/0/0')
+    api.node_register('node-9', obmd={
+        'uri': 'http://obmd.example.com/nodes/node-9',
+        'admin_token': 'secret',
+    })
+    api.node_register_nic('node-9', 'eth0', 'de:ad:be:ef:20:99')
+    api.port_connect_nic('sw0', 'gi1/0/0', 'node-9', 'eth0')
+
+    doc = _layout()
+    del doc['switches']
+    doc['nodes'][2]['nics'][0]['port'] = 'gi1/0/1'
+    with pytest.raises(errors.LayoutError) as excinfo:
+        layout.import_layout(doc)
+    assert excinfo.value.problems == [
+        'nodes[0] (node-0) nic eth0: port gi1/0/0 on switch sw0 is already '
+        'connected to nic eth0 on node node-9',
+        'nodes[2] (node-2) nic eth0: port gi1/0/1 on switch sw0 is connected '
+        'to another nic in the layout',
+    ]
+
+
+def test_not_a_layout():
+    """Documents of the wrong shape are rejected outright."""
+    for doc in [], {'nodes': {}}:
+        with pytest.raises(errors.LayoutError):
+            layout.import_layout(doc)
+
+
+def test_layout_import_api():
+    """The API call commits the layout, and reports the problems in the
+    response body."""
+    from hil.rest import app
+    client = app.test_client()
+    response = client.post('/v0/layout', data=json.dumps(_layout()))
+    assert response.status_code == 200
+    assert json.loads(response.get_data()) == {
+        'switches': 1, 'ports': 4, 'nodes': 3, 'nics': 6,
+    }
+    assert _counts()['nodes'] == 3
+
+    response = client.post('/v0/layout', data=json.dumps(_layout()))
+    assert response.status_code == 400
+    body = json.loads(response.get_data())
+    assert body['type'] == 'LayoutError'
+    assert len(body['problems']) == 4
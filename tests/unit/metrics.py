@@ -0,0 +1,128 @@
+"""Unit tests for hil/metrics.py"""
+
+import pytest
+import urllib2
+
+from hil import config, metrics
+from hil.flaskapp import app
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, server_init
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.auth.null': '',
+        },
+    })
+    config.load_extensions()
+
+
+def test_counter():
+    """Counters are rendered one line per set of labels."""
+    counter = metrics.Counter('test_total', 'Things.', ('kind', 'colour'))
+    counter.inc(('a', 'red'))
+    counter.inc(('a', 'red'), 2)
+    counter.inc(('b', 'say "hi"'), 0.5)
+    assert counter.value(('a', 'red')) == 3
+    assert counter.samples() == [
+        'test_total{kind="a",colour="red"} 3',
+        'test_total{kind="b",colour="say \\"hi\\""} 0.5',
+    ]
+
+
+def test_histogram():
+    """Histograms have cumulative buckets, a sum and a count."""
+    histogram = metrics.Histogram('test_seconds', 'Time.', ('what',),
+                                  buckets=(0.1, 1))
+    for value in 0.05, 0.5, 0.5, 3:
+        histogram.observe(value, ('x',))
+    assert histogram.count(('x',)) == 4
+    assert histogram.samples() == [
+        'test_seconds_bucket{what="x",le="0.1"} 1',
+        'test_seconds_bucket{what="x",le="1"} 3',
+        'test_seconds_bucket{what="x",le="+Inf"} 4',
+        'test_seconds_sum{what="x"} 4.05',
+        'test_seconds_count{what="x"} 4',
+    ]
+
+
+@pytest.mark.usefixtures('configure', 'fresh_database', 'server_init')
+def test_request_metrics():
+    """API requests are counted and timed, with their queries."""
+    client = app.test_client()
+    ok = ('list_nodes', 'GET', '200')
+    missing = ('show_node', 'GET', '404')
+    before = (metrics.requests_total.value(ok),
+              metrics.requests_total.value(missing),
+              metrics.request_duration.count(('list_nodes',)),
+              metrics.auth_duration.count(('list_nodes',)),
+              metrics.db_queries.value(('list_nodes',)))
+
+    assert client.get('/v0/nodes/free').status_code == 200
+    assert client.get('/v0/node/no-such-node').status_code == 404
+
+    after = (metrics.requests_total.value(ok),
+             metrics.requests_total.value(missing),
+             metrics.request_duration.count(('list_nodes',)),
+             metrics.auth_duration.count(('list_nodes',)),
+             metrics.db_queries.value(('list_nodes',)))
+    assert [b - a for a, b in zip(before, after)][:4] == [1, 1, 1, 1]
+    assert after[4] > before[4]
+
+    response = client.get('/v0/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data()
+    assert '# TYPE hil_http_request_duration_seconds histogram\n' in body
+    assert '\nhil_http_requests_total{endpoint="show_node",method="GET",' \
+        'status="404"} ' in body
+    assert '\nhil_db_queries_total{endpoint="list_nodes"} ' in body
+
+
+def test_cache_metrics(monkeypatch):
+    """Registered caches' hits and misses are reported."""
+    from hil.cache import TTLCache
+    monkeypatch.setattr(metrics, '_caches', {})
+    cache = TTLCache(ttl=10, max_size=10)
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('b')
+    cache.get('c')
+    metrics.register_cache('test', lambda: cache)
+    body = metrics.render()
+    assert '\nhil_cache_hits_total{cache="test"} 1\n' in body
+    assert '\nhil_cache_misses_total{cache="test"} 2\n' in body
+
+
+def test_write_textfile(tmpdir):
+    """The daemon's metrics can be written to a file."""
+    counter = metrics.Counter('test_textfile_total', 'A counter.')
+    counter.inc()
+    path = str(tmpdir.join('hil.prom'))
+    metrics.write_textfile(path, [counter])
+    with open(path) as f:
+        assert f.read() == metrics.render([counter])
+    assert tmpdir.listdir() == [tmpdir.join('hil.prom')]
+
+
+def test_serve_http():
+    """The daemon's metrics can be served over HTTP."""
+    counter = metrics.Counter('test_http_total', 'A counter.')
+    counter.inc(amount=2)
+    server = metrics.serve_http('127.0.0.1', 0, [counter])
+    try:
+        response = urllib2.urlopen('http://127.0.0.1:%d/metrics'
+                                   % server.server_address[1])
+        assert response.read() == metrics.render([counter])
+        assert response.info()['Content-Type'].startswith('text/plain')
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -8,8 +8,9 @@
 # to make sure it isn't throwing an exception.
 
 from hil.model import Node, Nic, Project, Headnode, Hnic, Network, \
-    NetworkingAction, Metadata
+    NetworkingAction, Metadata, NetworkAttachment, db
 from hil import config
+from sqlalchemy.exc import IntegrityError
 
 from hil.test_common import fresh_database, config_testsuite, ModelTest, \
     fail_on_log_warnings
@@ -106,3 +107,28 @@ class TestNetworkingAction(ModelTest):
         return NetworkingAction(nic=nic,
                                 new_network=network,
                                 channel='null')
+
+
+@pytest.mark.parametrize('make_duplicate', [
+    lambda node, nic, network: Nic(node, 'eth0', '00:11:22:33:44:66'),
+    lambda node, nic, network: Metadata('EK', 'other', node),
+    lambda node, nic, network: NetworkAttachment(
+        nic=nic, network=network, channel='vlan/102'),
+    lambda node, nic, network: NetworkAttachment(
+        nic=nic, network=Network(None, [], True, '103', 'othernet'),
+        channel='vlan/native'),
+])
+def test_unique_constraints(make_duplicate):
+    """The database rejects duplicate nics, metadata and attachments."""
+    node = _test_node()
+    nic = Nic(node, 'eth0', '00:11:22:33:44:55')
+    Metadata('EK', 'pk', node)
+    network = Network(None, [], True, '102', 'hammernet')
+    db.session.add(NetworkAttachment(nic=nic, network=network,
+                                     channel='vlan/native'))
+    db.session.commit()
+
+    db.session.add(make_duplicate(node, nic, network))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
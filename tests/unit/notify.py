@@ -0,0 +1,74 @@
+"""Tests for hil/notify.py"""
+
+import time
+import uuid
+
+import pytest
+
+from hil import config, notify
+from hil.model import db, Node, Nic, NetworkingAction
+from hil.test_common import fresh_database, config_testsuite, config_merge, \
+    fail_on_log_warnings
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+
+
+@pytest.fixture
+def configure(tmpdir):
+    """Configure HIL, with a socket for notifications."""
+    config_testsuite()
+    config_merge({
+        'network-daemon': {
+            'notify_socket': str(tmpdir.join('network-daemon.sock')),
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture
+def listener(configure, fresh_database):
+    """Create a listener, and close it when we're done."""
+    listener = notify.Listener()
+    yield listener
+    listener.close()
+
+
+def _queue_action():
+    """Add a networking action to the session (without committing it)."""
+    node = Node(label='node-99',
+                obmd_uri='https://obmd.example.com/node/node-99',
+                obmd_admin_token='secret')
+    nic = Nic(node, 'eth0', '00:11:22:33:44:55')
+    db.session.add(NetworkingAction(nic=nic,
+                                    new_network=None,
+                                    channel='',
+                                    type='revert_port',
+                                    uuid=str(uuid.uuid4()),
+                                    status='PENDING'))
+
+
+def test_notify_on_commit(listener):
+    """The listener should wake up promptly when an action is committed."""
+    assert not listener.wait(0)
+
+    _queue_action()
+    db.session.flush()
+    assert not listener.wait(0)
+
+    db.session.commit()
+    start = time.time()
+    assert listener.wait(10)
+    assert time.time() - start < 1
+
+    # The notification has been consumed:
+    assert not listener.wait(0)
+
+
+def test_no_notify_on_rollback(listener):
+    """Actions which are rolled back should not wake the listener."""
+    _queue_action()
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    assert not listener.wait(0)
@@ -0,0 +1,345 @@
+"""Unit tests for hil/obmd.py, and the node_power_batch API call."""
+
+import base64
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+import urlparse
+
+import pytest
+
+from hil import api, config, errors, model, obmd, server
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, fresh_database, \
+    fail_on_log_warnings, with_request_context, server_init
+
+fail_on_log_warnings = pytest.fixture(autouse=True)(fail_on_log_warnings)
+fresh_database = pytest.fixture(fresh_database)
+server_init = pytest.fixture(server_init)
+with_request_context = pytest.yield_fixture(with_request_context)
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL"""
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.auth.null': '',
+        },
+        # We talk to a (fake) OBMd for real:
+        'devel': {
+            'dry_run': None,
+        },
+    })
+    config.load_extensions()
+
+
+@pytest.fixture(autouse=True)
+def reset_session(monkeypatch):
+    """Give each test a fresh session, so it sees its own config."""
+    monkeypatch.setattr(obmd, '_session', None)
+
+
+class _FakeObmdServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Just enough of OBMd to answer power requests.
+
+    Each node is at ``/nodes/<label>``, its admin token is ``secret``, and
+    its node token is ``token-<label>``. Every request takes ``delay`` seconds
+    to answer, and the first ``failures`` requests get a 503 response.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           _FakeObmdHandler)
+        self.delay = 0
+        self.failures = 0
+        self.power = {}
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def uri(self, label):
+        """Return the OBMd uri for node ``label``."""
+        return 'http://127.0.0.1:%d/nodes/%s' % (self.server_port, label)
+
+
+class _FakeObmdHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Request handler for `_FakeObmdServer`."""
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def _handle(self):
+        time.sleep(self.server.delay)
+        url = urlparse.urlparse(self.path)
+        _, _, label, op = url.path.split('/')
+        body = None
+        length = int(self.headers.get('Content-Length', 0))
+        if length:
+            body = json.loads(self.rfile.read(length))
+        with self.server.lock:
+            self.server.requests.append((self.command, label, op, body))
+            if self.server.failures:
+                self.server.failures -= 1
+                self._respond(503)
+                return
+        if op == 'token':
+            if self.headers.get('Authorization') != \
+                    'Basic ' + base64.b64encode('admin:secret'):
+                self._respond(401)
+            elif self.command == 'POST':
+                self._respond(200, {'token': 'token-' + label})
+            else:
+                self._respond(200)
+        elif urlparse.parse_qs(url.query).get('token') != ['token-' + label]:
+            self._respond(401)
+        elif op == 'power_status':
+            self._respond(200, {
+                'power_status': self.server.power.get(label, 'off'),
+            })
+        elif op in ('power_on', 'power_cycle'):
+            self.server.power[label] = 'on'
+            self._respond(200)
+        elif op == 'power_off':
+            self.server.power[label] = 'off'
+            self._respond(200)
+        else:
+            self._respond(404)
+
+    def _respond(self, code, body=None):
+        self.send_response(code)
+        if body is None:
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            data = json.dumps(body)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    do_GET = do_POST = do_DELETE = _handle
+
+
+@pytest.yield_fixture
+def obmd_server():
+    """Run a `_FakeObmdServer` for the duration of the test."""
+    server = _FakeObmdServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+pytestmark = pytest.mark.usefixtures('configure',
+                                     'fresh_database',
+                                     'server_init',
+                                     'with_request_context')
+
+
+def _make_nodes(server, labels, project=None, enabled=True):
+    """Register a node for each of ``labels``, on the fake OBMd ``server``.
+
+    The nodes' OBM is enabled if ``enabled`` is True. If ``project`` is not
+    None, it's the name of a project (created if needed) to put them in.
+    """
+    if project is not None:
+        project = model.Project.query.filter_by(label=project).first() or \
+            model.Project(project)
+    for label in labels:
+        node = model.Node(label=label,
+                          obmd_uri=server.uri(label),
+                          obmd_admin_token='secret')
+        if enabled:
+            node.obmd_node_token = 'token-' + label
+        node.project = project
+        db.session.add(node)
+    db.session.commit()
+
+
+def _power_batch(**kwargs):
+    """Call node_power_batch, and decode the result."""
+    return json.loads(api.node_power_batch(**kwargs))
+
+
+def test_power_batch_nodes(obmd_server):
+    """Each of the listed nodes is sent the request."""
+    _make_nodes(obmd_server, ['node-1', 'node-2', 'node-3'])
+    result = _power_batch(op='on', nodes=['node-1', 'node-3'])
+    assert result == {
+        'counts': {'ok': 2, 'failed': 0},
+        'nodes': {
+            'node-1': {'ok': True, 'status_code': 200},
+            'node-3': {'ok': True, 'status_code': 200},
+        },
+    }
+    assert sorted(obmd_server.requests) == [
+        ('POST', 'node-1', 'power_on', None),
+        ('POST', 'node-3', 'power_on', None),
+    ]
+
+    result = _power_batch(op='status', nodes=['node-1', 'node-2'])
+    assert result['nodes']['node-1']['power_status'] == 'on'
+    assert result['nodes']['node-2']['power_status'] == 'off'
+
+
+def test_power_batch_project(obmd_server):
+    """Every node in the project is sent the request, with ``force``."""
+    _make_nodes(obmd_server, ['node-1', 'node-2'], project='anvil-nextgen')
+    _make_nodes(obmd_server, ['node-3'], project='other')
+    result = _power_batch(op='cycle', project='anvil-nextgen', force=True)
+    assert result['counts'] == {'ok': 2, 'failed': 0}
+    assert sorted(obmd_server.requests) == [
+        ('POST', 'node-1', 'power_cycle', {'force': True}),
+        ('POST', 'node-2', 'power_cycle', {'force': True}),
+    ]
+
+
+def test_power_batch_partial_failure(obmd_server):
+    """Nodes which fail don't stop the others from being powered off."""
+    _make_nodes(obmd_server, ['node-1', 'node-2'])
+    _make_nodes(obmd_server, ['node-3'], enabled=False)
+    node = model.Node.query.filter_by(label='node-2').one()
+    node.obmd_node_token = 'wrong'
+    db.session.commit()
+
+    result = _power_batch(op='off', nodes=['node-1', 'node-2', 'node-3'])
+    assert result == {
+        'counts': {'ok': 1, 'failed': 2},
+        'nodes': {
+            'node-1': {'ok': True, 'status_code': 200},
+            'node-2': {'ok': False, 'status_code': 401,
+                       'error': 'OBMd returned status 401'},
+            'node-3': {'ok': False, 'status_code': None,
+                       'error': 'OBM is not enabled'},
+        },
+    }
+
+
+def test_power_batch_concurrent(obmd_server):
+    """The requests are made concurrently."""
+    labels = ['node-%d' % i for i in range(8)]
+    _make_nodes(obmd_server, labels)
+    obmd_server.delay = 0.5
+    start = time.time()
+    result = _power_batch(op='on', nodes=labels)
+    elapsed = time.time() - start
+    assert result['counts'] == {'ok': 8, 'failed': 0}
+    # One after another, this would take 4 seconds:
+    assert elapsed < 2
+
+
+def test_power_batch_timeout(obmd_server):
+    """Requests which take too long fail, without holding up the call."""
+    config_merge({'obmd': {'request_timeout': '0.2'}})
+    _make_nodes(obmd_server, ['node-1'])
+    obmd_server.delay = 2
+    start = time.time()
+    result = _power_batch(op='status', nodes=['node-1'])
+    assert time.time() - start < 1
+    assert result['nodes']['node-1'] == {
+        'ok': False,
+        'status_code': None,
+        'error': 'OBMd timed out',
+    }
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'op': 'on'},
+    {'op': 'on', 'nodes': ['node-1'], 'project': 'anvil-nextgen'},
+    {'op': 'on', 'nodes': ['node-1'], 'force': True},
+])
+def test_power_batch_bad_arguments(obmd_server, kwargs):
+    """Exactly one of nodes or project, and force only for cycle."""
+    _make_nodes(obmd_server, ['node-1'], project='anvil-nextgen')
+    with pytest.raises(errors.BadArgumentError):
+        api.node_power_batch(**kwargs)
+    assert obmd_server.requests == []
+
+
+def test_power_batch_not_found(obmd_server):
+    """If any node doesn't exist, nothing is done."""
+    _make_nodes(obmd_server, ['node-1'])
+    with pytest.raises(errors.NotFoundError):
+        api.node_power_batch(op='off', nodes=['node-1', 'node-2'])
+    with pytest.raises(errors.NotFoundError):
+        api.node_power_batch(op='off', project='anvil-nextgen')
+    assert obmd_server.requests == []
+
+
+def test_power_batch_retries(obmd_server):
+    """Requests which get a 503 are retried."""
+    config_merge({'obmd': {'retry_backoff': '0.01'}})
+    _make_nodes(obmd_server, ['node-1'])
+    obmd_server.failures = 2
+    result = _power_batch(op='status', nodes=['node-1'])
+    assert result['nodes']['node-1'] == {
+        'ok': True,
+        'status_code': 200,
+        'power_status': 'off',
+    }
+    assert len(obmd_server.requests) == 3
+
+
+def test_enable_disable_obm(obmd_server):
+    """Node tokens are fetched and invalidated with the admin token."""
+    _make_nodes(obmd_server, ['node-1'], enabled=False)
+    node = model.Node.query.one()
+    node.enable_obm()
+    assert node.obmd_node_token == 'token-node-1'
+    node.disable_obm()
+    assert node.obmd_node_token is None
+
+    node.obmd_admin_token = 'wrong'
+    with pytest.raises(errors.OBMError):
+        node.enable_obm()
+
+
+def test_obmd_unreachable(obmd_server):
+    """Failing to contact OBMd is an OBMError."""
+    config_merge({'obmd': {'request_retries': '0'}})
+    _make_nodes(obmd_server, ['node-1'], enabled=False)
+    obmd_server.shutdown()
+    obmd_server.server_close()
+    with pytest.raises(errors.OBMError):
+        model.Node.query.one().enable_obm()
+
+
+def test_stop_orphan_consoles(obmd_server, monkeypatch):
+    """Every node's token is invalidated, concurrently."""
+    labels = ['node-%d' % i for i in range(8)]
+    _make_nodes(obmd_server, labels)
+    _make_nodes(obmd_server, ['node-bad'])
+    node = model.Node.query.filter_by(label='node-bad').one()
+    node.obmd_admin_token = 'wrong'
+    db.session.commit()
+    logged = []
+    monkeypatch.setattr(server.logger, 'error',
+                        lambda *args: logged.append(args[1:]))
+
+    obmd_server.delay = 0.5
+    start = time.time()
+    server.stop_orphan_consoles()
+    # One after another, this would take 4.5 seconds:
+    assert time.time() - start < 2
+
+    db.session.expire_all()
+    tokens = dict((node.label, node.obmd_node_token)
+                  for node in model.Node.query)
+    assert tokens == dict([(label, None) for label in labels] +
+                          [('node-bad', 'token-node-bad')])
+    assert logged == [('node-bad', 'OBMd returned status 401')]
+
+
+def test_session_pool_size():
+    """The session keeps a connection per worker open to each server."""
+    config_merge({'obmd': {'bulk_workers': '4'}})
+    adapter = obmd.session().get_adapter('http://obmd.example.com/')
+    assert adapter._pool_maxsize == 4
+    assert obmd.session() is obmd.session()
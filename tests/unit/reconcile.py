@@ -0,0 +1,209 @@
+"""Unit tests for hil/reconcile.py"""
+
+import pytest
+import tempfile
+
+from hil import config, deferred, model, reconcile
+from hil.errors import SwitchError
+from hil.model import db
+from hil.test_common import config_testsuite, config_merge, fresh_database
+
+fresh_database = pytest.fixture(fresh_database)
+
+
+@pytest.fixture
+def configure():
+    """Configure HIL.
+
+    The switches are read from worker threads, each of which has its own
+    database connection, so if the configuration specifies an in-memory
+    sqlite database, we use a temporary file instead.
+    """
+    config_testsuite()
+    config_merge({
+        'extensions': {
+            'hil.ext.switches.mock': '',
+        },
+    })
+    uri = config.cfg.get('database', 'uri')
+    if uri == 'sqlite:///:memory:':
+        with tempfile.NamedTemporaryFile() as temp_db:
+            config_merge({
+                'database': {
+                    'uri': 'sqlite:///' + temp_db.name,
+                },
+            })
+            config.load_extensions()
+            yield
+    else:
+        config.load_extensions()
+        yield
+
+
+pytestmark = pytest.mark.usefixtures('configure', 'fresh_database')
+
+
+@pytest.fixture
+def switches():
+    """Create two mock switches, with a few ports each.
+
+    Every port but the last on each switch has a nic. In the database, the
+    nics on the first ports are attached to network 100 (as their native
+    network) and 101; the nics on the second ports aren't attached to
+    anything.
+
+    The switches start out agreeing with the database.
+    """
+    from hil.ext.switches.mock import MockSwitch, LOCAL_STATE
+    project = model.Project('anvil-nextgen')
+    networks = [model.Network(project, [project], True, str(i), 'net-%d' % i)
+                for i in (100, 101, 102)]
+    result = []
+    for label in ('sw0', 'sw1'):
+        switch = MockSwitch(label=label,
+                            hostname='http://example.com',
+                            username='admin',
+                            password='admin')
+        for i in range(3):
+            port = model.Port(label='gi1/0/%d' % i, switch=switch)
+            if i == 2:
+                continue
+            node = model.Node(label='%s-node-%d' % (label, i),
+                              obmd_uri='http://obmd.example.com/nodes/x',
+                              obmd_admin_token='secret')
+            nic = model.Nic(node, 'eth0', '00:11:22:33:44:55')
+            nic.port = port
+            if i == 0:
+                db.session.add(model.NetworkAttachment(
+                    nic=nic, network=networks[0], channel='vlan/native'))
+                db.session.add(model.NetworkAttachment(
+                    nic=nic, network=networks[1], channel='vlan/101'))
+        LOCAL_STATE[label].clear()
+        LOCAL_STATE[label]['gi1/0/0'] = {'vlan/native': '100',
+                                         'vlan/101': '101'}
+        result.append(switch)
+    db.session.commit()
+    yield result
+    for switch in result:
+        del LOCAL_STATE[switch.label]
+
+
+def test_no_drift(switches):
+    """If the switches agree with the database, nothing is reported."""
+    assert reconcile.find_drift() == ([], [])
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_find_drift(switches, workers):
+    """Differences in either direction are reported, per port."""
+    from hil.ext.switches.mock import LOCAL_STATE
+    LOCAL_STATE['sw0']['gi1/0/0'] = {'vlan/native': '102'}
+    LOCAL_STATE['sw1']['gi1/0/1'] = {'vlan/102': '102'}
+    LOCAL_STATE['sw1']['gi1/0/2'] = {'vlan/101': '101'}
+
+    drift, failed = reconcile.find_drift(workers=workers)
+    assert failed == []
+    assert [(d.switch, d.port, d.missing, d.extra) for d in drift] == [
+        ('sw0', 'gi1/0/0',
+         set([('vlan/native', '100'), ('vlan/101', '101')]),
+         set([('vlan/native', '102')])),
+        ('sw1', 'gi1/0/1', set(), set([('vlan/102', '102')])),
+        ('sw1', 'gi1/0/2', set(), set([('vlan/101', '101')])),
+    ]
+    # The port with no nic can't be fixed:
+    assert drift[2].nic_id is None
+
+
+def test_unreadable_switch(switches, monkeypatch):
+    """A switch which can't be read is reported, and its ports skipped."""
+    from hil.ext.switches.mock import MockSwitch, LOCAL_STATE
+    LOCAL_STATE['sw0']['gi1/0/1'] = {'vlan/102': '102'}
+
+    def snapshot(self, ports):
+        """Fail to read sw1."""
+        if self.label == 'sw1':
+            raise SwitchError('oops')
+        return original(self, ports)
+    original = MockSwitch.snapshot
+    monkeypatch.setattr(MockSwitch, 'snapshot', snapshot)
+
+    drift, failed = reconcile.find_drift()
+    assert failed == ['sw1']
+    assert [(d.switch, d.port) for d in drift] == [('sw0', 'gi1/0/1')]
+
+
+def test_missing_port(switches, monkeypatch):
+    """A port which the snapshot leaves out isn't reported as drift."""
+    from hil.ext.switches.mock import MockSwitch, LOCAL_STATE
+    LOCAL_STATE['sw0']['gi1/0/1'] = {'vlan/102': '102'}
+
+    def snapshot(self, ports):
+        """Leave out sw0's gi1/0/0."""
+        result = original(self, ports)
+        if self.label == 'sw0':
+            del result['gi1/0/0']
+        return result
+    original = MockSwitch.snapshot
+    monkeypatch.setattr(MockSwitch, 'snapshot', snapshot)
+
+    drift, failed = reconcile.find_drift()
+    assert failed == []
+    assert ('sw0', 'gi1/0/0') not in [(d.switch, d.port) for d in drift]
+    assert ('sw0', 'gi1/0/1') in [(d.switch, d.port) for d in drift]
+
+
+def test_find_drift_closes_pool(switches, monkeypatch):
+    """Without a pool, sessions with unsaved changes are closed anyway."""
+    from hil.ext.switches.mock import MockSwitch
+
+    disconnected = []
+    monkeypatch.setattr(MockSwitch, 'disconnect',
+                        lambda self: disconnected.append(self.label))
+    monkeypatch.setattr(MockSwitch, 'has_unsaved_changes',
+                        lambda self: self.label not in disconnected)
+
+    reconcile.find_drift()
+    assert sorted(disconnected) == ['sw0', 'sw1']
+
+
+def test_fix_drift(switches):
+    """fix_drift queues one action per nic, until the drift is gone."""
+    from hil.ext.switches.mock import LOCAL_STATE
+    LOCAL_STATE['sw0']['gi1/0/0'] = {'vlan/native': '102', 'vlan/102': '102'}
+    LOCAL_STATE['sw1']['gi1/0/1'] = {'vlan/102': '102'}
+
+    for _ in range(5):
+        drift, _ = reconcile.reconcile(fix=True)
+        if not drift:
+            break
+        # Only one action per nic may be pending:
+        pending = model.NetworkingAction.query.filter_by(status='PENDING')
+        nic_ids = [action.nic_id for action in pending]
+        assert len(nic_ids) == len(set(nic_ids))
+        while deferred.apply_networking():
+            pass
+    assert not drift
+
+    assert LOCAL_STATE['sw0']['gi1/0/0'] == {'vlan/native': '100',
+                                             'vlan/101': '101'}
+    assert LOCAL_STATE['sw1']['gi1/0/1'] == {}
+    # Re-applying attachments doesn't duplicate them:
+    assert model.NetworkAttachment.query.count() == 4
+
+
+def test_fix_skips_busy_nics(switches):
+    """Nics which already have a pending action are left alone."""
+    from hil.ext.switches.mock import LOCAL_STATE
+    LOCAL_STATE['sw1']['gi1/0/1'] = {'vlan/102': '102'}
+    nic = model.Port.query.filter_by(label='gi1/0/1').join(model.Switch) \
+        .filter(model.Switch.label == 'sw1').one().nic
+    db.session.add(model.NetworkingAction(type='revert_port',
+                                          nic=nic,
+                                          channel='',
+                                          uuid='some-uuid',
+                                          status='PENDING'))
+    db.session.commit()
+
+    drift, _ = reconcile.find_drift()
+    assert len(drift) == 1
+    assert reconcile.fix_drift(drift) == []